@@ -0,0 +1,83 @@
+"""
+Token use and latency of the answer generation strategies, with a local stand-in for OpenAI.
+
+The same sequence of utterances is answered with every strategy of `AnswerStrategies`. After
+each short answer the agent waits a random time before the next utterance, and asks for the
+long answer on a share of the utterances; the on-demand strategy otherwise only generates it
+once the agent was idle for `--idle-sec` seconds.
+
+Usage:
+    python -m benchmarks.answer_strategies [--utterances 20] [--ask-share 0.2]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeOpenAI
+from benchmarks.pipeline import SCRIPT
+from src import llm
+from src.constants import AnswerStrategies
+from src.generation import AnswerGenerator, AnswerStats, summarize_answer_stats
+
+
+def run_strategy(args, strategy: AnswerStrategies) -> list[AnswerStats]:
+    rng = np.random.default_rng(0)
+    executor = ThreadPoolExecutor(max_workers=4)
+    generator = AnswerGenerator(executor.submit, strategy, args.idle_sec)
+    everything = []
+    answers = None
+    for i in range(args.utterances):
+        if answers:
+            answers.cancel()
+        answers = generator.answer(f"{SCRIPT[i % len(SCRIPT)]} ({i})", [], lambda *_: None)
+        everything.append(answers)
+        answers.short.result()
+        if rng.random() < args.ask_share:
+            answers.request_long()
+        time.sleep(rng.uniform(args.min_gap_sec, args.max_gap_sec))
+    answers.cancel()
+    for answers in everything:
+        if not answers.long.cancelled():
+            answers.long.exception()
+    executor.shutdown()
+    return [answers.stats for answers in everything]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--utterances", type=int, default=20)
+    parser.add_argument("--ask-share", type=float, default=0.2)
+    parser.add_argument("--idle-sec", type=float, default=1.5)
+    parser.add_argument("--min-gap-sec", type=float, default=0.3)
+    parser.add_argument("--max-gap-sec", type=float, default=2.0)
+    parser.add_argument("--llm-latency", type=float, default=0.25)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    args = parser.parse_args()
+
+    openai = FakeOpenAI(args.llm_latency, args.tokens_per_sec, args.answer_tokens)
+    stats = []
+    with mock.patch.object(llm, "client", openai):
+        for strategy in AnswerStrategies:
+            llm.answer_cache.clear()
+            stats += run_strategy(args, strategy)
+
+    print(
+        f"{'strategy':>9} {'requests':>9} {'prompt':>8} {'completion':>11} {'long':>6} "
+        f"{'short p50':>10} {'long p50':>9}"
+    )
+    for strategy, summary in summarize_answer_stats(stats).items():
+        long_p50 = summary["long_latency_p50"]
+        print(
+            f"{strategy:>9} {summary['requests']:>9.2f} {summary['prompt_tokens']:>8.0f} "
+            f"{summary['completion_tokens']:>11.0f} {summary['long_answer_share']:>6.0%} "
+            f"{summary['short_latency_p50']:>10.3f} "
+            f"{long_p50 if long_p50 is not None else float('nan'):>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
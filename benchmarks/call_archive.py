@@ -0,0 +1,99 @@
+"""
+Write throughput and lookup latency of the call archive.
+
+Fills a fresh archive with synthetic calls whose utterances are drawn from a Zipf-distributed
+vocabulary, each with a short and a long answer, then looks up utterances said before with a word
+added or dropped (which should reuse the earlier answer) and new utterances (which should not).
+Reports the write rate, and the latency percentiles and hit rate of both kinds of lookups and
+of full-text searches.
+
+Usage:
+    python -m benchmarks.call_archive [--calls 100000] [--utterances 5] [--lookups 1000]
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from src.archive import CallArchive
+
+
+def utterance(rng: random.Random, vocabulary: list[str], cum_weights: list[float]) -> str:
+    return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(6, 16)))
+
+
+def paraphrase(rng: random.Random, text: str, vocabulary: list[str]) -> str:
+    words = text.split()
+    if rng.random() < 0.5:
+        del words[rng.randrange(len(words))]
+    else:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(vocabulary))
+    return ' '.join(words)
+
+
+def percentiles(latencies: list[float]) -> str:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return f"p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--utterances", type=int, default=5)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary)))
+    calls = [
+        [utterance(rng, vocabulary, cum_weights) for _ in range(args.utterances)]
+        for _ in range(args.calls)
+    ]
+    said = rng.sample([text for call in calls for text in call], args.lookups)
+    with tempfile.TemporaryDirectory() as directory:
+        archive = CallArchive(os.path.join(directory, "calls.db"))
+
+        started_at = time.perf_counter()
+        for call, texts in enumerate(calls):
+            call_id = archive.start_call(f"call-{call}")
+            for text in texts:
+                utterance_id = archive.add_utterance(call_id, text)
+                archive.add_suggestion(utterance_id, True, f"short answer to {text}")
+                archive.add_suggestion(utterance_id, False, f"long answer to {text}")
+        queued_sec = time.perf_counter() - started_at
+        archive.flush()
+        written_sec = time.perf_counter() - started_at
+        print(
+            f"{args.calls * args.utterances} utterances queued in {queued_sec:.1f} sec, "
+            f"committed at {archive.written / written_sec:.0f} writes/sec"
+        )
+
+        for kind, queries in (
+            ("repeated", [paraphrase(rng, text, vocabulary) for text in said]),
+            ("new", [utterance(rng, vocabulary, cum_weights) for _ in range(args.lookups)]),
+        ):
+            latencies = []
+            hits = 0
+            for query in queries:
+                started_at = time.perf_counter()
+                hits += archive.lookup(query) is not None
+                latencies.append(time.perf_counter() - started_at)
+            print(f"lookup {kind:>8}: {hits / len(queries):6.1%} hits, {percentiles(latencies)}")
+
+        latencies = []
+        for text in said:
+            started_at = time.perf_counter()
+            archive.search(' '.join(rng.sample(text.split(), 2)))
+            latencies.append(time.perf_counter() - started_at)
+        print(f"search {'':>8}:{'':>13}{percentiles(latencies)}")
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
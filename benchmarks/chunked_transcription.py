@@ -0,0 +1,107 @@
+"""
+Speedup of chunked prerecorded transcription with a local stand-in for Deepgram.
+
+A synthetic call with a pause between every sentence is written to a WAV file and transcribed
+with 1, 2, 4, ... workers. The stand-in transcriber takes a fixed overhead plus a time
+proportional to the chunk duration, fails a share of its first attempts, and returns the
+chunk's duration, so the stitched order can be checked against the chunk timestamps.
+
+Usage:
+    python -m benchmarks.chunked_transcription [--minutes 10] [--workers 1 2 4 8]
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from src.constants import SAMPLE_RATE
+from src.prerecorded import ChunkedTranscriber
+
+
+def synthetic_call(minutes: float, sample_rate: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    parts = []
+    while sum(map(len, parts)) < minutes * 60 * sample_rate:
+        sentence = int(rng.uniform(2, 8) * sample_rate)
+        t = np.arange(sentence) / sample_rate
+        parts.append(6000 * np.sin(2 * np.pi * rng.uniform(150, 300) * t))
+        parts.append(rng.normal(0, 30, int(rng.uniform(0.3, 1.0) * sample_rate)))
+    return np.concatenate(parts).astype(np.int16)
+
+
+class StandInTranscriber:
+    """
+    Stand-in for a Deepgram request that fails `failure_rate` of the first attempts.
+    """
+
+    def __init__(self, overhead: float, sec_per_audio_sec: float, failure_rate: float):
+        self.overhead = overhead
+        self.sec_per_audio_sec = sec_per_audio_sec
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, data: bytes) -> str:
+        samples, sample_rate = sf.read(io.BytesIO(data), dtype="int16")
+        duration = len(samples) / sample_rate
+        with self._lock:
+            self.calls += 1
+            first_attempt = data not in self._seen
+            self._seen.add(data)
+        time.sleep(self.overhead + duration * self.sec_per_audio_sec)
+        if first_attempt and random.random() < self.failure_rate:
+            with self._lock:
+                self.failures += 1
+            raise ConnectionError("stand-in failure")
+        return f"{duration:.3f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--overhead", type=float, default=0.2)
+    parser.add_argument("--sec-per-audio-sec", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "call.wav")
+        sf.write(path, synthetic_call(args.minutes, SAMPLE_RATE), SAMPLE_RATE, subtype="PCM_16")
+
+        print(
+            f"{'workers':>7} {'chunks':>7} {'retries':>8} {'sec':>7} {'speedup':>8} "
+            f"{'ordered':>8}"
+        )
+        baseline = None
+        for workers in args.workers:
+            stand_in = StandInTranscriber(
+                args.overhead, args.sec_per_audio_sec, args.failure_rate
+            )
+            transcriber = ChunkedTranscriber(stand_in, max_workers=workers)
+            started_at = time.perf_counter()
+            chunks = transcriber.transcribe_chunks(path)
+            elapsed = time.perf_counter() - started_at
+            transcriber.shutdown()
+
+            baseline = baseline or elapsed
+            ordered = all(
+                abs(float(chunk.text) - (chunk.end - chunk.start)) < 1e-3 for chunk in chunks
+            ) and all(a.end == b.start for a, b in zip(chunks, chunks[1:]))
+            print(
+                f"{workers:>7} {len(chunks):>7} {stand_in.failures:>8} {elapsed:>7.2f} "
+                f"{baseline / elapsed:>8.2f} {str(ordered):>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Suggestions and prompt tokens of a two-party call, captured mixed into one channel or as two.
+
+A synthetic call of alternating caller and agent turns is replayed through the real session,
+speech gate, live connection and LLM code, with Deepgram and OpenAI replaced by the local
+stand-ins of `benchmarks.fakes`. Captured mixed, as the microphone alone used to, every turn is
+answered, the agent's included; captured as two channels (agent on AGENT_CHANNEL, caller on
+CALLER_CHANNEL), only the caller's turns are. Reports the suggestions made, how many of them
+answered the agent, and the prompt tokens sent, then the rate at which `interleave` builds
+two-channel frames.
+
+Usage:
+    python -m benchmarks.dual_channel [--turns 20] [--speed 4]
+"""
+from unittest import mock
+import argparse
+import re
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeDeepgramClient, FakeOpenAI
+from src import connections, llm
+from src.audio import interleave
+from src.constants import AGENT_CHANNEL, CALLER_CHANNEL, FRAME_MS, SAMPLE_RATE
+from src.session import SessionManager
+
+CALLER_LINES = [
+    "my AC is blowing warm air since yesterday",
+    "is there a service fee to come out",
+    "the system is about ten years old",
+    "when can I be scheduled",
+]
+AGENT_LINES = [
+    "I'm sorry to hear that, let me take a look at the schedule for you",
+    "the diagnostic visit is eighty nine dollars and it goes toward the repair",
+    "thanks, do you know the brand of the outdoor unit",
+    "we have an opening tomorrow morning between eight and ten",
+]
+
+
+class ArraySource:
+    """
+    Audio source that replays int16 samples of shape (samples, channels) at `speed` times real
+    time.
+    """
+
+    def __init__(self, samples: np.ndarray, speed: float):
+        self.samples = samples
+        self.speed = speed
+        self.sample_rate = SAMPLE_RATE
+        self.channels = samples.shape[1]
+
+    def frames(self, is_recording):
+        frame_samples = SAMPLE_RATE * FRAME_MS // 1000
+        interval = FRAME_MS / 1000 / self.speed
+        started_at = time.perf_counter()
+        for i, start in enumerate(range(0, len(self.samples), frame_samples)):
+            if not is_recording():
+                return
+            delay = started_at + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield self.samples[start:start + frame_samples].tobytes()
+
+
+def conversation(turns: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns a call of `turns` alternating caller and agent turns, caller first, with each party
+    on its own channel over background noise, and a little of the caller leaking into the
+    microphone.
+    """
+    rng = np.random.default_rng(seed)
+    channels = [[], []]
+    for turn in range(turns):
+        speech = int(rng.uniform(1.0, 2.5) * SAMPLE_RATE)
+        pause = int(rng.uniform(0.8, 1.5) * SAMPLE_RATE)
+        t = np.arange(speech) / SAMPLE_RATE
+        pitch = rng.uniform(120, 250)
+        envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+        voice = 4000 * envelope * sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        speaker = CALLER_CHANNEL if turn % 2 == 0 else AGENT_CHANNEL
+        for channel in (AGENT_CHANNEL, CALLER_CHANNEL):
+            level = 1.0 if channel == speaker else 0.02 if channel == AGENT_CHANNEL else 0.0
+            channels[channel].append(level * voice + rng.normal(0, 40, speech))
+            channels[channel].append(rng.normal(0, 40, pause))
+    signals = np.stack([np.concatenate(signal) for signal in channels], axis=1)
+    return np.clip(signals, -32768, 32767).astype(np.int16)
+
+
+def run(args, samples: np.ndarray) -> dict:
+    script = [line for pair in zip(CALLER_LINES, AGENT_LINES) for line in pair]
+    deepgram = FakeDeepgramClient(script, args.interim_delay, args.final_delay)
+    openai = FakeOpenAI(args.llm_latency, args.tokens_per_sec, args.answer_tokens)
+    finals = []
+    suggested = []
+    lock = threading.Lock()
+
+    def on_event(session, event, payload):
+        with lock:
+            if event in ("transcript", "agent_transcript") and payload["final"]:
+                finals.append(payload["text"])
+            elif event == "suggestion":
+                suggested.append(payload["transcript"])
+
+    with mock.patch.object(connections, "_deepgram_client", deepgram), \
+            mock.patch.object(llm, "client", openai):
+        llm.answer_cache.clear()
+        llm.generation_stats.clear()
+        manager = SessionManager(auto_suggest=True, on_event=on_event)
+        session = manager.create(audio_source=ArraySource(samples, args.speed))
+        session.record(lambda: True)
+        deadline = time.perf_counter() + 30
+        while time.perf_counter() < deadline:
+            with lock:
+                answered = len(finals) >= args.turns and session.pending() == 0
+            if answered:
+                break
+            time.sleep(0.05)
+        manager.shutdown()
+
+    # Utterances are numbered in the order they were said, and the caller speaks first.
+    turns = [int(re.search(r"\((\d+)\)$", text).group(1)) - 1 for text in suggested]
+    stats = list(llm.generation_stats)
+    return {
+        "finals": len(finals),
+        "suggestions": len(suggested),
+        "agent_suggestions": sum(turn % 2 == 1 for turn in turns),
+        "prompt_tokens": sum(stat.prompt_tokens for stat in stats),
+    }
+
+
+def interleave_rate(seconds: float) -> float:
+    frame_samples = SAMPLE_RATE * FRAME_MS // 1000
+    frames = int(seconds * 1000 / FRAME_MS)
+    mic = np.random.default_rng(0).uniform(-1, 1, (frame_samples, 1)).astype(np.float32)
+    speaker = np.random.default_rng(1).uniform(-1, 1, (frame_samples, 2)).astype(np.float32)
+    out = np.empty((frame_samples, 2), dtype=np.int16)
+    started_at = time.perf_counter()
+    for _ in range(frames):
+        interleave([mic, speaker], out)
+    return seconds / (time.perf_counter() - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=4.0)
+    parser.add_argument("--interim-delay", type=float, default=0.05)
+    parser.add_argument("--final-delay", type=float, default=0.1)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0)
+    parser.add_argument("--answer-tokens", type=int, default=30)
+    args = parser.parse_args()
+
+    samples = conversation(args.turns)
+    mixed = samples.mean(axis=1, keepdims=True).astype(np.int16)
+    print(f"{'capture':>7} {'finals':>6} {'suggestions':>11} {'on agent':>8} {'prompt tokens':>13}")
+    for name, audio in (("mixed", mixed), ("dual", samples)):
+        result = run(args, audio)
+        print(
+            f"{name:>7} {result['finals']:>6} {result['suggestions']:>11} "
+            f"{result['agent_suggestions']:>8} {result['prompt_tokens']:>13}"
+        )
+    print(f"\ninterleaving runs {interleave_rate(10):.0f}x faster than real time")
+
+
+if __name__ == "__main__":
+    main()
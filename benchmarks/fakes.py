@@ -0,0 +1,492 @@
+"""
+Local stand-ins for Deepgram, OpenAI and the microphone, for offline benchmarks.
+
+The fakes implement just the parts of the client interfaces the pipeline uses, so the real
+`llm`, `connections`, `session` and transcript code can run unchanged against them:
+
+- `FakeDeepgramClient` opens `FakeLiveSocket`s, which segment the received audio by energy and
+  emit scripted interim and final transcripts after configurable delays.
+- `FakeOpenAI` answers chat completions, streamed or not, after a configurable latency and at a
+  configurable token rate, following the answer format the system prompt asks for.
+- `StandInBackend` is an answer and transcription backend with a heavy-tailed latency.
+- `RateLimitedBackend` is an answer backend that rejects requests over its capacity with 429s
+  and fails all of them with 503s during an outage.
+- `WavReplaySource` replays a WAV file through the capture conversion stage, faster than real
+  time if asked to.
+"""
+from types import SimpleNamespace
+from typing import Callable, Iterator, Optional
+import itertools
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+from deepgram import LiveTranscriptionEvents
+
+from src.constants import (
+    DUAL_INSTRUCTION,
+    FRAME_MS,
+    LONG_MARKER,
+    LONGER_INSTRUCTION,
+    SAMPLE_RATE,
+    SHORT_MARKER
+)
+from src.resample import AudioConverter
+
+SPEECH_RMS = 500  # RMS above which the fake ASR considers a frame speech.
+
+
+class FakeLiveSocket:
+    """
+    Stand-in for a Deepgram live WebSocket.
+
+    Audio is segmented by energy: while speech is received, an interim transcript is emitted
+    every `interim_every_sec` seconds of speech, and once `endpointing_ms` of silence (or no audio
+    at all) follows the speech, the final transcript is emitted `final_delay` seconds later.
+    Every utterance takes the next text of `script`, numbered so that answers are never cached.
+
+    Interleaved multichannel audio is downmixed, unless the socket is started with
+    `multichannel`, in which case every channel is segmented on its own and its results carry
+    its `channel_index`.
+
+    Args:
+        script (Iterator[str]): The texts of consecutive utterances.
+        interim_delay (float): The delay of an interim transcript, in seconds.
+        final_delay (float): The delay of a final transcript after the endpoint, in seconds.
+        interim_every_sec (float): The amount of speech between interim transcripts.
+        connect_delay (float): The time the socket takes to start, in seconds.
+    """
+
+    def __init__(
+        self,
+        script: Iterator[str],
+        interim_delay: float,
+        final_delay: float,
+        interim_every_sec: float = 0.5,
+        connect_delay: float = 0.0
+    ):
+        self.script = script
+        self.interim_delay = interim_delay
+        self.final_delay = final_delay
+        self.interim_every_sec = interim_every_sec
+        self.connect_delay = connect_delay
+        self.handlers = {}
+        self.sample_rate = SAMPLE_RATE
+        self.channels = 1
+        self.multichannel = False
+        self.endpointing_sec = 0.1
+        self.bytes_received = 0
+        self._connected = False
+        self._segments = []
+        self._lock = threading.Lock()
+        self._idle_timer = None
+
+    def on(self, event, handler: Callable) -> None:
+        self.handlers[event] = handler
+
+    def start(self, options) -> bool:
+        time.sleep(self.connect_delay)
+        self.sample_rate = int(options.sample_rate)
+        self.channels = int(getattr(options, "channels", 1))
+        self.multichannel = bool(getattr(options, "multichannel", False))
+        self.endpointing_sec = int(getattr(options, "endpointing", 100)) / 1000
+        self._segments = [
+            SimpleNamespace(text=None, speech_sec=0.0, silence_sec=0.0, next_interim_sec=0.0)
+            for _ in range(self.channels if self.multichannel else 1)
+        ]
+        self._connected = True
+        self._emit(LiveTranscriptionEvents.Open, open=SimpleNamespace(type="Open"))
+        return True
+
+    def send(self, data: bytes) -> bool:
+        if not self._connected:
+            return False
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        samples = samples.reshape(-1, self.channels)
+        if not self.multichannel:
+            samples = samples.mean(axis=1, keepdims=True)
+        # Messages of several frames, e.g. coalesced while the network stalled, are segmented
+        # frame by frame.
+        frame_samples = self.sample_rate * FRAME_MS // 1000
+        with self._lock:
+            self.bytes_received += len(data)
+            for start in range(0, max(1, len(samples)), frame_samples):
+                frame = samples[start:start + frame_samples]
+                duration = len(frame) / self.sample_rate
+                for channel, segment in enumerate(self._segments):
+                    signal = frame[:, channel]
+                    if len(signal) > 0 and np.sqrt(np.mean(signal * signal)) > SPEECH_RMS:
+                        self._speech(channel, segment, duration)
+                    else:
+                        self._silence(channel, segment, duration)
+            self._arm_idle_timer()
+        return True
+
+    def _speech(self, channel: int, segment: SimpleNamespace, duration: float) -> None:
+        if segment.text is None:
+            segment.text = next(self.script)
+            segment.next_interim_sec = self.interim_every_sec
+        segment.speech_sec += duration
+        segment.silence_sec = 0.0
+        if segment.speech_sec >= segment.next_interim_sec:
+            segment.next_interim_sec += self.interim_every_sec
+            words = segment.text.split()
+            shown = max(1, int(len(words) * min(1.0, segment.speech_sec / 3)))
+            self._later(self.interim_delay, channel, False, " ".join(words[:shown]))
+
+    def _silence(self, channel: int, segment: SimpleNamespace, duration: float) -> None:
+        if segment.text is None:
+            return
+        segment.silence_sec += duration
+        if segment.silence_sec >= self.endpointing_sec:
+            self._later(self.final_delay, channel, True, segment.text)
+            segment.text = None
+            segment.speech_sec = 0.0
+
+    def _arm_idle_timer(self) -> None:
+        # A gated stream stops sending audio after the speech, which Deepgram also endpoints.
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        self._idle_timer = threading.Timer(self.endpointing_sec * 2, self._on_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _on_idle(self) -> None:
+        with self._lock:
+            for channel, segment in enumerate(self._segments):
+                self._silence(channel, segment, self.endpointing_sec)
+
+    def _later(self, delay: float, channel: int, is_final: bool, text: str) -> None:
+        result = SimpleNamespace(
+            is_final=is_final,
+            channel_index=[channel, len(self._segments)],
+            channel=SimpleNamespace(alternatives=[SimpleNamespace(transcript=text)]),
+        )
+        timer = threading.Timer(
+            delay, self._emit, args=(LiveTranscriptionEvents.Transcript,), kwargs={"result": result}
+        )
+        timer.daemon = True
+        timer.start()
+
+    def _emit(self, event, **kwargs) -> None:
+        handler = self.handlers.get(event)
+        if handler and self._connected:
+            handler(self, **kwargs)
+
+    def keep_alive(self) -> bool:
+        return self._connected
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def finish(self) -> bool:
+        self._connected = False
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        return True
+
+
+class FakeDeepgramClient:
+    """
+    Stand-in for `DeepgramClient` whose live sockets are `FakeLiveSocket`s.
+
+    Args:
+        script (list[str]): The texts of the utterances, used in turn and numbered.
+        interim_delay (float): The delay of an interim transcript, in seconds.
+        final_delay (float): The delay of a final transcript after the endpoint, in seconds.
+        connect_delay (float): The time a live socket takes to start, in seconds.
+    """
+
+    def __init__(
+        self,
+        script: list[str],
+        interim_delay: float,
+        final_delay: float,
+        connect_delay: float = 0.0
+    ):
+        self.script = script
+        self.interim_delay = interim_delay
+        self.final_delay = final_delay
+        self.connect_delay = connect_delay
+        self.sockets = []
+        self.listen = SimpleNamespace(websocket=SimpleNamespace(v=self._socket))
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next_text(self) -> Iterator[str]:
+        while True:
+            with self._lock:
+                n = next(self._counter)
+            yield f"{self.script[n % len(self.script)]} ({n + 1})"
+
+    def _socket(self, version: str) -> FakeLiveSocket:
+        socket = FakeLiveSocket(
+            self._next_text(),
+            self.interim_delay,
+            self.final_delay,
+            connect_delay=self.connect_delay
+        )
+        self.sockets.append(socket)
+        return socket
+
+
+class FakeOpenAI:
+    """
+    Stand-in for the `OpenAI` client's chat completions.
+
+    Args:
+        latency (float): The time to the first token, in seconds.
+        tokens_per_sec (float): The rate at which the answer is generated.
+        answer_tokens (int): The number of tokens of a short answer; long answers have twice as
+        many.
+    """
+
+    def __init__(self, latency: float, tokens_per_sec: float, answer_tokens: int = 30):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: [])
+
+    def _tokens(self, messages: list) -> list[str]:
+        # Long answers are twice as long; dual answers hold a short and a long answer.
+        question = messages[-1]["content"]
+        short = [f"answer{i} " for i in range(self.answer_tokens - 1)] + [f"({question})"]
+        long = [f"answer{i} " for i in range(self.answer_tokens * 2 - 1)] + [f"({question})"]
+        system_prompt = messages[0]["content"]
+        if system_prompt.endswith(DUAL_INSTRUCTION):
+            return [SHORT_MARKER + " ", *short, "\n" + LONG_MARKER + " ", *long]
+        return long if system_prompt.endswith(LONGER_INSTRUCTION) else short
+
+    def _create(
+        self,
+        model: str,
+        messages: list,
+        temperature: float = 1,
+        stream: bool = False,
+        **kwargs
+    ):
+        with self._lock:
+            self.requests += 1
+        tokens = self._tokens(messages)
+        if stream:
+            return self._stream(tokens)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_sec)
+        message = SimpleNamespace(content="".join(tokens))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _stream(self, tokens: list[str]) -> Iterator[SimpleNamespace]:
+        # Tokens are paced against the start of the stream, so sleep overshoots don't add up.
+        started_at = time.perf_counter() + self.latency
+        for i, token in enumerate(tokens):
+            delay = started_at + (i + 1) / self.tokens_per_sec - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class StandInBackend:
+    """
+    Answer and transcription backend with a heavy-tailed latency, for hedging benchmarks.
+
+    The latency to the first token is log-normal around `median_sec`, and `tail_share` of the
+    requests are stalled for another `tail_sec` seconds, like a provider having a bad moment.
+
+    Args:
+        name (str): The name of the backend.
+        median_sec (float): The median latency, in seconds.
+        tail_share (float): The share of stalled requests.
+        tail_sec (float): The extra latency of a stalled request, in seconds.
+        tokens (int): The number of tokens of an answer.
+        tokens_per_sec (float): The rate at which an answer is generated.
+        seed (int, optional): The seed of the latencies.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        median_sec: float,
+        tail_share: float,
+        tail_sec: float,
+        tokens: int = 30,
+        tokens_per_sec: float = 400.0,
+        seed: Optional[int] = 0
+    ):
+        self.name = name
+        self.median_sec = median_sec
+        self.tail_share = tail_share
+        self.tail_sec = tail_sec
+        self.tokens = tokens
+        self.tokens_per_sec = tokens_per_sec
+        self.requests = 0
+        self.tokens_sent = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self) -> float:
+        with self._lock:
+            self.requests += 1
+            latency = self.median_sec * self._rng.lognormal(0, 0.25)
+            if self._rng.random() < self.tail_share:
+                latency += self.tail_sec
+        return latency
+
+    def stream(self, messages: list, temperature: float) -> Iterator[SimpleNamespace]:
+        time.sleep(self._latency())
+        for i in range(self.tokens):
+            with self._lock:
+                self.tokens_sent += 1
+            delta = SimpleNamespace(content=f"{self.name}{i} ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+            time.sleep(1 / self.tokens_per_sec)
+
+    def transcribe(self, data: bytes) -> str:
+        time.sleep(self._latency())
+        return f"transcribed by {self.name}"
+
+
+class ProviderError(Exception):
+    """An error response of a stand-in provider, with its HTTP status code."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+
+class RateLimitedBackend:
+    """
+    Answer backend with a concurrency quota and an outage, for limiter benchmarks.
+
+    At most `capacity` requests are served at once, and slower the more there are; requests over
+    it fail at once with a 429. From `outage_start` to `outage_end` seconds after creation every
+    request fails with a 503 after `median_sec`.
+
+    Args:
+        capacity (int): The number of requests served at once.
+        median_sec (float): The latency to the first token of a lone request, in seconds.
+        outage_start (float): When the outage starts, in seconds.
+        outage_end (float): When the outage ends, in seconds.
+        tokens (int): The number of tokens of an answer.
+        tokens_per_sec (float): The rate at which an answer is generated.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        median_sec: float,
+        outage_start: float = float("inf"),
+        outage_end: float = float("inf"),
+        tokens: int = 30,
+        tokens_per_sec: float = 400.0
+    ):
+        self.name = "rate-limited"
+        self.capacity = capacity
+        self.median_sec = median_sec
+        self.outage = (outage_start, outage_end)
+        self.tokens = tokens
+        self.tokens_per_sec = tokens_per_sec
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.in_flight = 0
+        self._created_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def stream(self, messages: list, temperature: float) -> Iterator[SimpleNamespace]:
+        with self._lock:
+            self.requests += 1
+            outage = self.outage[0] <= time.monotonic() - self._created_at < self.outage[1]
+            if outage:
+                self.failed += 1
+            elif self.in_flight >= self.capacity:
+                self.throttled += 1
+                raise ProviderError(429, "Rate limit reached")
+            else:
+                self.in_flight += 1
+                load = self.in_flight / self.capacity
+        if outage:
+            time.sleep(self.median_sec)
+            raise ProviderError(503, "Service unavailable")
+        try:
+            time.sleep(self.median_sec * (1 + 2 * load))
+            for i in range(self.tokens):
+                delta = SimpleNamespace(content=f"token{i} ")
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+                time.sleep(1 / self.tokens_per_sec)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class WavReplaySource:
+    """
+    Audio source that replays a WAV file in place of the microphone.
+
+    The file is read in frames of the device's native format and converted to mono SAMPLE_RATE
+    audio frame by frame, as `CaptureEngine` does. Frames are paced at `speed` times real time;
+    a speed of 0 replays as fast as possible.
+
+    Args:
+        path (str): The path of the WAV file.
+        speed (float): The replay speed relative to real time.
+        frame_ms (int): The duration of a frame. Defaults to the value of FRAME_MS.
+    """
+
+    channels = 1
+
+    def __init__(self, path: str, speed: float, frame_ms: int = FRAME_MS):
+        self.path = path
+        self.speed = speed
+        self.frame_ms = frame_ms
+        self.sample_rate = SAMPLE_RATE
+        self.frames_replayed = 0
+        info = sf.info(path)
+        self.duration = info.duration
+
+    def frames(self, is_recording: Callable[[], bool]) -> Iterator[bytes]:
+        samples, device_rate = sf.read(self.path, dtype="int16", always_2d=True)
+        converter = AudioConverter(device_rate, samples.shape[1], self.sample_rate)
+        frame_samples = int(device_rate * self.frame_ms / 1000)
+        interval = self.frame_ms / 1000 / self.speed if self.speed else 0
+        started_at = time.perf_counter()
+        for i, start in enumerate(range(0, len(samples), frame_samples)):
+            if not is_recording():
+                return
+            if interval:
+                delay = started_at + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.frames_replayed += 1
+            yield converter.process(samples[start:start + frame_samples].tobytes())
+
+
+def synthetic_call(
+    path: str,
+    utterances: int,
+    device_rate: int = 48000,
+    channels: int = 2,
+    seed: Optional[int] = 0
+) -> float:
+    """
+    Writes a synthetic call of voiced segments separated by pauses over background noise.
+
+    Returns:
+        float: The duration of the call in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [rng.normal(0, 40, int(device_rate * 0.5))]
+    for _ in range(utterances):
+        speech = int(rng.uniform(1.0, 2.5) * device_rate)
+        t = np.arange(speech) / device_rate
+        pitch = rng.uniform(120, 250)
+        envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+        voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        parts.append(4000 * envelope * voice + rng.normal(0, 40, speech))
+        parts.append(rng.normal(0, 40, int(rng.uniform(0.8, 1.5) * device_rate)))
+    signal = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+    sf.write(path, np.repeat(signal[:, None], channels, axis=1), device_rate, subtype="PCM_16")
+    return len(signal) / device_rate
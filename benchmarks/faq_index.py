@@ -0,0 +1,84 @@
+"""
+Offline benchmark of the FAQ index: precision on labelled transcripts and lookup latency.
+
+The transcripts that ask about none of the entries include near misses, which share words or
+sound with an FAQ question but must not get its answer.
+
+Usage:
+    python -m benchmarks.faq_index
+"""
+import time
+
+import numpy as np
+
+from src.faq import FAQ_INDEX
+
+# Transcripts labelled with the index of the FAQ entry they ask about, or None.
+LABELLED_TRANSCRIPTS = [
+    ("When can I be scheduled?", 0),
+    ("when could you schedule me", 0),
+    ("How soon can I get scheduled", 0),
+    ("What hours are you open?", 1),
+    ("what are your hours", 1),
+    ("What hours are you guys open", 1),
+    ("When can I speak to a live agent?", 2),
+    ("can I talk to a live person", 2),
+    ("When can we speak to a real agent", 2),
+    ("What time can you come out?", 3),
+    ("what time can someone come out", 3),
+    ("What time would you come out to the house", 3),
+    ("Is there a service fee to come out?", 4),
+    ("is there a fee for coming out", 4),
+    ("how much is the service fee", 4),
+    ("My AC is blowing warm air", None),
+    ("The system is about ten years old", None),
+    ("My name is John Smith", None),
+    ("I live at 42 Main Street", None),
+    ("You can reach me at 555 0134", None),
+    ("my email is john at example dot com", None),
+    ("The furnace keeps making a loud banging noise", None),
+    # Near misses:
+    ("what time is it", None),
+    ("when can I be there", None),
+    ("Can I speak to a manager", None),
+    ("what time is the appointment", None),
+    ("is there a fee to cancel", None),
+    ("what is the service agreement", None),
+    ("I need to speak to someone about my bill", None),
+    ("what hours does the technician work", None),
+    ("how much is the repair", None),
+]
+
+
+def main(repeats: int = 1000) -> None:
+    predictions = []
+    latencies = []
+    for transcript, _ in LABELLED_TRANSCRIPTS:
+        for _ in range(repeats):
+            started_at = time.perf_counter()
+            match = FAQ_INDEX.lookup(transcript)
+            latencies.append(time.perf_counter() - started_at)
+        predictions.append(FAQ_INDEX.entries.index(match.entry) if match else None)
+
+    labels = [label for _, label in LABELLED_TRANSCRIPTS]
+    answered = [(p, label) for p, label in zip(predictions, labels) if p is not None]
+    correct = sum(p == label for p, label in answered)
+    relevant = sum(label is not None for label in labels)
+    latencies_us = np.array(latencies) * 1e6
+
+    print(f"entries:   {len(FAQ_INDEX.entries)}")
+    precision = correct / len(answered) if answered else 0.0
+    print(f"precision: {precision:.2f} ({correct}/{len(answered)})")
+    print(f"recall:    {correct / relevant:.2f} ({correct}/{relevant})")
+    print(
+        f"latency:   p50 {np.percentile(latencies_us, 50):.1f} us, "
+        f"p95 {np.percentile(latencies_us, 95):.1f} us, "
+        f"p99 {np.percentile(latencies_us, 99):.1f} us"
+    )
+    for (transcript, label), prediction in zip(LABELLED_TRANSCRIPTS, predictions):
+        if prediction != label:
+            print(f"  mismatch: {transcript!r} expected {label}, got {prediction}")
+
+
+if __name__ == "__main__":
+    main()
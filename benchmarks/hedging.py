@@ -0,0 +1,76 @@
+"""
+Tail latency of hedged requests, with local stand-in backends.
+
+The same sequence of requests is sent to a primary stand-in backend alone, then hedged across the
+primary and an alternate backend. Both stand-ins stall a share of their requests. Reports the
+latency percentiles to the first token (answers) or to the transcript (transcription), the share
+of hedged requests and the extra work the hedges cost.
+
+Usage:
+    python -m benchmarks.hedging [--requests 200] [--tail-share 0.05]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.fakes import StandInBackend
+from src.backends import HedgedAnswerBackend, HedgedTranscriber, Hedger
+
+
+def run(args, kind: str, hedged: bool) -> dict:
+    primary = StandInBackend("primary", args.median_sec, args.tail_share, args.tail_sec, seed=1)
+    alternate = StandInBackend(
+        "alternate", args.median_sec * 1.3, args.tail_share, args.tail_sec, seed=2
+    )
+    backends = [primary, alternate] if hedged else [primary]
+    hedger = Hedger(default_delay=args.median_sec * 3, min_delay=args.median_sec)
+    latencies = []
+    for _ in range(args.requests):
+        started_at = time.perf_counter()
+        if kind == "answer":
+            stream = HedgedAnswerBackend(backends, hedger).stream([], 0)
+            next(stream)
+            latencies.append(time.perf_counter() - started_at)
+            for _ in stream:
+                pass
+        else:
+            HedgedTranscriber(backends, hedger).transcribe(b"")
+            latencies.append(time.perf_counter() - started_at)
+    time.sleep(args.tail_sec)  # lets cancelled requests finish before counting their work.
+    primary_only = primary.tokens_sent if kind == "answer" else primary.requests
+    all_work = primary_only + (alternate.tokens_sent if kind == "answer" else alternate.requests)
+    return {
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "hedged": hedger.hedged / args.requests if hedged else 0.0,
+        "extra_work": all_work / primary_only - 1,
+        "delay": hedger.delay("primary") if hedged else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--median-sec", type=float, default=0.05)
+    parser.add_argument("--tail-share", type=float, default=0.05)
+    parser.add_argument("--tail-sec", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(
+        f"{'kind':>13} {'hedged':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'hedges':>7} "
+        f"{'extra':>6} {'delay':>7}"
+    )
+    for kind in ("answer", "transcription"):
+        for hedged in (False, True):
+            result = run(args, kind, hedged)
+            print(
+                f"{kind:>13} {str(hedged):>7} {result['p50']:>7.3f} {result['p95']:>7.3f} "
+                f"{result['p99']:>7.3f} {result['hedged']:>7.1%} {result['extra_work']:>6.1%} "
+                f"{result['delay']:>7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
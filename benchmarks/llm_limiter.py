@@ -0,0 +1,110 @@
+"""
+Answer success rate and latency under rate limits and an outage, with and without the limiter.
+
+Concurrent clients send answer requests for a while to a stand-in provider that serves a limited
+number of requests at once, rejects the others with 429s, and fails every request with 503s for
+part of the run. The requests go straight to the provider, then through `LimitedAnswerBackend`.
+Reports the share of answered requests, the answers per second, the latency percentiles to the
+first token of the answered requests, the requests the provider saw and throttled, and how often
+the circuit breaker opened.
+
+Usage:
+    python -m benchmarks.llm_limiter [--clients 16] [--capacity 4] [--duration-sec 6]
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.fakes import RateLimitedBackend
+from src.limiter import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, LimitedAnswerBackend
+
+
+def run(args, limited: bool) -> dict:
+    provider = RateLimitedBackend(
+        args.capacity,
+        args.median_sec,
+        outage_start=args.duration_sec / 2,
+        outage_end=args.duration_sec / 2 + args.outage_sec,
+    )
+    backend = provider
+    if limited:
+        backend = LimitedAnswerBackend(
+            provider,
+            AdaptiveLimiter(latency_target=args.median_sec * 4),
+            CircuitBreaker(reset_sec=args.outage_sec / 4),
+            deadline_sec=args.median_sec * 20,
+        )
+    latencies = []
+    outcomes = {"answered": 0, "failed": 0, "failed_fast": 0}
+    lock = threading.Lock()
+    ends_at = time.monotonic() + args.duration_sec
+
+    def client(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.monotonic() < ends_at:
+            started_at = time.perf_counter()
+            try:
+                stream = iter(backend.stream([], 0))
+                next(stream)
+                latency = time.perf_counter() - started_at
+                for _ in stream:
+                    pass
+                outcome = "answered"
+            except CircuitOpenError:
+                outcome = "failed_fast"
+            except Exception:
+                outcome = "failed"
+            with lock:
+                outcomes[outcome] += 1
+                if outcome == "answered":
+                    latencies.append(latency)
+            time.sleep(rng.expovariate(1 / args.think_sec))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = backend.stats() if limited else {}
+    return {
+        **outcomes,
+        "answered_share": outcomes["answered"] / sum(outcomes.values()),
+        "goodput": outcomes["answered"] / args.duration_sec,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "provider_requests": provider.requests,
+        "throttled": provider.throttled,
+        "breaker_opened": stats.get("breaker_opened", 0),
+        "limit": stats.get("limit", float("nan")),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--capacity", type=int, default=4)
+    parser.add_argument("--median-sec", type=float, default=0.05)
+    parser.add_argument("--think-sec", type=float, default=0.05)
+    parser.add_argument("--duration-sec", type=float, default=6)
+    parser.add_argument("--outage-sec", type=float, default=1)
+    args = parser.parse_args()
+
+    print(
+        f"{'limited':>7} {'answered':>8} {'per sec':>7} {'p50':>6} {'p95':>6} {'failed':>6} "
+        f"{'fast':>5} {'sent':>6} {'429s':>6} {'opened':>6} {'limit':>5}"
+    )
+    for limited in (False, True):
+        result = run(args, limited)
+        print(
+            f"{str(limited):>7} {result['answered_share']:>8.1%} {result['goodput']:>7.1f} "
+            f"{result['p50']:>6.3f} {result['p95']:>6.3f} {result['failed']:>6} "
+            f"{result['failed_fast']:>5} {result['provider_requests']:>6} "
+            f"{result['throttled']:>6} {result['breaker_opened']:>6} {result['limit']:>5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Offline benchmark of the whole suggestion pipeline, with regression checks against a baseline.
+
+A synthetic call is replayed through the real session, capture conversion, voice activity
+detection, live connection, transcript and LLM code, with Deepgram and OpenAI replaced by the
+local stand-ins of `benchmarks.fakes`. Two scenarios are run:
+
+- throughput: sessions replay the call as fast as possible; reports how many times faster than
+  real time the audio path runs.
+- latency: sessions replay the call at a fixed speed; reports the time from a final transcript to
+  its suggestion, and the pipeline overhead on top of the stand-ins' configured delays.
+
+Every scenario is repeated and the median of every metric is kept. The medians are compared with
+`benchmarks/pipeline_baseline.json`, and the run fails if one of them regressed by more than the
+tolerance.
+
+Usage:
+    python -m benchmarks.pipeline [--sessions 4] [--utterances 8] [--repeat 3] [--update-baseline]
+"""
+from unittest import mock
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeDeepgramClient, FakeOpenAI, WavReplaySource, synthetic_call
+from src import connections, llm
+from src.session import SessionManager
+from src.tracing import Tracer
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "pipeline_baseline.json")
+SCRIPT = [
+    "what hours are you open",
+    "my AC is blowing warm air",
+    "is there a service fee to come out",
+    "the system is about ten years old",
+    "when can I be scheduled",
+]
+# Metrics for which a higher value is better; lower is better for all others.
+HIGHER_IS_BETTER = {"audio_realtime_factor"}
+
+
+def run_scenario(args, path: str, duration: float, speed: float) -> dict:
+    deepgram = FakeDeepgramClient(SCRIPT, args.interim_delay, args.final_delay)
+    openai = FakeOpenAI(args.llm_latency, args.tokens_per_sec, args.answer_tokens)
+    tracer = Tracer()
+    finals = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def on_event(session, event, payload):
+        now = time.perf_counter()
+        with lock:
+            if event == "transcript" and payload["final"]:
+                finals[(session.session_id, payload["text"])] = now
+            elif event == "suggestion":
+                latencies.append(now - finals[(session.session_id, payload["transcript"])])
+
+    with mock.patch.object(connections, "_deepgram_client", deepgram), \
+            mock.patch.object(llm, "client", openai):
+        llm.answer_cache.clear()
+        manager = SessionManager(auto_suggest=True, on_event=on_event, tracer=tracer)
+        sources = [WavReplaySource(path, speed) for _ in range(args.sessions)]
+        threads = [
+            threading.Thread(
+                target=manager.create(audio_source=source).record, args=(lambda: True,)
+            )
+            for source in sources
+        ]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        replay_time = time.perf_counter() - started_at
+
+        deadline = time.perf_counter() + 30
+        while time.perf_counter() < deadline:
+            with lock:
+                if len(finals) >= args.sessions * args.utterances and len(latencies) >= len(finals):
+                    break
+            time.sleep(0.01)
+        manager.shutdown()
+
+    generation_time = args.llm_latency + args.answer_tokens / args.tokens_per_sec
+    latencies = np.array(latencies) if latencies else np.array([np.nan])
+    stages = tracer.summary()
+    return {
+        "audio_realtime_factor": args.sessions * duration / replay_time,
+        "finals": len(finals),
+        "suggestions": int(np.isfinite(latencies).sum()),
+        "suggestion_latency_p50": float(np.percentile(latencies, 50)),
+        "suggestion_latency_p95": float(np.percentile(latencies, 95)),
+        "suggestion_overhead_p50": float(np.percentile(latencies, 50)) - generation_time,
+        "suggestion_overhead_p95": float(np.percentile(latencies, 95)) - generation_time,
+        "stages_p50": {stage: summary["p50"] for stage, summary in stages.items()},
+    }
+
+
+def find_regressions(metrics: dict, baseline: dict) -> list[str]:
+    tolerance = baseline.get("tolerance", 0.35)
+    slack = baseline.get("absolute_slack_sec", 0.02)
+    regressions = []
+    for name, expected in baseline["metrics"].items():
+        actual = metrics.get(name)
+        if actual is None:
+            continue
+        if name in HIGHER_IS_BETTER:
+            regressed = actual < expected * (1 - tolerance)
+        else:
+            regressed = actual > expected * (1 + tolerance) + slack
+        if regressed:
+            regressions.append(f"{name}: {actual:.4f} (baseline {expected:.4f})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--utterances", type=int, default=8)
+    parser.add_argument("--speed", type=float, default=4.0, help="replay speed of the latency run")
+    parser.add_argument("--interim-delay", type=float, default=0.15)
+    parser.add_argument("--final-delay", type=float, default=0.3)
+    parser.add_argument("--llm-latency", type=float, default=0.25)
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0)
+    parser.add_argument("--answer-tokens", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "call.wav")
+        duration = synthetic_call(path, args.utterances)
+        runs = [
+            (run_scenario(args, path, duration, 0), run_scenario(args, path, duration, args.speed))
+            for _ in range(args.repeat)
+        ]
+
+    throughput, latency = runs[len(runs) // 2]
+    metrics = {
+        "audio_realtime_factor": float(np.median(
+            [run[0]["audio_realtime_factor"] for run in runs]
+        )),
+        "suggestion_overhead_p50": float(np.median(
+            [run[1]["suggestion_overhead_p50"] for run in runs]
+        )),
+        "suggestion_overhead_p95": float(np.median(
+            [run[1]["suggestion_overhead_p95"] for run in runs]
+        )),
+    }
+    print(json.dumps({"throughput": throughput, "latency": latency, "metrics": metrics}, indent=2))
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(
+                {"tolerance": 0.35, "absolute_slack_sec": 0.02, "metrics": metrics}, file, indent=2
+            )
+            file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return
+    with open(args.baseline) as file:
+        regressions = find_regressions(metrics, json.load(file))
+    expected = args.sessions * args.utterances
+    for name, run in (("throughput", throughput), ("latency", latency)):
+        if run["suggestions"] < expected:
+            regressions.append(f"{name}: {run['suggestions']} of {expected} utterances answered")
+    if regressions:
+        print("Regressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the capture conversion stage: downmix and resampling throughput on one core.
+
+Every configuration converts synthetic speech-band audio frame by frame, as the capture engine
+does, and reports the throughput in input samples per second and as a multiple of real time. The
+alias column is the level of a tone above the output Nyquist frequency after conversion.
+
+Usage:
+    python -m benchmarks.resample [--seconds 20] [--frame-ms 20]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.constants import FRAME_MS, SAMPLE_RATE
+from src.resample import AudioConverter
+
+CONFIGURATIONS = [(48000, 1), (48000, 2), (44100, 1), (44100, 2), (16000, 2), (8000, 1)]
+
+
+def synthetic_audio(rate: int, channels: int, seconds: float, frequency: float) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    signal = 8000 * np.sin(2 * np.pi * frequency * t) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    return np.repeat(signal[:, None], channels, axis=1).astype(np.int16)
+
+
+def throughput(rate: int, channels: int, seconds: float, frame_ms: int) -> float:
+    audio = synthetic_audio(rate, channels, seconds, 440).tobytes()
+    converter = AudioConverter(rate, channels, SAMPLE_RATE)
+    frame_bytes = int(rate * frame_ms / 1000) * channels * 2
+    started_at = time.perf_counter()
+    for start in range(0, len(audio), frame_bytes):
+        converter.process(audio[start:start + frame_bytes])
+    return time.perf_counter() - started_at
+
+
+def alias_db(rate: int, frame_ms: int) -> float:
+    frequency = SAMPLE_RATE * 0.6
+    if frequency >= rate / 2:
+        return float("nan")
+    audio = synthetic_audio(rate, 1, 1, frequency).tobytes()
+    converter = AudioConverter(rate, 1, SAMPLE_RATE)
+    frame_bytes = int(rate * frame_ms / 1000) * 2
+    output = np.frombuffer(b"".join(
+        converter.process(audio[start:start + frame_bytes])
+        for start in range(0, len(audio), frame_bytes)
+    ), dtype=np.int16)[SAMPLE_RATE // 10:]
+    rms = np.sqrt(np.mean(output.astype(np.float64) ** 2))
+    return 20 * np.log10(max(rms, 1e-3) / (8000 / np.sqrt(2)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--frame-ms", type=int, default=FRAME_MS)
+    args = parser.parse_args()
+
+    print(f"converting to {SAMPLE_RATE} Hz mono in {args.frame_ms} ms frames")
+    print(f"{'input':>14} {'Msamples/s':>11} {'x realtime':>11} {'us/frame':>9} {'alias dB':>9}")
+    for rate, channels in CONFIGURATIONS:
+        elapsed = throughput(rate, channels, args.seconds, args.frame_ms)
+        frames = args.seconds * 1000 / args.frame_ms
+        print(
+            f"{f'{rate} Hz x{channels}':>14} "
+            f"{rate * channels * args.seconds / elapsed / 1e6:>11.1f} "
+            f"{args.seconds / elapsed:>11.0f} "
+            f"{elapsed / frames * 1e6:>9.1f} "
+            f"{alias_db(rate, args.frame_ms):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
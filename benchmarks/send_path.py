@@ -0,0 +1,129 @@
+"""
+Audio lost to network stalls, with capture sending inline and with the non-blocking send path.
+
+A stand-in input device produces a frame every FRAME_MS and holds at most `--device-buffer-ms`
+of audio, like a PortAudio input stream: whatever the capture loop doesn't read in time
+overflows and is lost. The captured frames go to a stand-in connection whose sends stall for
+`--stall-sec` every `--stall-every-sec`. Capture either sends every frame itself, or puts it into
+an `AudioSender` with each overflow policy. Reports the frames lost at the device and dropped by
+the sender, the share of the audio delivered, the longest time capture was blocked, the send and
+queue-to-sent latency percentiles, and the deepest the send queue got.
+
+Usage:
+    python -m benchmarks.send_path [--duration-sec 10] [--stall-sec 1.5] [--queue-frames 50]
+"""
+import argparse
+import threading
+import time
+
+from src.constants import FRAME_MS, SAMPLE_RATE, OverflowPolicies
+from src.sender import AudioSender
+from src.tracing import LatencyHistogram
+
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * 2
+
+
+class StallingConnection:
+    """
+    Connection whose sends take `latency_sec`, or block until the end of the stall during the
+    first `stall_sec` of every `stall_every_sec`.
+    """
+
+    def __init__(self, latency_sec: float, stall_sec: float, stall_every_sec: float):
+        self.latency_sec = latency_sec
+        self.stall_sec = stall_sec
+        self.stall_every_sec = stall_every_sec
+        self.bytes_received = 0
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def send(self, data: bytes) -> None:
+        into_period = (time.perf_counter() - self.started_at) % self.stall_every_sec
+        stall_left = self.stall_sec - into_period
+        time.sleep(max(stall_left, self.latency_sec))
+        with self._lock:
+            self.bytes_received += len(data)
+
+
+def capture(args, send) -> dict:
+    """
+    Reads the stand-in device in real time and hands every frame to `send`.
+    """
+    frame_sec = FRAME_MS / 1000
+    buffer_frames = args.device_buffer_ms // FRAME_MS
+    total = int(args.duration_sec / frame_sec)
+    frame = bytes(FRAME_BYTES)
+    read = lost = 0
+    blocked_sec = 0.0
+    started_at = time.perf_counter()
+    while read + lost < total:
+        produced = min(total, int((time.perf_counter() - started_at) / frame_sec))
+        waiting = produced - read - lost
+        if waiting > buffer_frames:
+            lost += waiting - buffer_frames
+        if read + lost >= produced:
+            time.sleep(max(0.0, started_at + (produced + 1) * frame_sec - time.perf_counter()))
+            continue
+        sent_at = time.perf_counter()
+        send(frame)
+        blocked_sec = max(blocked_sec, time.perf_counter() - sent_at)
+        read += 1
+    return {"total": total, "lost": lost, "blocked_sec": blocked_sec}
+
+
+def run(args, policy) -> dict:
+    connection = StallingConnection(args.latency_sec, args.stall_sec, args.stall_every_sec)
+    if policy is None:
+        latency = LatencyHistogram()
+
+        def send(frame: bytes) -> None:
+            started_at = time.perf_counter()
+            connection.send(frame)
+            latency.observe(time.perf_counter() - started_at)
+
+        result = capture(args, send)
+        stats = {"dropped": 0, "max_depth": 0, "send": latency.summary()}
+        stats["delay"] = stats["send"]
+    else:
+        sender = AudioSender(connection.send, queue_frames=args.queue_frames, policy=policy)
+        result = capture(args, sender.put)
+        sender.close(timeout=args.stall_sec * 2 + args.duration_sec)
+        stats = sender.stats()
+    return {
+        **result,
+        **stats,
+        "delivered": connection.bytes_received / FRAME_BYTES / result["total"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration-sec", type=float, default=10)
+    parser.add_argument("--latency-sec", type=float, default=0.002)
+    parser.add_argument("--stall-sec", type=float, default=1.5)
+    parser.add_argument("--stall-every-sec", type=float, default=4)
+    parser.add_argument("--device-buffer-ms", type=int, default=100)
+    parser.add_argument("--queue-frames", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{'send path':>11} {'lost':>5} {'dropped':>7} {'delivered':>9} {'blocked':>8} "
+        f"{'send p95':>8} {'delay p95':>9} {'depth':>5}"
+    )
+    for name, policy in (
+        ("inline", None),
+        ("drop oldest", OverflowPolicies.DropOldest),
+        ("coalesce", OverflowPolicies.Coalesce),
+        ("spill", OverflowPolicies.Spill),
+    ):
+        result = run(args, policy)
+        send_p95, delay_p95 = result["send"]["p95"], result["delay"]["p95"]
+        print(
+            f"{name:>11} {result['lost']:>5} {result['dropped']:>7} {result['delivered']:>9.1%} "
+            f"{result['blocked_sec'] * 1000:>6.1f}ms {send_p95 * 1000:>6.1f}ms "
+            f"{delay_p95 * 1000:>7.1f}ms {result['max_depth']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Load test of concurrent call sessions with local stand-ins for Deepgram and OpenAI.
+
+Every session replays synthetic audio faster than real time. The stand-in live connection emits
+a final transcript after every utterance, the session suggests an answer for it on the shared
+pool, and the stand-in LLM answers after a fixed latency. The reported latency is the time from
+the final transcript to the suggestion.
+
+Usage:
+    python -m benchmarks.session_load [--sessions 1 2 4 8 16 32 64] [--workers 32]
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from src.constants import FRAME_MS, SESSION_POOL_WORKERS
+from src.session import SessionManager
+
+FRAME_BYTES = 16000 * FRAME_MS // 1000 * 2
+
+
+class FakeLiveConnection:
+    """
+    Stand-in for a Deepgram live connection that finalizes an utterance every
+    `utterance_frames` frames, `asr_delay` seconds after its last frame was sent.
+    """
+
+    def __init__(self, transcript, utterance_frames: int, asr_delay: float):
+        self.transcript = transcript
+        self.utterance_frames = utterance_frames
+        self.asr_delay = asr_delay
+        self.frames = 0
+
+    def send(self, data: bytes) -> None:
+        self.frames += 1
+        if self.frames % self.utterance_frames == 0:
+            utterance = self.frames // self.utterance_frames
+            timer = threading.Timer(
+                self.asr_delay, self.transcript.push_final, args=(f"utterance {utterance}",)
+            )
+            timer.daemon = True
+            timer.start()
+
+    def is_connected(self) -> bool:
+        return True
+
+    def finish(self) -> None:
+        pass
+
+
+class ReplaySource:
+    """
+    Audio source that replays `frames` silent frames at `speed` times real time.
+    """
+
+    sample_rate = 16000
+    channels = 1
+
+    def __init__(self, frames: int, speed: float):
+        self.num_frames = frames
+        self.speed = speed
+
+    def frames(self, is_recording):
+        frame = bytes(FRAME_BYTES)
+        interval = FRAME_MS / 1000 / self.speed
+        started_at = time.perf_counter()
+        for i in range(self.num_frames):
+            if not is_recording():
+                return
+            delay = started_at + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield frame
+
+
+def run(
+    sessions: int,
+    workers: int,
+    llm_latency: float,
+    asr_delay: float,
+    utterances: int,
+    speed: float
+) -> list[float]:
+    latencies = []
+    finals = {}
+    lock = threading.Lock()
+    utterance_frames = 2000 // FRAME_MS
+
+    def on_event(session, event, payload):
+        now = time.perf_counter()
+        with lock:
+            if event == "transcript" and payload["final"]:
+                finals[(session.session_id, payload["text"])] = now
+            elif event == "suggestion":
+                latencies.append(now - finals[(session.session_id, payload["transcript"])])
+
+    def generate(text, short_answer, temperature, context):
+        time.sleep(llm_latency)
+        return f"answer to {text}"
+
+    manager = SessionManager(
+        max_workers=workers,
+        connect=lambda transcript, *_: FakeLiveConnection(
+            transcript, utterance_frames, asr_delay
+        ),
+        generate=generate,
+        on_event=on_event,
+        auto_suggest=True,
+        speculative=False,
+        vad_gating=False,
+    )
+    threads = []
+    for _ in range(sessions):
+        session = manager.create(audio_source=ReplaySource(utterances * utterance_frames, speed))
+        threads.append(threading.Thread(target=session.record, args=(lambda: True,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    deadline = time.perf_counter() + 30
+    while len(latencies) < sessions * utterances and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    manager.shutdown()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--workers", type=int, default=SESSION_POOL_WORKERS)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--asr-delay", type=float, default=0.1)
+    parser.add_argument("--utterances", type=int, default=5)
+    parser.add_argument("--speed", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'answers':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for sessions in args.sessions:
+        latencies = np.array(run(
+            sessions, args.workers, args.llm_latency, args.asr_delay, args.utterances, args.speed
+        )) * 1000
+        print(
+            f"{sessions:>8} {len(latencies):>8} {np.percentile(latencies, 50):>8.1f} "
+            f"{np.percentile(latencies, 95):>8.1f} {latencies.max():>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Startup cost of the UI: the import time of every module, and the time to the first interactive
+frame.
+
+Every measurement runs in a fresh interpreter. Each module is imported on its own, and the SDKs
+its import loaded are listed. The UI is then started with a stand-in for PySimpleGUI, whose
+window records when it is first read, i.e. when it starts handling input, and with a stand-in
+Deepgram client whose live sockets take `--connect-sec` to start. Reports the time from launching
+the interpreter to the first interactive frame, and to a connected call session.
+
+Usage:
+    python -m benchmarks.startup [--runs 5] [--connect-sec 1.0]
+"""
+import argparse
+import functools
+import importlib
+import json
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+MODULES = [
+    "src.constants",
+    "src.audio",
+    "src.connections",
+    "src.backends",
+    "src.llm",
+    "src.session",
+    "src.server",
+    "src.simple_ui",
+]
+SDKS = ["deepgram", "openai", "soundcard", "speech_recognition", "pyaudio"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StandInElement:
+    """
+    Stand-in for a PySimpleGUI element, which ignores updates.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.metadata = kwargs.get("metadata")
+
+    def update(self, *args, **kwargs) -> None:
+        pass
+
+
+class StandInWindow:
+    """
+    Stand-in for a PySimpleGUI window that records when it is first read, and closes itself once
+    the UI's call session is connected.
+    """
+
+    first_read_at = None
+    connected_at = None
+
+    def __init__(self, *args, **kwargs):
+        self.events = queue.Queue()
+
+    def write_event_value(self, event: str, value) -> None:
+        self.events.put((event, value))
+
+    def read(self) -> tuple:
+        if StandInWindow.first_read_at is None:
+            StandInWindow.first_read_at = time.time()
+        ui = sys.modules["src.simple_ui"]
+        while True:
+            if ui.SESSION is not None and ui.SESSION.is_connected():
+                StandInWindow.connected_at = time.time()
+                return "Cancel", {}
+            try:
+                event, value = self.events.get(timeout=0.005)
+            except queue.Empty:
+                continue
+            return event, {event: value}
+
+
+def install_stand_in_gui() -> None:
+    gui = types.ModuleType("PySimpleGUI")
+    gui.WIN_CLOSED = None
+    gui.Text = gui.Button = gui.Multiline = gui.Column = StandInElement
+    gui.Window = StandInWindow
+    gui.theme = lambda name: None
+    gui.theme_background_color = lambda: "#000000"
+    sys.modules["PySimpleGUI"] = gui
+
+
+def child_import(module: str) -> dict:
+    install_stand_in_gui()
+    started_at = time.perf_counter()
+    importlib.import_module(module)
+    return {
+        "import_sec": time.perf_counter() - started_at,
+        "sdks": [sdk for sdk in SDKS if sdk in sys.modules],
+    }
+
+
+def child_ui(connect_sec: float) -> dict:
+    install_stand_in_gui()
+    from src import connections  # pylint: disable=import-outside-toplevel
+
+    @functools.lru_cache(maxsize=1)
+    def deepgram_client():
+        # Imported on first use, like the real client, so the fakes don't load the SDK early.
+        from benchmarks.fakes import FakeDeepgramClient  # pylint: disable=import-outside-toplevel
+
+        return FakeDeepgramClient(["hello"], 0.1, 0.2, connect_delay=connect_sec)
+
+    connections.get_deepgram_client = deepgram_client
+    from src.simple_ui import run_ui  # pylint: disable=import-outside-toplevel
+
+    run_ui()
+    return {"first_frame": StandInWindow.first_read_at, "connected": StandInWindow.connected_at}
+
+
+def spawn(args: list[str], directory: str) -> tuple[float, dict]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")])}
+    launched_at = time.time()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", *args],
+        cwd=directory,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    return launched_at, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--connect-sec", type=float, default=1.0)
+    parser.add_argument("--child-import", help=argparse.SUPPRESS)
+    parser.add_argument("--child-ui", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_import:
+        print(json.dumps(child_import(args.child_import)))
+        return
+    if args.child_ui:
+        print(json.dumps(child_ui(args.connect_sec)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'module':<16} {'import':>9}  SDKs loaded")
+        for module in MODULES:
+            runs = [spawn(["--child-import", module], directory)[1] for _ in range(args.runs)]
+            import_sec = statistics.median(run["import_sec"] for run in runs)
+            print(f"{module:<16} {import_sec * 1000:>6.0f} ms  {', '.join(runs[-1]['sdks'])}")
+
+        first_frames, connected = [], []
+        for _ in range(args.runs):
+            launched_at, run = spawn(
+                ["--child-ui", "--connect-sec", str(args.connect_sec)], directory
+            )
+            first_frames.append(run["first_frame"] - launched_at)
+            connected.append(run["connected"] - launched_at)
+        print(
+            f"\nfirst interactive frame {statistics.median(first_frames) * 1000:.0f} ms, "
+            f"session connected {statistics.median(connected) * 1000:.0f} ms "
+            f"(medians of {args.runs} launches, sockets start in {args.connect_sec} sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Event-loop lag of the window while a long call is transcribed, with and without the renderer.
+
+A stand-in event loop handles events posted from other threads, and its stand-in widgets take
+time proportional to the text they lay out, like Tk does. A call of many utterances is played
+into it: interim transcripts arrive at a high rate, and every finished utterance is added to the
+history. Without the renderer, every interim redraws the transcript and every utterance redraws
+the whole history; with it, updates are coalesced to one render per frame and the history is
+appended to. Reports the event-loop lag measured by `LagProbe`, the renders and the characters
+laid out.
+
+Usage:
+    python -m benchmarks.ui_render [--utterances 200] [--interim-sec 0.005]
+"""
+import argparse
+import queue
+import threading
+import time
+
+from src.constants import LAG_EVENT, RENDER_EVENT
+from src.render import LagProbe, RenderScheduler
+
+
+class StandInWidget:
+    """
+    Text widget whose updates busy the event loop for `sec_per_char` per character laid out.
+    """
+
+    def __init__(self, sec_per_char: float):
+        self.sec_per_char = sec_per_char
+        self.text = ""
+        self.updates = 0
+        self.chars = 0
+
+    def update(self, value: str, append: bool = False) -> None:
+        self.text = self.text + value if append else value
+        self.updates += 1
+        self.chars += len(value)
+        busy_until = time.perf_counter() + len(value) * self.sec_per_char
+        while time.perf_counter() < busy_until:
+            pass
+
+
+class StandInWindow:
+    """
+    Event loop fed through `write_event_value`, like a PySimpleGUI window.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def write_event_value(self, event: str, value) -> None:
+        self.events.put((event, value))
+
+    def read(self) -> tuple:
+        return self.events.get()
+
+
+def run(args, scheduled: bool) -> dict:
+    window = StandInWindow()
+    transcript = StandInWidget(args.sec_per_char)
+    history = StandInWidget(args.sec_per_char)
+    renderer = RenderScheduler(window.write_event_value)
+    probe = LagProbe(window.write_event_value, interval_sec=args.probe_sec)
+
+    def call() -> None:
+        utterances = []
+        for utterance in range(args.utterances):
+            words = [f"word{utterance}-{i}" for i in range(args.words)]
+            for interim in range(1, args.interims + 1):
+                text = ' '.join(words[:len(words) * interim // args.interims])
+                if scheduled:
+                    renderer.update(transcript, text)
+                else:
+                    window.write_event_value("-TRANSCRIPT-", text)
+                time.sleep(args.interim_sec)
+            utterances.append(' '.join(words))
+            if scheduled:
+                renderer.append(history, f"{utterances[-1]}\n\n")
+            else:
+                window.write_event_value("-HISTORY-", '\n\n'.join(utterances))
+        window.write_event_value("-DONE-", None)
+
+    probe.start()
+    threading.Thread(target=call, daemon=True).start()
+    while True:
+        event, value = window.read()
+        if event == "-DONE-":
+            break
+        if event == RENDER_EVENT:
+            renderer.render()
+        elif event == LAG_EVENT:
+            probe.observe(value)
+        elif event == "-TRANSCRIPT-":
+            transcript.update(value)
+        elif event == "-HISTORY-":
+            history.update(value)
+    probe.stop()
+    return {
+        **probe.stats(),
+        "renders": transcript.updates + history.updates,
+        "chars": transcript.chars + history.chars,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--utterances", type=int, default=200)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--interims", type=int, default=10)
+    parser.add_argument("--interim-sec", type=float, default=0.005)
+    parser.add_argument("--sec-per-char", type=float, default=1e-6)
+    parser.add_argument("--probe-sec", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{'scheduled':>9} {'lag p50':>8} {'p95':>8} {'p99':>8} {'renders':>8} {'chars':>10}")
+    for scheduled in (False, True):
+        result = run(args, scheduled)
+        print(
+            f"{str(scheduled):>9} {result['p50'] * 1000:>6.2f}ms {result['p95'] * 1000:>6.2f}ms "
+            f"{result['p99'] * 1000:>6.2f}ms {result['renders']:>8} {result['chars']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,22 @@
-from src.simple_ui import run_ui
+import argparse
+
+from src.constants import SERVER_HOST, SERVER_PORT
 
 
 if __name__ == "__main__":
-    run_ui()
+    parser = argparse.ArgumentParser(description="Avoca AI autosuggest")
+    parser.add_argument(
+        "--headless", action="store_true", help="run the suggestion server instead of the UI"
+    )
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    if args.headless:
+        from src.server import run_server
+
+        run_server(args.host, args.port)
+    else:
+        from src.simple_ui import run_ui
+
+        run_ui()
@@ -0,0 +1,479 @@
+"""Append-only archive of calls, with full-text search and reuse of earlier answers."""
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+import itertools
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from src.cache import LRUTTLCache
+from src.constants import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_CANDIDATES,
+    ARCHIVE_FLUSH_SEC,
+    ARCHIVE_ID_BLOCK,
+    ARCHIVE_MATCH_RATIO,
+    ARCHIVE_MIN_WORDS,
+    ARCHIVE_PATH,
+    ARCHIVE_QUERY_TERMS,
+    ARCHIVE_TERM_CACHE_SIZE,
+    ARCHIVE_TERM_CACHE_TTL_SEC
+)
+from src.speculation import transcript_similarity
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS utterances (
+    id INTEGER PRIMARY KEY,
+    call_id INTEGER NOT NULL,
+    started_at REAL,
+    ended_at REAL NOT NULL,
+    text TEXT NOT NULL,
+    normalized TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS utterances_normalized ON utterances (normalized);
+CREATE TABLE IF NOT EXISTS suggestions (
+    id INTEGER PRIMARY KEY,
+    utterance_id INTEGER NOT NULL,
+    short INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    text TEXT NOT NULL,
+    day TEXT,
+    reusable INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS suggestions_utterance ON suggestions (utterance_id, short);
+CREATE VIRTUAL TABLE IF NOT EXISTS utterances_fts
+    USING fts5(text, content='utterances', content_rowid='id');
+CREATE VIRTUAL TABLE IF NOT EXISTS utterances_terms USING fts5vocab(utterances_fts, 'row');
+CREATE TABLE IF NOT EXISTS id_blocks (
+    name TEXT PRIMARY KEY,
+    next_id INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS utterances_index AFTER INSERT ON utterances BEGIN
+    INSERT INTO utterances_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+_SELECT = """
+SELECT u.id, c.session_id, u.started_at, u.ended_at, u.text,
+    (SELECT text FROM suggestions
+        WHERE utterance_id = u.id AND short = 1 ORDER BY id DESC LIMIT 1),
+    (SELECT text FROM suggestions
+        WHERE utterance_id = u.id AND short = 0 ORDER BY id DESC LIMIT 1)
+FROM utterances u JOIN calls c ON c.id = u.call_id
+"""
+
+# The utterances with a short answer suggested on `:day` that can be reused, and that answer.
+_SELECT_REUSABLE = """
+SELECT u.id, c.session_id, u.started_at, u.ended_at, u.text, s.text,
+    (SELECT text FROM suggestions
+        WHERE utterance_id = u.id AND short = 0 AND reusable = 1 AND day = :day
+        ORDER BY id DESC LIMIT 1)
+FROM utterances u JOIN calls c ON c.id = u.call_id
+JOIN suggestions s ON s.id = (SELECT MAX(id) FROM suggestions
+    WHERE utterance_id = u.id AND short = 1 AND reusable = 1 AND day = :day)
+"""
+
+# Columns added to the tables of archives created by earlier versions.
+_MIGRATIONS = {
+    "suggestions": {
+        "day": "ALTER TABLE suggestions ADD COLUMN day TEXT",
+        "reusable": "ALTER TABLE suggestions ADD COLUMN reusable INTEGER NOT NULL DEFAULT 0",
+    },
+}
+
+_INSERT_CALL = "INSERT INTO calls (id, session_id, started_at) VALUES (?, ?, ?)"
+_INSERT_UTTERANCE = (
+    "INSERT INTO utterances (id, call_id, started_at, ended_at, text, normalized) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_INSERT_SUGGESTION = (
+    "INSERT INTO suggestions (utterance_id, short, created_at, text, day, reusable) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+# Words too common to narrow down a search.
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been but by can could did do does for from
+had has have how i if in is it its just me my no not of on or our so than that the their them
+then there they this to was we were what when where which who why will with would you your
+""".split())
+
+_CLOSE = object()
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(_words(text))
+
+
+def _any_two(terms: list[str]) -> str:
+    # An FTS5 query matching the rows that contain at least two of `terms`, or the only one.
+    # Intersections are cheap however common the other word is, and allowing a word to miss lets
+    # a rephrased utterance still match.
+    if len(terms) < 2:
+        return ' '.join(f'"{term}"' for term in terms)
+    return ' OR '.join(f'("{a}" "{b}")' for a, b in itertools.combinations(terms, 2))
+
+
+@dataclass
+class ArchivedUtterance:
+    utterance_id: int
+    session_id: str
+    started_at: Optional[float]
+    ended_at: float
+    text: str
+    short_answer: Optional[str]
+    long_answer: Optional[str]
+
+
+@dataclass
+class ArchiveMatch:
+    utterance: ArchivedUtterance
+    score: float
+
+
+class CallArchive:
+    """
+    Local SQLite store of every call, its utterances and the answers suggested for them.
+
+    The store is append-only. Writes are queued and committed in batches of up to `batch_size`
+    by a background thread, at most `flush_sec` seconds after they were queued, so the caller
+    never waits for the disk. Identifiers are assigned at once so later writes can refer to
+    earlier ones: each archive reserves them in blocks of ARCHIVE_ID_BLOCK under a write lock,
+    so archives of several processes sharing the file never assign the same one. A batch that
+    can't be committed is written again record by record, and only the failing records are lost.
+    Utterances are indexed with SQLite FTS5 for `search`, and `lookup` finds an earlier utterance
+    close enough to a new one that its answer can be suggested again.
+
+    Answers refer to the scheduling day of the system prompt, so only an answer suggested the
+    same day is reused, and only if it was marked reusable when archived, i.e. it doesn't depend
+    on the earlier turns of its call.
+
+    Args:
+        path (str): The SQLite database file. Defaults to the value of ARCHIVE_PATH.
+        batch_size (int): The maximum number of writes committed at once. Defaults to the value
+        of ARCHIVE_BATCH_SIZE.
+        flush_sec (float): The maximum time a write waits to be committed. Defaults to the value
+        of ARCHIVE_FLUSH_SEC.
+        match_ratio (float): The minimum similarity of a reused utterance. Defaults to the value
+        of ARCHIVE_MATCH_RATIO.
+
+    Example:
+        ```python
+        archive = CallArchive("calls.db")
+        call_id = archive.start_call("call-1")
+        utterance_id = archive.add_utterance(call_id, "What hours are you open?")
+        archive.add_suggestion(utterance_id, True, "We are open 8 AM to 5 PM.")
+        ...
+        match = archive.lookup("what hours are you open")
+        archive.close()
+        ```
+    """
+
+    def __init__(
+        self,
+        path: str = ARCHIVE_PATH,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        flush_sec: float = ARCHIVE_FLUSH_SEC,
+        match_ratio: float = ARCHIVE_MATCH_RATIO
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.match_ratio = match_ratio
+        self.written = 0
+        self.lookups = 0
+        self.hits = 0
+        self._queue = queue.Queue()
+        self._term_counts = LRUTTLCache(ARCHIVE_TERM_CACHE_SIZE, ARCHIVE_TERM_CACHE_TTL_SEC)
+        self._lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._migrate()
+        self._ids = {"calls": iter(()), "utterances": iter(())}
+        self._ids_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="archive", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _migrate(self) -> None:
+        for table, columns in _MIGRATIONS.items():
+            existing = {row[1] for row in self._reader.execute(f"PRAGMA table_info({table})")}
+            for column, statement in columns.items():
+                if column not in existing:
+                    self._reader.execute(statement)
+        self._reader.commit()
+
+    def _next_id(self, table: str) -> int:
+        with self._ids_lock:
+            next_id = next(self._ids[table], None)
+            if next_id is None:
+                next_id = self._reserve(table)
+                self._ids[table] = iter(range(next_id + 1, next_id + ARCHIVE_ID_BLOCK))
+            return next_id
+
+    def _reserve(self, table: str) -> int:
+        # Reserves the next ARCHIVE_ID_BLOCK identifiers of `table` and returns the first. The
+        # write lock of BEGIN IMMEDIATE keeps other processes from reserving the same block, and
+        # rows written by versions that didn't reserve identifiers are skipped.
+        with self._lock:
+            self._reader.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._reader.execute(
+                    "SELECT next_id FROM id_blocks WHERE name = ?", (table,)
+                ).fetchone()
+                written = self._reader.execute(
+                    f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}"
+                ).fetchone()[0]
+                start = max(row[0] if row else 0, written)
+                self._reader.execute(
+                    "INSERT INTO id_blocks (name, next_id) VALUES (?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET next_id = excluded.next_id",
+                    (table, start + ARCHIVE_ID_BLOCK),
+                )
+            except sqlite3.Error:
+                self._reader.rollback()
+                raise
+            self._reader.commit()
+        return start
+
+    def start_call(self, session_id: str) -> int:
+        """
+        Archives the start of a call.
+
+        Returns:
+            int: The identifier of the call.
+        """
+        call_id = self._next_id("calls")
+        self._queue.put((_INSERT_CALL, (call_id, session_id, time.time())))
+        return call_id
+
+    def add_utterance(
+        self,
+        call_id: int,
+        text: str,
+        started_at: Optional[float] = None,
+        ended_at: Optional[float] = None
+    ) -> int:
+        """
+        Archives an utterance of a call.
+
+        Args:
+            call_id (int): The call of the utterance.
+            text (str): The transcript of the utterance.
+            started_at (float, optional): When the utterance started, as a `time.time()` value.
+            ended_at (float, optional): When the utterance ended. Defaults to now.
+
+        Returns:
+            int: The identifier of the utterance.
+        """
+        utterance_id = self._next_id("utterances")
+        ended_at = ended_at if ended_at is not None else time.time()
+        self._queue.put((
+            _INSERT_UTTERANCE,
+            (utterance_id, call_id, started_at, ended_at, text, _normalize(text)),
+        ))
+        return utterance_id
+
+    def add_suggestion(
+        self,
+        utterance_id: int,
+        short_answer: bool,
+        text: str,
+        reusable: bool = True,
+        day: Optional[date] = None
+    ) -> None:
+        """
+        Archives an answer suggested for an utterance.
+
+        Args:
+            utterance_id (int): The utterance the answer is for.
+            short_answer (bool): Whether the answer is the short one.
+            text (str): The answer.
+            reusable (bool): Whether the answer can be suggested again for a similar utterance,
+            i.e. it doesn't depend on the earlier turns of the call. Defaults to True.
+            day (date, optional): The scheduling day the answer was generated for. Defaults to
+            today.
+        """
+        day = (day or date.today()).isoformat()
+        self._queue.put((
+            _INSERT_SUGGESTION,
+            (utterance_id, short_answer, time.time(), text, day, reusable),
+        ))
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            flush_at = time.monotonic() + self.flush_sec
+            while batch[-1] is not _CLOSE and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, flush_at - time.monotonic())))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is _CLOSE
+            writes = batch[:-1] if closing else batch
+            if writes:
+                self._write(connection, writes)
+            for _ in batch:
+                self._queue.task_done()
+            if closing:
+                connection.close()
+                return
+
+    def _write(self, connection: sqlite3.Connection, writes: list[tuple]) -> None:
+        statements = {}
+        for statement, parameters in writes:
+            statements.setdefault(statement, []).append(parameters)
+        try:
+            with connection:
+                for statement, rows in statements.items():
+                    connection.executemany(statement, rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Can't archive {len(writes)} records at once, retrying one by one: {e}")
+        else:
+            self.written += len(writes)
+            return
+        for statement, parameters in writes:
+            try:
+                with connection:
+                    connection.execute(statement, parameters)
+            except sqlite3.Error as e:
+                logger.error(f"Can't archive a record: {e}")
+                continue
+            self.written += 1
+
+    def search(self, query: str, limit: int = 20) -> list[ArchivedUtterance]:
+        """
+        Returns the archived utterances matching a full-text query, best matches first.
+
+        Args:
+            query (str): An FTS5 query, e.g. `appointment AND tuesday`.
+            limit (int): The maximum number of utterances. Defaults to 20.
+
+        Returns:
+            list[ArchivedUtterance]: The matching utterances and their latest answers.
+        """
+        with self._lock:
+            rows = self._reader.execute(
+                f"{_SELECT} JOIN utterances_fts ON utterances_fts.rowid = u.id "
+                "WHERE utterances_fts MATCH ? ORDER BY utterances_fts.rank LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        return [ArchivedUtterance(*row) for row in rows]
+
+    def lookup(self, text: str, day: Optional[date] = None) -> Optional[ArchiveMatch]:
+        """
+        Returns the most similar earlier utterance with a reusable short answer suggested on
+        `day`, or None if none is similar enough. Utterances of fewer than ARCHIVE_MIN_WORDS words,
+        such as the openings every call shares, are never looked up.
+
+        An utterance said word for word before is found through an index. Otherwise the most
+        recent utterances containing at least two of the ARCHIVE_QUERY_TERMS least common words
+        of `text` are compared with it. An intersection with a rare word is short, so a lookup
+        stays fast however large the archive grows.
+
+        Args:
+            text (str): The transcript to match.
+            day (date, optional): The scheduling day of the answer. Defaults to today.
+
+        Returns:
+            Optional[ArchiveMatch]: The best match above the match ratio.
+        """
+        words = _words(text)
+        if len(words) < ARCHIVE_MIN_WORDS:
+            return None
+        normalized = ' '.join(words)
+        day = (day or date.today()).isoformat()
+        with self._lock:
+            self.lookups += 1
+            rows = self._reader.execute(
+                f"{_SELECT_REUSABLE} WHERE u.normalized = :normalized ORDER BY u.id DESC LIMIT 1",
+                {"normalized": normalized, "day": day},
+            ).fetchall()
+            terms = [] if rows else self._rarest(set(words) - STOPWORDS or set(words))
+            if terms:
+                # The candidates are picked on the full-text index alone, in its own order, so
+                # the search stops at the first ARCHIVE_CANDIDATES matches.
+                rows = self._reader.execute(
+                    f"{_SELECT_REUSABLE} JOIN (SELECT rowid FROM utterances_fts "
+                    "WHERE utterances_fts MATCH :query ORDER BY rowid DESC LIMIT :limit) f "
+                    "ON f.rowid = u.id",
+                    {"query": _any_two(terms), "limit": ARCHIVE_CANDIDATES, "day": day},
+                ).fetchall()
+        if not rows:
+            return None
+        best = max(
+            (
+                ArchiveMatch(
+                    ArchivedUtterance(*row), transcript_similarity(_normalize(row[4]), normalized)
+                )
+                for row in rows
+            ),
+            key=lambda match: match.score,
+        )
+        if best.score < self.match_ratio:
+            return None
+        with self._lock:
+            self.hits += 1
+        return best
+
+    def _rarest(self, words: set[str]) -> list[str]:
+        # The ARCHIVE_QUERY_TERMS words of `words` found in the fewest archived utterances.
+        # Counting the utterances of a common word walks a long posting list, so the counts are
+        # cached; they only need to be about right. Words not archived yet are not cached.
+        counts = []
+        for word in words:
+            count = self._term_counts.get(word)
+            if count is None:
+                row = self._reader.execute(
+                    "SELECT doc FROM utterances_terms WHERE term = ?", (word,)
+                ).fetchone()
+                if row is None:
+                    continue
+                count = row[0]
+                self._term_counts.put(word, count)
+            counts.append((count, word))
+        return [word for _, word in sorted(counts)[:ARCHIVE_QUERY_TERMS]]
+
+    def flush(self) -> None:
+        """
+        Waits until the queued writes are committed.
+        """
+        self._queue.join()
+
+    def close(self) -> None:
+        """
+        Commits the queued writes and closes the archive.
+        """
+        self._queue.put(_CLOSE)
+        self._writer.join()
+        with self._lock:
+            self._reader.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "written": self.written,
+                "queued": self._queue.qsize(),
+                "lookups": self.lookups,
+                "hits": self.hits,
+            }
@@ -1,109 +1,365 @@
-"""Audio utilities."""
+"""
+Audio utilities.
+
+The device libraries (soundcard, and speech_recognition with PyAudio) are imported and the devices
+enumerated on first use, so importing this module neither loads them nor touches the hardware.
+"""
+from functools import lru_cache
 from loguru import logger
-from typing import Callable
+from typing import Callable, Iterator, Optional
 import numpy as np
-import pyaudio
-import soundcard as sc
+import queue
 import soundfile as sf
-import speech_recognition as sr
-import time
-import wave
+import threading
+
+from src.constants import (
+    AGENT_CHANNEL,
+    CALLER_CHANNEL,
+    FRAME_MS,
+    RECORDING_CLOSE_TIMEOUT_SEC,
+    RECORDING_FORMAT,
+    RECORDING_QUEUE_FRAMES,
+    RING_BUFFER_SEC,
+    SAMPLE_RATE
+)
+from src.resample import AudioConverter
 
-from src.llm import transcribe_audio_realtime
-from src.constants import OUTPUT_FILE_NAME, RECORD_SEC, SAMPLE_RATE, TranscriptionModes
 
+@lru_cache(maxsize=1)
+def default_devices() -> tuple[str, str]:
+    """
+    Returns the names of the default speaker and microphone, enumerating the devices once.
+    """
+    import soundcard as sc  # pylint: disable=import-outside-toplevel
 
-SPEAKER_ID = str(sc.default_speaker().name)
-MIC_ID = str(sc.default_microphone().name)
+    return str(sc.default_speaker().name), str(sc.default_microphone().name)
 
 
-def record_background(
-    audio_data: list[bytes],
-    transcription_mode: TranscriptionModes,
-    record_sec: int = RECORD_SEC
-) -> Callable:
+def interleave(signals: list[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Records an audio batch for a specified duration.
+    Converts float signals to linear16 and interleaves them, one signal per channel.
 
     Args:
-        record_sec (int): The duration of the recording in seconds. Defaults to the value of
-        RECORD_SEC.
+        signals (list[np.ndarray]): Signals of equal length with samples in [-1, 1]. A 2-D
+        signal, e.g. a stereo device, is downmixed to mono first.
+        out (np.ndarray, optional): The int16 array of shape (samples, channels) written to.
+        Allocated if missing.
 
     Returns:
-        np.ndarray: The recorded audio sample.
+        np.ndarray: The int16 array of shape (samples, channels), whose bytes are the
+        interleaved stream.
+    """
+    if out is None:
+        out = np.empty((len(signals[0]), len(signals)), dtype=np.int16)
+    for channel, signal in enumerate(signals):
+        if signal.ndim > 1:
+            signal = signal.mean(axis=1)
+        out[:, channel] = np.clip(signal * 32768, -32768, 32767)
+    return out
 
-    Example:
-        ```python
-        audio_sample = record_batch(5)
-        print(audio_sample)
-        ```
+
+class RingBuffer:
     """
+    Preallocated, frame-aligned ring buffer for raw audio.
+
+    The capacity is a whole number of frames, so every frame occupies one contiguous slot and can
+    be handed out as a zero-copy `memoryview`. A view stays valid until the writer wraps around and
+    overwrites its slot, i.e. for `capacity_frames - 1` subsequent writes.
 
+    Args:
+        frame_bytes (int): The size of a single frame in bytes.
+        capacity_frames (int): The number of frames the buffer can hold.
     """
-    def callback(_, audio):
-        audio_data.append(audio.get_wav_data())
-
-    def realtime_callback(_, audio):
-        transcribe_audio_realtime(audio.get_wav_data())
-        audio_data.append(audio.get_wav_data())
-
-    r = sr.Recognizer()
-    r.non_speaking_duration = 1
-    r.pause_threshold = 1
-    s = sr.Microphone()
-
-    if transcription_mode == TranscriptionModes.Live:
-        return r.listen_in_background(s, realtime_callback)
-    else:
-        return r.listen_in_background(s, callback)
+
+    def __init__(self, frame_bytes: int, capacity_frames: int):
+        self.frame_bytes = frame_bytes
+        self.capacity_frames = capacity_frames
+        self._buffer = bytearray(frame_bytes * capacity_frames)
+        self._view = memoryview(self._buffer)
+        self.frames_written = 0
+
+    def write(self, data: bytes) -> memoryview:
+        """
+        Copies a frame into the next slot.
+
+        Args:
+            data (bytes): The frame data. Shorter frames are zero padded.
+
+        Returns:
+            memoryview: A view of the slot the frame was written to.
+        """
+        start = (self.frames_written % self.capacity_frames) * self.frame_bytes
+        size = min(len(data), self.frame_bytes)
+        self._view[start:start + size] = data[:size]
+        if size < self.frame_bytes:
+            self._view[start + size:start + self.frame_bytes] = bytes(self.frame_bytes - size)
+        self.frames_written += 1
+        return self._view[start:start + self.frame_bytes]
+
+    def frame(self, index: int) -> memoryview:
+        """
+        Returns a view of a previously written frame.
+
+        Args:
+            index (int): The absolute index of the frame, counted from the first write.
+
+        Returns:
+            memoryview: A view of the frame.
+
+        Raises:
+            IndexError: If the frame was not written yet or was already overwritten.
+        """
+        if not self.frames_written - self.capacity_frames <= index < self.frames_written:
+            raise IndexError(f"Frame {index} is not in the ring buffer")
+        start = (index % self.capacity_frames) * self.frame_bytes
+        return self._view[start:start + self.frame_bytes]
+
+
+class CaptureEngine:
+    """
+    Microphone capture that keeps a single input stream open for the whole recording.
+
+    Frames of `frame_ms` milliseconds are read from the device at its native rate, converted to
+    mono at `sample_rate`, copied into a `RingBuffer` and yielded as zero-copy views, so they can
+    be forwarded as soon as they are captured.
+
+    Args:
+        frame_ms (int): The duration of a single frame in milliseconds. Defaults to the value of
+        FRAME_MS.
+        buffer_sec (float): The amount of audio kept in the ring buffer. Defaults to the value of
+        RING_BUFFER_SEC.
+        sample_rate (int): The sample rate of the yielded frames. Defaults to the value of
+        SAMPLE_RATE.
     """
 
-    p = pyaudio.PyAudio()
-    device_info = p.get_default_input_device_info()
-    sample_rate = device_info.get("defaultSampleRate")
-    m = sr.Microphone()
-    with m as s:
-        audio_samples = []
-        for _ in range(0, int(sample_rate / 1024 * record_sec)):
-            audio_samples.append(s.stream.read(1024))
+    def __init__(
+        self,
+        frame_ms: int = FRAME_MS,
+        buffer_sec: float = RING_BUFFER_SEC,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        self.frame_ms = frame_ms
+        self.buffer_sec = buffer_sec
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.channels = 1
+        self.device_rate = None
+        self.device_channels = 1
+        self.ring = None
 
-        transcribe_audio_realtime(b''.join(audio_samples))
-        audio_data.append(b''.join(audio_samples))
+    def frames(self, is_recording: Callable[[], bool]) -> Iterator[memoryview]:
+        """
+        Captures frames until `is_recording` returns False.
 
+        Args:
+            is_recording (Callable[[], bool]): Polled before every frame to decide whether to keep
+            recording.
 
-def save_audio_file(
-    audio_data: list[bytes],
-    output_file_name: str = OUTPUT_FILE_NAME
-) -> None:
+        Yields:
+            memoryview: The captured frame, valid until the ring buffer wraps around.
+        """
+        import speech_recognition as sr  # pylint: disable=import-outside-toplevel
+
+        with sr.Microphone() as s:
+            self.device_rate = s.SAMPLE_RATE
+            converter = AudioConverter(self.device_rate, self.device_channels, self.sample_rate)
+            frame_samples = int(self.device_rate * self.frame_ms / 1000)
+            self.ring = RingBuffer(
+                converter.output_samples(frame_samples) * self.sample_width * self.channels,
+                max(2, int(self.buffer_sec * 1000 / self.frame_ms))
+            )
+            logger.debug(
+                f"Capturing {self.frame_ms} ms frames at {self.device_rate} Hz, "
+                f"converted to {self.sample_rate} Hz"
+            )
+            while is_recording():
+                frame = converter.process(s.stream.read(frame_samples))
+                yield self.ring.write(frame)[:len(frame)]
+
+
+class DualCaptureEngine:
     """
-    Saves an audio data array to a file.
+    Captures the microphone and the speaker loopback as two channels of one stream.
+
+    The microphone picks up the agent and the loopback of the default speaker plays the caller,
+    so the two are kept apart: the agent is channel AGENT_CHANNEL and the caller CALLER_CHANNEL
+    of interleaved linear16 frames. Both devices are recorded at `sample_rate` and the frames are
+    interleaved with `interleave` into a `RingBuffer`, then yielded as zero-copy views, like
+    `CaptureEngine` does.
 
     Args:
-        audio_data (np.ndarray): The audio data to be saved.
-        output_file_name (str): The name of the output file. Defaults to the value of
-        OUTPUT_FILE_NAME.
+        frame_ms (int): The duration of a single frame in milliseconds. Defaults to the value of
+        FRAME_MS.
+        buffer_sec (float): The amount of audio kept in the ring buffer. Defaults to the value of
+        RING_BUFFER_SEC.
+        sample_rate (int): The sample rate of the yielded frames. Defaults to the value of
+        SAMPLE_RATE.
+    """
 
-    Returns:
-        None
+    def __init__(
+        self,
+        frame_ms: int = FRAME_MS,
+        buffer_sec: float = RING_BUFFER_SEC,
+        sample_rate: int = SAMPLE_RATE
+    ):
+        self.frame_ms = frame_ms
+        self.buffer_sec = buffer_sec
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.channels = 2
+        self.ring = None
+
+    def frames(self, is_recording: Callable[[], bool]) -> Iterator[memoryview]:
+        """
+        Captures frames until `is_recording` returns False.
+
+        Args:
+            is_recording (Callable[[], bool]): Polled before every frame to decide whether to keep
+            recording.
+
+        Yields:
+            memoryview: The captured frame, valid until the ring buffer wraps around.
+        """
+        import soundcard as sc  # pylint: disable=import-outside-toplevel
+
+        speaker_id, mic_id = default_devices()
+        microphone = sc.get_microphone(mic_id)
+        loopback = sc.get_microphone(speaker_id, include_loopback=True)
+        frame_samples = int(self.sample_rate * self.frame_ms / 1000)
+        self.ring = RingBuffer(
+            frame_samples * self.sample_width * self.channels,
+            max(2, int(self.buffer_sec * 1000 / self.frame_ms))
+        )
+        signals = [None] * self.channels
+        frame = np.empty((frame_samples, self.channels), dtype=np.int16)
+        logger.debug(
+            f"Capturing {self.frame_ms} ms frames of {mic_id} and the loopback of {speaker_id} "
+            f"at {self.sample_rate} Hz"
+        )
+        with microphone.recorder(self.sample_rate, channels=1, blocksize=frame_samples) as mic, \
+                loopback.recorder(self.sample_rate, blocksize=frame_samples) as speaker:
+            while is_recording():
+                signals[AGENT_CHANNEL] = mic.record(frame_samples)
+                signals[CALLER_CHANNEL] = speaker.record(frame_samples)
+                yield self.ring.write(memoryview(interleave(signals, frame)).cast("B"))
+
+
+class AudioFileWriter:
+    """
+    Streams linear16 audio to a file on a background thread.
+
+    Frames are queued by `write` and appended to the file as they arrive, so memory use is bounded
+    by the queue size whatever the length of the recording. `write` never blocks: while the disk
+    is behind by a full queue, new frames are dropped and counted in `dropped`, so capture never
+    waits for the recording. The file header is finalized by `close`. WAV and FLAC files are
+    written as 16-bit PCM, OGG files as Vorbis.
+
+    Args:
+        path (str): The path of the output file.
+        sample_rate (int): The sample rate of the audio.
+        channels (int): The number of interleaved channels. Defaults to 1.
+        file_format (str): "WAV", "FLAC" or "OGG". Defaults to the value of RECORDING_FORMAT.
+        queue_frames (int): The maximum number of frames waiting to be written. Defaults to the
+        value of RECORDING_QUEUE_FRAMES.
 
     Example:
         ```python
-        audio_data = np.array([0.1, 0.2, 0.3])
-        save_audio_file(audio_data, "output.wav")
+        with AudioFileWriter("out.flac", 16000, file_format="FLAC") as writer:
+            writer.write(frame)
         ```
     """
-    logger.debug(f"Saving audio file to {output_file_name}...")
-
-    p = pyaudio.PyAudio()
-    device_info = p.get_default_input_device_info()
-    sample_width = int(p.get_sample_size(pyaudio.paInt16))
-    channels = device_info.get("maxInputChannels")
-    sample_rate = device_info.get("defaultSampleRate")
-
-    with wave.open(output_file_name, 'wb') as w:
-        w.setnchannels(channels)
-        w.setsampwidth(sample_width)
-        w.setframerate(sample_rate)
-        for d in audio_data:
-            w.writeframes(d)
-    logger.debug("...Saved!")
+
+    _SUBTYPES = {"WAV": "PCM_16", "FLAC": "PCM_16", "OGG": "VORBIS"}
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: int,
+        channels: int = 1,
+        file_format: str = RECORDING_FORMAT,
+        queue_frames: int = RECORDING_QUEUE_FRAMES
+    ):
+        self.path = path
+        self.channels = channels
+        self._file = sf.SoundFile(
+            path,
+            mode="w",
+            samplerate=int(sample_rate),
+            channels=channels,
+            format=file_format,
+            subtype=self._SUBTYPES[file_format],
+        )
+        self.dropped = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_frames)
+        self._overflowing = False
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="audio-writer", daemon=True)
+        self._thread.start()
+        logger.debug(f"Recording audio to {path} ({file_format}, {sample_rate} Hz)")
+
+    def write(self, frame: bytes) -> None:
+        """
+        Queues a frame for writing. Never blocks; the frame is dropped if the queue is full.
+        """
+        if self._closing:
+            return
+        try:
+            self._queue.put_nowait(bytes(frame))
+        except queue.Full:
+            self.dropped += 1
+            if not self._overflowing:
+                self._overflowing = True
+                reason = f"failed: {self.error}" if self.error else "is behind"
+                logger.warning(f"Writing {self.path} {reason}, dropping recorded frames")
+            return
+        self._overflowing = False
+
+    def _run(self) -> None:
+        try:
+            while True:
+                frames = [self._queue.get()]
+                while frames[-1] is not None and not self._queue.empty():
+                    frames.append(self._queue.get_nowait())
+                done = frames[-1] is None
+                if done:
+                    frames.pop()
+                if frames:
+                    samples = np.frombuffer(b''.join(frames), dtype=np.int16)
+                    self._file.write(samples.reshape(-1, self.channels))
+                # The end marker can't be queued while the queue is full, so once closing, an
+                # empty queue ends the recording too.
+                if done or (self._closing and self._queue.empty()):
+                    return
+        except Exception as e:
+            logger.error(f"Can't write {self.path}: {e}")
+            self.error = e
+
+    def close(self, timeout: float = RECORDING_CLOSE_TIMEOUT_SEC) -> None:
+        """
+        Gives the queued frames `timeout` seconds to be written, and finalizes the file.
+
+        Raises:
+            Exception: The error that stopped the writer thread, if any.
+        """
+        self._closing = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Writing {self.path} didn't finish in {timeout} sec, left unfinalized")
+            return
+        self._file.close()
+        if self.dropped:
+            logger.warning(f"{self.dropped} frames were dropped from {self.path}")
+        if self.error:
+            raise self.error
+        logger.debug(f"...Saved {self.path}!")
+
+    def __enter__(self) -> "AudioFileWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
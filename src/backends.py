@@ -0,0 +1,303 @@
+"""Transcription and answer generation backends, and hedged requests across them."""
+from collections import Counter
+from typing import Any, Callable, Iterator, Optional
+import queue
+import threading
+import time
+
+from loguru import logger
+
+from src.connections import get_deepgram_client
+from src.constants import (
+    HEDGE_DEFAULT_DELAY_SEC,
+    HEDGE_MIN_DELAY_SEC,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE
+)
+from src.tracing import LatencyHistogram
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _once(fn: Callable, *args) -> Iterator:
+    yield fn(*args)
+
+
+class Hedger:
+    """
+    Sends a request to the first of several backends and hedges it to the next one when the
+    response is late.
+
+    A response is late once it took longer than the `percentile` of the backend's recent
+    latencies to produce its first item, so about `1 - percentile` of the requests are hedged
+    whatever the backend's latency is. The first backend to produce an item wins; the others are
+    cancelled, and stop at their next item. A backend that fails before producing anything is
+    replaced by the next one at once.
+
+    The latency of every backend is recorded into its own histogram. A cancelled request records
+    the time it ran for, a lower bound of its latency, so the slow requests that get hedged still
+    count in the percentile.
+
+    Args:
+        percentile (float): The latency percentile after which a request is hedged. Defaults to
+        the value of HEDGE_PERCENTILE.
+        default_delay (float): The hedge delay of a backend with fewer than `min_samples`
+        latencies, in seconds. Defaults to the value of HEDGE_DEFAULT_DELAY_SEC.
+        min_delay (float): The minimum hedge delay, in seconds. Defaults to the value of
+        HEDGE_MIN_DELAY_SEC.
+        min_samples (int): The number of latencies needed before they set the delay. Defaults to
+        the value of HEDGE_MIN_SAMPLES.
+    """
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        default_delay: float = HEDGE_DEFAULT_DELAY_SEC,
+        min_delay: float = HEDGE_MIN_DELAY_SEC,
+        min_samples: int = HEDGE_MIN_SAMPLES
+    ):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedged = 0
+        self.wins = Counter()
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def latency(self, name: str) -> LatencyHistogram:
+        with self._lock:
+            if name not in self._latencies:
+                self._latencies[name] = LatencyHistogram()
+            return self._latencies[name]
+
+    def delay(self, name: str) -> float:
+        """
+        Returns how long to wait for backend `name` before hedging, in seconds.
+        """
+        latency = self.latency(name)
+        if latency.count < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, latency.percentile(self.percentile))
+
+    def stream(self, attempts: list[tuple[str, Callable[[], Iterator]]]) -> Iterator:
+        """
+        Yields the items of the first of `attempts` to respond.
+
+        Args:
+            attempts (list[tuple[str, Callable[[], Iterator]]]): The backend names, and functions
+            that send the request to the backend and return its response as an iterator, in order
+            of preference.
+
+        Yields:
+            The items of the winning response.
+
+        Raises:
+            Exception: The error of the last attempt, if all of them failed.
+        """
+        results = queue.Queue()
+        cancelled = [threading.Event() for _ in attempts]
+        started_at = []
+
+        def pump(i: int) -> None:
+            try:
+                response = attempts[i][1]()
+                for item in response:
+                    if cancelled[i].is_set():
+                        getattr(response, "close", lambda: None)()
+                        return
+                    results.put((i, item))
+                results.put((i, _DONE))
+            except Exception as e:
+                results.put((i, _Failure(e)))
+
+        def launch() -> float:
+            i = len(started_at)
+            started_at.append(time.perf_counter())
+            threading.Thread(target=pump, args=(i,), daemon=True).start()
+            return started_at[-1] + self.delay(attempts[i][0])
+
+        with self._lock:
+            self.requests += 1
+        deadline = launch()
+        failed = set()
+        winner = None
+        try:
+            while winner is None:
+                timeout = None
+                if len(started_at) < len(attempts):
+                    timeout = max(0.0, deadline - time.perf_counter())
+                try:
+                    i, item = results.get(timeout=timeout)
+                except queue.Empty:
+                    late, hedge = attempts[len(started_at) - 1][0], attempts[len(started_at)][0]
+                    logger.debug(f"Hedging {late} with {hedge}")
+                    with self._lock:
+                        self.hedged += 1
+                    deadline = launch()
+                    continue
+                if isinstance(item, _Failure):
+                    logger.warning(f"{attempts[i][0]} failed: {item.error}")
+                    failed.add(i)
+                    if len(failed) == len(attempts):
+                        raise item.error
+                    if len(failed) == len(started_at):
+                        deadline = launch()
+                    continue
+                winner = i
+                self._settle(attempts, started_at, failed, winner, cancelled)
+
+            while item is not _DONE:
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+                i, item = results.get()
+                while i != winner:
+                    i, item = results.get()
+        finally:
+            for event in cancelled:
+                event.set()
+
+    def _settle(
+        self,
+        attempts: list,
+        started_at: list[float],
+        failed: set[int],
+        winner: int,
+        cancelled: list[threading.Event]
+    ) -> None:
+        now = time.perf_counter()
+        for i, at in enumerate(started_at):
+            if i != winner:
+                cancelled[i].set()
+            if i not in failed:
+                self.latency(attempts[i][0]).observe(now - at)
+        with self._lock:
+            self.wins[attempts[winner][0]] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the number of requests and hedges, and the wins and latency of every backend.
+        """
+        with self._lock:
+            names = list(self._latencies)
+            summary = {"requests": self.requests, "hedged": self.hedged, "backends": {}}
+        for name in names:
+            summary["backends"][name] = {
+                "wins": self.wins[name],
+                "delay": self.delay(name),
+                **self.latency(name).summary(),
+            }
+        return summary
+
+
+class OpenAIChatBackend:
+    """
+    Answer backend on an OpenAI chat model.
+
+    Answer backends provide a `name` and `stream(messages, temperature)`, which returns the
+    response as OpenAI chat completion chunks.
+
+    Args:
+        client (Callable[[], Any]): Returns the OpenAI client to use.
+        model (str): The chat model.
+    """
+
+    def __init__(self, client: Callable[[], Any], model: str):
+        self.client = client
+        self.model = model
+        self.name = model
+
+    def stream(self, messages: list[dict], temperature: float) -> Iterator:
+        return self.client().chat.completions.create(
+            model=self.model,
+            temperature=temperature,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+
+class HedgedAnswerBackend:
+    """
+    Answer backend that hedges every request across `backends`, in order of preference.
+
+    Args:
+        backends (list): The answer backends.
+        hedger (Hedger, optional): The hedger, which keeps the latency of every backend.
+        Defaults to a new one.
+    """
+
+    def __init__(self, backends: list, hedger: Optional[Hedger] = None):
+        self.backends = backends
+        self.hedger = hedger or Hedger()
+        self.name = "+".join(backend.name for backend in backends)
+
+    def stream(self, messages: list[dict], temperature: float) -> Iterator:
+        if len(self.backends) == 1:
+            return self.backends[0].stream(messages, temperature)
+        return self.hedger.stream([
+            (backend.name, lambda backend=backend: backend.stream(messages, temperature))
+            for backend in self.backends
+        ])
+
+
+class DeepgramTranscriber:
+    """
+    Transcription backend on a Deepgram prerecorded model.
+
+    Transcription backends provide a `name` and `transcribe(data)`, which transcribes an audio
+    file held in memory.
+
+    Args:
+        model (str): The Deepgram model.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.name = f"deepgram-{model}"
+
+    def transcribe(self, data: bytes) -> str:
+        from deepgram import PrerecordedOptions  # pylint: disable=import-outside-toplevel
+
+        payload = {"buffer": data}
+        options = PrerecordedOptions(model=self.model, smart_format=True)
+        response = get_deepgram_client().listen.rest.v("1").transcribe_file(payload, options)
+        return response.results.channels[0].alternatives[0].transcript
+
+
+class HedgedTranscriber:
+    """
+    Transcription backend that hedges every request across `backends`, in order of preference.
+
+    A transcription request can't be stopped once sent, so the response of a hedged request that
+    lost is simply dropped.
+
+    Args:
+        backends (list): The transcription backends.
+        hedger (Hedger, optional): The hedger, which keeps the latency of every backend.
+        Defaults to a new one.
+    """
+
+    def __init__(self, backends: list, hedger: Optional[Hedger] = None):
+        self.backends = backends
+        self.hedger = hedger or Hedger()
+        self.name = "+".join(backend.name for backend in backends)
+
+    def transcribe(self, data: bytes) -> str:
+        if len(self.backends) == 1:
+            return self.backends[0].transcribe(data)
+        response = self.hedger.stream([
+            (backend.name, lambda backend=backend: _once(backend.transcribe, data))
+            for backend in self.backends
+        ])
+        try:
+            return next(response)
+        finally:
+            response.close()
@@ -0,0 +1,251 @@
+"""Shared ASR clients and a live transcription connection that survives network blips."""
+from collections import deque
+from typing import Any, Optional
+import random
+import threading
+import time
+
+from loguru import logger
+
+from src.constants import (
+    DEEPGRAM_API_KEY,
+    RECONNECT_BASE_SEC,
+    RECONNECT_MAX_SEC,
+    REPLAY_BUFFER_SEC
+)
+from src.transcript import TranscriptBuffer
+
+
+_deepgram_client = None
+_client_lock = threading.Lock()
+
+
+def get_deepgram_client() -> Any:
+    """
+    Returns the process-wide Deepgram client, importing the SDK and creating it on first use.
+    """
+    global _deepgram_client  # pylint: disable=global-statement
+
+    with _client_lock:
+        if _deepgram_client is None:
+            # pylint: disable-next=import-outside-toplevel
+            from deepgram import DeepgramClient, DeepgramClientOptions
+
+            _deepgram_client = DeepgramClient(
+                api_key=DEEPGRAM_API_KEY,
+                config=DeepgramClientOptions(options={"keepalive": "true"})
+            )
+        return _deepgram_client
+
+
+class LiveConnection:
+    """
+    Live Deepgram connection that reconnects transparently.
+
+    When a send fails or the socket closes, audio is buffered (up to `replay_sec` seconds) while a
+    background thread reconnects with jittered exponential backoff. Once the new socket is open,
+    the buffered audio is replayed in order, so no transcript is lost to a short outage.
+
+    Args:
+        transcript (TranscriptBuffer): The transcript that receives interim and final results.
+        options (LiveOptions): The options the socket is started with.
+        bytes_per_sec (int): The byte rate of the audio stream, used to size the replay buffer.
+        replay_sec (float): The amount of audio buffered during an outage. Defaults to the value
+        of REPLAY_BUFFER_SEC.
+        client (DeepgramClient, optional): The client sockets are opened with. Defaults to the
+        shared client.
+        channel_transcripts (dict[int, TranscriptBuffer], optional): For multichannel audio, the
+        transcripts that receive the results of some channels, by channel index. The results of
+        the other channels go to `transcript`.
+    """
+
+    def __init__(
+        self,
+        transcript: TranscriptBuffer,
+        options: Any,
+        bytes_per_sec: int,
+        replay_sec: float = REPLAY_BUFFER_SEC,
+        client: Optional[Any] = None,
+        channel_transcripts: Optional[dict[int, TranscriptBuffer]] = None
+    ):
+        self.transcript = transcript
+        self.channel_transcripts = channel_transcripts or {}
+        self.options = options
+        self.max_backlog_bytes = int(bytes_per_sec * replay_sec)
+        self.client = client or get_deepgram_client()
+        self.reconnects = 0
+        self.gaps = deque(maxlen=100)
+        self.dropped_bytes = 0
+        self._socket = None
+        self._backlog = deque()
+        self._backlog_bytes = 0
+        self._down_since = None
+        self._reconnect_thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Opens the first socket.
+
+        Raises:
+            ConnectionError: If the socket fails to start.
+        """
+        socket = self._open_socket()
+        if socket is None:
+            raise ConnectionError("Can't start Deepgram connection")
+        self._socket = socket
+
+    def _open_socket(self):
+        from deepgram import LiveTranscriptionEvents  # pylint: disable=import-outside-toplevel
+
+        socket = self.client.listen.websocket.v("1")
+        socket.on(LiveTranscriptionEvents.Open, self._on_open)
+        socket.on(LiveTranscriptionEvents.Transcript, self._on_message)
+        socket.on(LiveTranscriptionEvents.SpeechStarted, self._on_speech_started)
+        socket.on(LiveTranscriptionEvents.Error, self._on_error)
+        socket.on(LiveTranscriptionEvents.Close, self._on_close)
+        try:
+            if socket.start(self.options) is False:
+                return None
+        except Exception as e:
+            logger.error(f"Can't start Deepgram connection: {e}")
+            return None
+        return socket
+
+    def _on_open(self, socket, open, **kwargs):
+        logger.info("Connection Open")
+
+    def _on_message(self, socket, result, **kwargs):
+        sentence = result.channel.alternatives[0].transcript
+        if len(sentence) == 0:
+            return
+        channel = (getattr(result, "channel_index", None) or [0])[0]
+        transcript = self.channel_transcripts.get(channel, self.transcript)
+        if result.is_final:
+            logger.debug(f"Transcription (channel {channel}): {sentence}")
+            transcript.push_final(sentence)
+        else:
+            logger.debug(f"Interim transcription (channel {channel}): {sentence}")
+            transcript.push_interim(sentence)
+
+    def _on_speech_started(self, socket, speech_started, **kwargs):
+        logger.debug("Speech Started")
+
+    def _on_error(self, socket, error, **kwargs):
+        logger.error(f"Error: {error}")
+        if not socket.is_connected():
+            self._on_close(socket, None)
+
+    def _on_close(self, socket, close, **kwargs):
+        with self._lock:
+            if socket is self._socket and not self._closed:
+                logger.warning("Deepgram connection closed, reconnecting...")
+                self._mark_down()
+
+    def send(self, data: bytes) -> None:
+        """
+        Sends audio, buffering it for replay while the connection is down.
+        """
+        with self._lock:
+            if self._socket is not None and not self._backlog:
+                try:
+                    if self._socket.send(data) is not False:
+                        return
+                except Exception as e:
+                    logger.warning(f"Can't send audio to Deepgram: {e}")
+                self._mark_down()
+            self._buffer(bytes(data))
+
+    def _buffer(self, data: bytes) -> None:
+        self._backlog.append(data)
+        self._backlog_bytes += len(data)
+        while self._backlog_bytes > self.max_backlog_bytes:
+            dropped = self._backlog.popleft()
+            self._backlog_bytes -= len(dropped)
+            self.dropped_bytes += len(dropped)
+
+    def _mark_down(self) -> None:
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+        stale_socket, self._socket = self._socket, None
+        if self._reconnect_thread is None:
+            self._reconnect_thread = threading.Thread(
+                target=self._reconnect, args=(stale_socket,), daemon=True
+            )
+            self._reconnect_thread.start()
+
+    def _reconnect(self, stale_socket) -> None:
+        if stale_socket is not None:
+            try:
+                stale_socket.finish()
+            except Exception as e:
+                logger.debug(f"Can't close stale Deepgram connection: {e}")
+
+        delay = RECONNECT_BASE_SEC
+        while not self._closed:
+            socket = self._open_socket()
+            if socket is not None and self._replay(socket):
+                return
+            if socket is not None:
+                socket.finish()
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, RECONNECT_MAX_SEC)
+
+    def _replay(self, socket) -> bool:
+        with self._lock:
+            if self._closed:
+                socket.finish()
+                return True
+            while self._backlog:
+                try:
+                    if socket.send(self._backlog[0]) is False:
+                        return False
+                except Exception as e:
+                    logger.warning(f"Can't replay audio to Deepgram: {e}")
+                    return False
+                self._backlog_bytes -= len(self._backlog.popleft())
+            gap = time.monotonic() - self._down_since
+            self.gaps.append(gap)
+            self.reconnects += 1
+            self._down_since = None
+            self._socket = socket
+            self._reconnect_thread = None
+        logger.info(f"Deepgram reconnected after {gap:.2f} sec")
+        return True
+
+    def keep_alive(self) -> None:
+        """
+        Keeps the socket open while no audio is being sent.
+        """
+        with self._lock:
+            socket = self._socket
+        if socket is not None:
+            try:
+                socket.keep_alive()
+            except Exception as e:
+                logger.warning(f"Can't send keepalive to Deepgram: {e}")
+
+    def is_connected(self) -> bool:
+        with self._lock:
+            return self._socket is not None and self._socket.is_connected()
+
+    def finish(self) -> None:
+        with self._lock:
+            self._closed = True
+            socket, self._socket = self._socket, None
+        if socket is not None:
+            socket.finish()
+
+    def stats(self) -> dict:
+        """
+        Returns the reconnect count, the outage durations and the state of the replay buffer.
+        """
+        with self._lock:
+            return {
+                "reconnects": self.reconnects,
+                "gaps_sec": list(self.gaps),
+                "down": self._down_since is not None,
+                "buffered_bytes": self._backlog_bytes,
+                "dropped_bytes": self.dropped_bytes,
+            }
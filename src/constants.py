@@ -7,14 +7,108 @@ class TranscriptionModes(Enum):
     Live = "-DEEPGRAM-LIVE-"
 
 
+class CaptureModes(Enum):
+    Mic = "-MIC-"  # the microphone only, mono.
+    Dual = "-DUAL-"  # the microphone and the speaker loopback as two channels.
+
+
+class OverflowPolicies(Enum):
+    DropOldest = "-DROP-OLDEST-"  # drop the oldest queued audio.
+    Coalesce = "-COALESCE-"  # merge new audio into the last queued message, then drop the oldest.
+    Spill = "-SPILL-"  # write the overflow to a temporary file and send it from there.
+
+
+class AnswerStrategies(Enum):
+    Parallel = "-PARALLEL-"  # a short and a long answer request at once.
+    Dual = "-DUAL-"  # both answers from a single structured request.
+    OnDemand = "-ON-DEMAND-"  # the short answer at once, the long one when asked for or idle.
+
+
 INTERVIEW_POSTION = "python developer"
 OPENAI_API_KEY =  os.environ['OPENAI_API_KEY']
 DEEPGRAM_API_KEY = os.environ['DEEPGRAM_API_KEY']
 
-OUTPUT_FILE_NAME = "out.wav"  # audio file name.
+RECORDING_FORMAT = "WAV"  # format of the recorded audio file: WAV, FLAC or OGG.
+RECORDING_QUEUE_FRAMES = 500  # maximum number of captured frames waiting to be written to disk.
+RECORDING_CLOSE_TIMEOUT_SEC = 5  # [sec]. time given to the queued frames to be written on close.
+OUTPUT_FILE_NAME = f"out.{RECORDING_FORMAT.lower()}"  # audio file name.
 
-SAMPLE_RATE = 48000  # [Hz]. sampling rate.
+SAMPLE_RATE = 16000  # [Hz]. sampling rate of the audio sent for transcription and recorded.
+RESAMPLE_ZERO_CROSSINGS = 16  # half-width of the resampling filter, in zero crossings.
 RECORD_SEC = 1  # [sec]. duration recording audio.
+FRAME_MS = 20  # [ms]. duration of a single captured audio frame.
+RING_BUFFER_SEC = 2  # [sec]. amount of captured audio kept in the ring buffer.
+CAPTURE_MODE = CaptureModes.Mic  # capture the agent only, or the agent and the caller apart.
+AGENT_CHANNEL = 0  # channel of the microphone (the agent) in dual capture.
+CALLER_CHANNEL = 1  # channel of the speaker loopback (the caller) in dual capture.
+
+ANSWER_CACHE_SIZE = 256  # maximum number of cached answers.
+ANSWER_CACHE_TTL_SEC = 3600  # [sec]. time to live of a cached answer.
+FAQ_NGRAM_SIZE = 3  # length of the character n-grams of the FAQ index.
+FAQ_MATCH_THRESHOLD = 0.4  # minimum cosine similarity of an FAQ match.
+FAQ_MIN_OVERLAP = 0.5  # minimum share of the content words of an FAQ question a match contains.
+SPECULATIVE_MODE = False  # generate answers on stable interim transcripts.
+SPECULATION_STABLE_SEC = 0.4  # [sec]. how long an interim transcript must be stable.
+SPECULATION_MATCH_RATIO = 0.9  # minimum similarity of a speculated and a final transcript.
+SESSION_POOL_WORKERS = 32  # size of the thread pool shared by all call sessions.
+VAD_GATING = True  # send only speech (and keepalives during silence) for live transcription.
+VAD_WINDOW_MS = 10  # [ms]. analysis window of the voice activity detector.
+VAD_MARGIN_DB = 12  # [dB]. energy above the noise floor that counts as voiced.
+VAD_MIN_ENERGY_DB = -50  # [dBFS]. minimum energy that counts as voiced.
+VAD_MAX_ZCR = 0.4  # maximum zero-crossing rate (per sample) that counts as voiced.
+VAD_HANGOVER_MS = 500  # [ms]. audio still sent after the last voiced frame.
+VAD_PREROLL_MS = 200  # [ms]. audio sent before the first voiced frame.
+KEEPALIVE_SEC = 5  # [sec]. interval of keepalive messages while no audio is sent.
+RECONNECT_BASE_SEC = 0.25  # [sec]. first delay between reconnect attempts.
+RECONNECT_MAX_SEC = 8  # [sec]. maximum delay between reconnect attempts.
+REPLAY_BUFFER_SEC = 30  # [sec]. amount of audio buffered while reconnecting.
+SEND_QUEUE_FRAMES = 250  # maximum number of captured frames waiting to be sent.
+SEND_OVERFLOW_POLICY = OverflowPolicies.Coalesce  # what happens to audio sent to a full queue.
+SEND_COALESCE_BYTES = 64000  # [bytes]. maximum size of a coalesced message.
+SEND_CLOSE_TIMEOUT_SEC = 2  # [sec]. time given to the queued audio to be sent on close.
+SERVER_HOST = "127.0.0.1"  # interface of the headless suggestion server.
+SERVER_PORT = 8765  # port of the headless suggestion server.
+SERVER_MAX_MESSAGE_BYTES = 1 << 20  # maximum size of a message sent to the server.
+TRANSCRIBE_CHUNK_SEC = 30  # [sec]. maximum duration of a chunk of a prerecorded transcription.
+TRANSCRIBE_WORKERS = 4  # maximum number of chunks transcribed at once.
+TRANSCRIBE_RETRIES = 2  # number of retries of a chunk that failed to transcribe.
+TRANSCRIBE_RETRY_BASE_SEC = 0.5  # [sec]. first delay before retrying a chunk.
+CONTEXT_TOKEN_BUDGET = 600  # maximum number of tokens of earlier turns sent with a prompt.
+CONTEXT_SUMMARY_TOKENS = 150  # maximum number of tokens of the summary of older turns.
+ANSWER_STRATEGY = AnswerStrategies.Parallel  # how the short and long answers are generated.
+LONG_ANSWER_IDLE_SEC = 10  # [sec]. idle time after which an on-demand long answer is generated.
+ANSWER_MODELS = ("gpt-3.5-turbo", "gpt-4o-mini")  # answer models, the primary one first.
+TRANSCRIPTION_MODELS = ("nova-2", "nova")  # prerecorded transcription models, the primary first.
+HEDGE_PERCENTILE = 0.95  # latency percentile of a backend after which a request is hedged.
+HEDGE_DEFAULT_DELAY_SEC = 1.5  # [sec]. hedge delay of a backend with too few latency samples.
+HEDGE_MIN_DELAY_SEC = 0.2  # [sec]. minimum hedge delay.
+HEDGE_MIN_SAMPLES = 20  # number of latencies of a backend needed to set its hedge delay.
+TRANSCRIBE_HEDGE_DEFAULT_DELAY_SEC = 5  # [sec]. hedge delay of a transcription backend at first.
+LLM_CONCURRENCY_INITIAL = 4  # initial number of requests to a model in flight at once.
+LLM_CONCURRENCY_MIN = 1  # minimum number of requests to a model in flight at once.
+LLM_CONCURRENCY_MAX = 64  # maximum number of requests to a model in flight at once.
+LLM_LATENCY_TARGET_SEC = 3  # [sec]. time to the first token above which a model is congested.
+LLM_REQUEST_DEADLINE_SEC = 8  # [sec]. time an answer request has to start, retries included.
+LLM_RETRY_BASE_SEC = 0.25  # [sec]. maximum delay before the first retry of an answer request.
+LLM_RETRY_MAX_SEC = 4  # [sec]. maximum delay before a retry of an answer request.
+LLM_BREAKER_FAILURES = 5  # consecutive failed requests after which a model is failed fast.
+LLM_BREAKER_RESET_SEC = 15  # [sec]. time a model is failed fast before it is probed again.
+LLM_MAX_IN_FLIGHT = 2  # maximum number of answer requests of the window running at once.
+STREAM_UPDATE_SEC = 0.05  # [sec]. minimum interval between partial answer updates.
+ARCHIVE_PATH = "calls.db"  # SQLite file the calls, their utterances and answers are archived in.
+ARCHIVE_BATCH_SIZE = 256  # maximum number of archive writes committed at once.
+ARCHIVE_FLUSH_SEC = 1  # [sec]. maximum time an archive write waits to be committed.
+ARCHIVE_ID_BLOCK = 1000  # number of call or utterance identifiers an archive reserves at once.
+ARCHIVE_MATCH_RATIO = 0.85  # minimum similarity of an archived utterance whose answer is reused.
+ARCHIVE_MIN_WORDS = 4  # minimum number of words of an utterance an archived answer is reused for.
+ARCHIVE_CANDIDATES = 20  # number of the best ranked archived utterances compared with a new one.
+ARCHIVE_QUERY_TERMS = 3  # number of the least common words of an utterance it is looked up by.
+ARCHIVE_TERM_CACHE_SIZE = 50000  # maximum number of cached archive word counts.
+ARCHIVE_TERM_CACHE_TTL_SEC = 3600  # [sec]. time to live of a cached archive word count.
+RENDER_FRAME_SEC = 1 / 60  # [sec]. minimum interval between renders of the window.
+RENDER_EVENT = "-RENDER-"  # event the window renders queued updates on.
+LAG_PROBE_SEC = 0.25  # [sec]. interval between measurements of the window's event-loop lag.
+LAG_EVENT = "-LAG-PROBE-"  # event the window's event-loop lag is measured with.
 
 APPLICATION_WIDTH = 100
 OFF_IMAGE = b"iVBORw0KGgoAAAANSUhEUgAAAGQAAAAoCAYAAAAIeF9DAAAPpElEQVRoge1b63MUVRY//Zo3eQHyMBEU5LVYpbxdKosQIbAqoFBraclatZ922Q9bW5b/gvpBa10+6K6WftFyxSpfaAmCEUIEFRTRAkQFFQkkJJghmcm8uqd763e6b+dOZyYJktoiskeb9OP2ne7zu+d3Hve2smvXLhqpKIpCmqaRruu1hmGsCoVCdxiGMc8wjNmapiUURalGm2tQeh3HSTuO802xWDxhmmaraZotpmkmC4UCWZZFxWKRHMcZVjMjAkQAEQqFmiORyJ+j0ei6UCgUNgyDz6uqym3Edi0KlC0227YBQN40zV2FQuHZbDa7O5fLOQBnOGCGBQTKNgzj9lgs9s9EIrE4EomQAOJaVf5IBYoHAKZpHs7lcn9rbm7+OAjGCy+8UHKsD9W3ruuRSCTyVCKR+Es8HlfC4bAPRF9fHx0/fpx+/PFH6unp4WOYJkbHtWApwhowYHVdp6qqKqqrq6Pp06fTvHnzqLq6mnWAa5qmLTYM48DevXuf7e/vf+Suu+7KVep3kIWsXbuW/7a0tDREo9Ed1dXVt8bjcbYK/MB3331HbW1t1N7eTgAIFoMfxSZTF3lU92sUMcplisJgxJbL5Sifz1N9fT01NjbSzTffXAKiaZpH+/v7169Zs+Yszr344oslFFbWQlpaWubGYrH3a2pqGmKxGCv74sWL9Pbbb1NnZyclEgmaNGmST13kUVsJ0h4wOB8EaixLkHIEKKAmAQx8BRhj+/btNHnyZNqwYQNNnDiR398wjFsTicSBDz74oPnOO+/8Gro1TbOyhWiaVh+Pxz+ura3FXwbj8OHDtHv3bgI448aNYyCg5Ouvv55mzJjBf2traykajXIf2WyWaQxWdOrUKTp//rww3V+N75GtRBaA4lkCA5NKpSiTydDq1atpyZIlfkvLstr7+/tvTyaT+MuAUhAQVVUjsVgMYABFVvzOnTvp888/Z34EIDgHjly6dCmfc3vBk4leFPd/jBwo3nHo559/pgMfHaATX59ApFZCb2NJKkVH5cARwAAUKBwDdOHChbRu3Tq/DegrnU4DlBxAwz3aQw895KpRUaCsp6urq9fDQUHxsIojR47QhAkTCNYCAO677z5acNttFI3FyCGHilaRUqk0myi2/nSaRwRMV9c1UhWFYrEozZo9mx3eyW9OMscGqexq3IJS7hlJOk+S3xTnvLyNB+L333/P4MycOVMYwGRN02pt234PwHFAJCxE1/Vl48aNO1hXV6fAEj777DPCteuuu44d9w033EDr16/3aQlKv3TpEv8tHS6exXiCvmpqaigWj5NCDqXT/bT9tdfoYnc39yWs5WqXcr6j0rHwK/I+KAy66u7upubmZlq8eLG47mQymeU9PT0fg95UD00lFAptSyQSHNrCgcM6xo8fz2DceOONtHnTJt4v2kXq7LxAHR0d7CvYccujRlNIwchX3WO06ejopM6ODrKsIgP0xy1bGGhhSRgZV7sELaNcRBnclzcwDt4dLAPdAhih+3A4/A8wEKyIAdE0bU0kEuGkDyaGaAo3YwMod999NyvZtCx20JlMf8lDkaK6ICgq8X/sRrxj1QUMwJw/D1BMvu8P99/PYTPCRAHI1Uxf5aLESvQ1FChQPPQKHQvRNG1pNBpdDf2rHl2hHMI3nD592g9tcdy8ppl03eCR3N3VxT5D5n9331U6/2XLUEv2Fe9vsWjRha5uKloWhUMGbdiwnjkVPkVEGWPNUoLnKJB/BdvACqBb6Bg5nbhmGMZWpnBVVWpDodDvw+EQO+H9+/fzDbhx9uzZTC2OU6Te3l5Wms/3AV9R8tCOe9FRSps4pJBdtCh56RKHyfX1DTRnzhx2dgAf/mQ0Iy9ky0jMFi1aVHL+k08+YWWAs4WibrnlFlq+fPmQ/bW2ttJPP/1EW7ZsGbLdiRMn2P/KdT74EfFbYAboGAn2rFlu4qjrGjCoVVVVawqFQiHDCHG0hNwBSKGjhYsWckf5XJ5yHBkJK3AtwPcVgq48y1A0lVRN8Y5Vv72GB1I1DgXzuRw5tsPZLHwJnJ5cdrnSbdq0afTAAw8MAgOybNkyVuqUKVN8yxxJJRa0i204wful0+lBVEwD1sA6hq77+lI8eBVFBQZNqqZpvxMZ97Fjxxg9HONhq6uq2IlnsjkXaU/xLlVppLHCNRck35m759FO0zyHrwpwNB8kvJjt2DS+bjxn/fAloMWRKGY4gWXI8X4luffee5kJ8LsjEQyakVArgEBbYRWyyNQFXUPnQoCFrmnafFwEICgUohEU1tDQQLbtlQXsImmqihyPFMWjI4bbIdUBFam8r5CbCJLi0pU79AjunRzVvU/1ruPFsOHhkO0fOnRoIFu9QtpasGCBv//DDz/Qu+++S2fOnOF3RMSIeh1yIggS3D179pQMhMcee4yTWVEWEgI9wfKEwDHv27dvUPUBx3DecjgvrguQ0Aa6xvMJqgQWuqqqMwXP4SHA4xCMWlGbwYh3exXde0onDwQSICnAhc+riuIn74yh15oR5HMqjyIEDPUN9cynIgS+0rxEKBuOc9u2bczXSG5h+QgiXn31VXrwwQc5t4KffOutt0pCb7QTpaCgUhEJyccoJUH5QfBEqUi0C1q+qBIjg5f6m6Fjlk84H/AekjgcV1VXk+Ol/6Cjih5ciOfkub2iuqA4A5Yi4GMsaaCtYxdpwvgJPh1cKWWBrjCSIaADhJg4J49YKB/hOwCBgnFdBuTRRx8d1O/JkyfZksSAhSBRxiYLAoXnn3/eD1AqvY+okCeTSd96VFWtASBVgtegFNFJyNDdhwTlqKXoO/6oH8BpiKDLvY5+yjSwHcdNOD0KG80kEX5KTBHIIxj7YAMhSNaG+12E5hiwsJyhBP0gIsXAFgOjkgidCwEWuhzNyOk+/Af8BUdRnqpLaojSUen5YSTQGC8gttFw6HIfsI5KRUxQspCuri6aOnXqkP1isCB6Gu4ZOSq9zLxKfj7dcZw+x3Gq0BG4U/wgRhfMXCR//s3Sv25hl52GDw1T0zAIKS5zMSUWbZsLkqMlGJ1QCCwD1dUDBw6UHf1w7hBEdwBEVsrjjz8+yKmDXuCL5HZw6shNhFMXDhu+J+hTyonQuRBgoXsrJqpwDlVesUIC3BaJRlh7hqaxB/B8OXk+2hvtiqi4+2gzpqoHkIi6PJ5TvAQRlFfwKOpCV9eoluORaM6dO5dp4+GHH+aKNWpvUBIsA5EVSkLkRWHBAieOca/s1EVkFHTyACno1L11CEM+o5hhRFAgRWCXdNu2TxWLxQaghYdEZIJ9/J00eTKRbZIaCZPDilcGrMJz0H6465kEY6EKvDwa5PkRhfy4S3HbF7MWJ4ciJA2+8C8RvBzmbwAIBGGqHKoGZceOHX6oLysa5wTlyRIsi4iioezsg/Mj5WhORLCYUZTuO606jnNMOFPkAzB37KNE4BRdSsEmlKX5SR6SQdU77yaFqtfGTQA1r6blZvAaZ/AaX1M4D7FdJ+7Y9O2335aMUnlJzS/ZEOm8+eabw8KJFR9ggmB4e7kSLL3L7yCfl6/h3aHrm266yffhtm0fV23b3i8mR+bPn8+NgBx4NZnsYZ7PZtxMHQBwJq55ZRKpNKJ5inYVrvrZO498v42bteNcNpsjx7G5DI0QFCNytOZG8Bznzp2j5557jvbu3TvoOsrfTzzxBE8vI+TFCB8pXVZSMlUAo9IcPJeP8nmuoQmxbbsVlNViWVbBsqwQHg4ZOhwjlHPkiy9oxR13kJ3P880iKWKK4mxcJHkeiSkDeYbrLRQ/ifTDAcWhXD5Hhby7EqZ1XyuHh6JaUO4lfomgLzwz1gOgYArnLSIfXMO7iOQPx0ePHuUAALOeGBTwIeWeBZNyTz75pF9shd8dDozgOYS6CJqga+l3gEELoiwsd3wvn89vxMOtXLmSXn75ZR6xKKXM6ezkim9vX68/Hy78uVISbXl+Y8C1uDgEEhVMUvVe6iWbHDrXfo6OHT/GeYBY8zVagJBUwkDfcp1M8dZLydVlgCCmIMjL1is9B/oT+YjwfZXAKAeMyGk2btzotykWi8Agyfxgmua/gBiQmzVrFq8iwTFuRljHcTXTWDfPaah+kVHMhahSAdGt6mr+vIjq+ReVR1R3dxf3hQryG2+84U+EyRYyWiJCdvSN3wA4YoKIZ+ekyE6uwoqp5XI0JqItWJhYxXk5YIhKMPIelG1owGqegc4ZENu2d+fz+cNi9m7Tpk0MiEASnGuaFs/2dXRcoGwmw5EUNkVUc0maPfRnEL3pTkXhEjumcTHraBaLXE/CbyBslOP2K3Xo/4tNVra8lQNA3jDgUUuDLjZv3iw780PZbHYP9K0hTvc6OKYoyp9CoZDCixJiMfrqq694FKATOF6Ej7AAHMMpozDII01xfUq5OQwoHY4bnIsySSFf4AVkyAvgs8DBQ43Iq0VGa5EDEk5MiUvW4eTz+ft7e3vP4roMSLvjOBN1XV8CM4TyoUxM6YIzAQJm2VA1TcQTbDHpVIp9S8Es8LFYHIb7+nr7qKu7i3r7+tgqIOfOtdMrr/yHHaMMxtW6eC44+iu1Ce4PBQYWyzU1NfnXsTo+lUr9G8EE1xI//PBDv0NVVaPxePwgFsqJFYrvvPMOT3lCeeBcOEdUSRcvXkS1NdJCOZIrjAOFeeyjxNzW9hFXTGF5oClBVWNlGRCNwkI5VAjuuecevw0WyqVSqd8mk8ks2vCMqQwIuWUDfykplAaFARAAA/qCtXhL7KmurpamT5tOU6ZiKalbagAUuWyOkj1JOtt+1l80IRxr0ImPFTCCUinPKLeUFMoGTWHqWAiWknqrFnkpqZi1HATIqlWrMFk0Nx6P82Jrsb4XieLrr7/O88CinO0MfP8wqGKrDHzk409Xim2sLiWly1hsDdoW0RSCJFFdRlvLss729/c3NzY2fo3gRi7Bl139joZtbW3LHcfZYds2f46AXGTr1q1MO8h+kaNAsZVWi/gZvLeUUvGmbRFJ4IHHsgR9RPBzBGzwwcgzsKpGBq9QKOBzhI0rVqw4Q16RUZaKH+w0Njae3b9//+22bT9lWZb/wQ6iA/wIoqYvv/ySK6siivLXp5aJtsYqNVUSAYao7MLHYmEIyvooQckTWZ4F4ZO2Z9Pp9CNNTU05+ZosZSkrKAcPHsQnbU/H4/ElYgX8/z9pG14kSj+UyWT+vnLlyoNBAF566aWS4xEBIuTTTz/Fcse/RqPRteFwOCy+ExHglFtuea2IHCJ7/qRgmubOfD7/jPfRpz+TOFQYPQiQoUQ4asMw8Fk0FtitCIVCv9F1nT+LVlW16hoFJOU4Tsq2bXwWfdyyrNZCodBSKBSScNgjXsBBRP8FGptkKVwR+ZoAAAAASUVORK5CYII="
@@ -75,3 +169,17 @@ LONGER_INSTRUCTION = (
     "Before answering, take a deep breath and think one step at a time. Believe the answer in no "
     "more than 150 words."
 )
+SHORT_MARKER = "SHORT:"
+LONG_MARKER = "LONG:"
+DUAL_INSTRUCTION = (
+    f"Answer twice. First write {SHORT_MARKER} followed by a concise answer of no more than 70 "
+    f"words. Then, on a new line, write {LONG_MARKER} followed by a fuller answer of no more than "
+    "150 words."
+)
+SUMMARY_INSTRUCTION = (
+    "You keep notes on a phone call with a customer of Avoca Air Conditioning. Update the notes "
+    "with the new turns of the call, what the customer said and what the agent answered. Keep "
+    "every detail already collected (problem, age of the system, name, address, callback number, "
+    "email) and what is still missing. Answer with the updated notes only, in no more than 100 "
+    "words."
+)
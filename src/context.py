@@ -0,0 +1,156 @@
+"""Token-budgeted conversation context with a rolling summary of older turns."""
+from concurrent.futures import Executor
+from typing import Callable, Optional
+import math
+import threading
+
+from loguru import logger
+
+from src.constants import CONTEXT_SUMMARY_TOKENS, CONTEXT_TOKEN_BUDGET
+
+# How the turns of each chat role are labelled for the summary.
+SPEAKERS = {"user": "Customer", "assistant": "Agent"}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of `text`, at about four characters per token.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    """
+    Cuts `text` down to about `tokens` tokens at a word boundary.
+    """
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:tokens * 4].rsplit(" ", 1)[0]
+
+
+class ConversationContext:
+    """
+    The earlier turns of a call, as sent along with every prompt: what the customer said, as
+    "user" turns, and the answers suggested to the agent, as "assistant" turns.
+
+    Recent turns are kept verbatim. Once they outgrow the budget left by the summary, the oldest
+    ones are folded into a running summary by `summarize` on the `executor`, so the summary is
+    updated off the critical path. Until a fold completes, `messages` simply leaves out whatever
+    does not fit, so a prompt never exceeds `budget_tokens` of context however long the call runs.
+
+    Args:
+        summarize (Callable[[str, list[str]], str]): Updates a summary with the given turns,
+        each labelled with its speaker, e.g. "Customer: ...".
+        executor (Executor, optional): Runs the summarization. Summarizes synchronously if
+        missing.
+        budget_tokens (int): The maximum size of the context. Defaults to the value of
+        CONTEXT_TOKEN_BUDGET.
+        summary_tokens (int): The maximum size of the summary. Defaults to the value of
+        CONTEXT_SUMMARY_TOKENS.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str, list[str]], str],
+        executor: Optional[Executor] = None,
+        budget_tokens: int = CONTEXT_TOKEN_BUDGET,
+        summary_tokens: int = CONTEXT_SUMMARY_TOKENS
+    ):
+        self.summarize = summarize
+        self.executor = executor
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.folds = 0
+        self._turns = []  # (turn, answered, role, text), answered being the user turn answered.
+        self._next_turn = 0
+        self._folding = False
+        self._lock = threading.Lock()
+
+    def add_turn(
+        self, text: str, role: str = "user", answers: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Adds a turn of `role`, "user" or "assistant", and starts folding the oldest turns if
+        they no longer fit.
+
+        An assistant turn that `answers` a user turn is placed right after it and the answers it
+        has already, even if the customer has spoken since; it goes first if that turn has been
+        folded. Other turns are appended.
+
+        Args:
+            text (str): The text of the turn.
+            role (str): The chat role of the turn. Defaults to "user".
+            answers (int, optional): The identifier of the user turn answered.
+
+        Returns:
+            Optional[int]: The identifier of the turn, or None if `text` is empty.
+        """
+        if not text:
+            return None
+        with self._lock:
+            turn = self._next_turn
+            self._next_turn += 1
+            answered = turn if answers is None else answers
+            index = next(
+                (i for i, other in enumerate(self._turns) if other[1] > answered),
+                len(self._turns)
+            )
+            self._turns.insert(index, (turn, answered, role, text))
+            verbatim = sum(estimate_tokens(other[3]) for other in self._turns)
+            if self._folding or verbatim <= self.budget_tokens - self.summary_tokens:
+                return turn
+            # Fold down to half of the verbatim budget, so folds are rare and batched.
+            keep_tokens = (self.budget_tokens - self.summary_tokens) // 2
+            folded = []
+            while len(self._turns) - len(folded) > 1 and verbatim > keep_tokens:
+                folded.append(self._turns[len(folded)])
+                verbatim -= estimate_tokens(folded[-1][3])
+            self._folding = True
+        if self.executor is not None:
+            self.executor.submit(self._fold, folded)
+        else:
+            self._fold(folded)
+        return turn
+
+    def _fold(self, turns: list[tuple[int, int, str, str]]) -> None:
+        try:
+            summary = self.summarize(
+                self.summary, [f"{SPEAKERS[role]}: {text}" for _, _, role, text in turns]
+            )
+        except Exception as e:
+            logger.warning(f"Can't summarize the conversation: {e}")
+            with self._lock:
+                self._folding = False
+            return
+        with self._lock:
+            self.summary = truncate_tokens(summary, self.summary_tokens)
+            # Answers may have been placed among the folded turns in the meantime:
+            folded = {turn[0] for turn in turns}
+            self._turns = [turn for turn in self._turns if turn[0] not in folded]
+            self.folds += 1
+            self._folding = False
+
+    def messages(self) -> list[dict]:
+        """
+        Returns the context as chat messages: the summary, then as many of the most recent
+        turns as fit in the budget.
+        """
+        with self._lock:
+            summary, turns = self.summary, list(self._turns)
+        messages = []
+        remaining = self.budget_tokens
+        if summary:
+            remaining -= estimate_tokens(summary)
+        for _, _, role, turn in reversed(turns):
+            remaining -= estimate_tokens(turn)
+            if remaining < 0:
+                break
+            messages.append({"role": role, "content": turn})
+        messages.reverse()
+        if summary:
+            messages.insert(0, {"role": "system", "content": f"Earlier in the call: {summary}"})
+        return messages
+
+    def tokens(self) -> int:
+        return sum(estimate_tokens(message["content"]) for message in self.messages())
@@ -0,0 +1,147 @@
+"""Local retrieval of the answers listed in the system prompt's "Commonly Asked Questions"."""
+from dataclasses import dataclass
+from typing import Optional
+import math
+import re
+
+import numpy as np
+
+from src.archive import STOPWORDS
+from src.constants import FAQ_MATCH_THRESHOLD, FAQ_MIN_OVERLAP, FAQ_NGRAM_SIZE, SYSTEM_PROMPT
+
+
+@dataclass
+class FaqEntry:
+    question: str
+    answer: str
+
+
+@dataclass
+class FaqMatch:
+    entry: FaqEntry
+    score: float
+
+
+def parse_faq(prompt: str = SYSTEM_PROMPT) -> list[FaqEntry]:
+    """
+    Extracts the question and answer pairs from the "Commonly Asked Questions" block of a prompt.
+
+    Args:
+        prompt (str): The prompt to parse. Defaults to the value of SYSTEM_PROMPT.
+
+    Returns:
+        list[FaqEntry]: The parsed entries, in prompt order.
+    """
+    block = prompt.split("Commonly Asked Questions:", 1)[-1].split("Last Line:", 1)[0]
+    entries = []
+    for match in re.finditer(r"Q:(.*?)\nA:(.*?)(?=\n\s*\n|\Z)", block, re.S):
+        question, answer = (' '.join(part.split()) for part in match.groups())
+        entries.append(FaqEntry(question, answer))
+    return entries
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(re.sub(r"[^\w\s]", ' ', text.lower()).split())
+
+
+def _content_words(text: str) -> set[str]:
+    # The words of `text` that aren't stopwords, crudely stemmed so "scheduled" matches
+    # "schedule" and "coming" matches "come".
+    return {
+        re.sub(r"(ing|ed|es|s|e)$", '', word) or word
+        for word in _normalize(text).split() if word not in STOPWORDS
+    }
+
+
+class FaqIndex:
+    """
+    TF-IDF index over character n-grams of the FAQ questions.
+
+    Questions are embedded once into an L2-normalized matrix, so a lookup is a single
+    matrix-vector product. N-grams that do not occur in any question still count towards the
+    query norm, so long transcripts that merely contain a question score lower than a close
+    paraphrase.
+
+    Character n-grams also reward questions that only sound alike ("what time is it" and "What
+    time can you come out?"), so a match must in addition contain at least `min_overlap` of the
+    content words of its question.
+
+    Args:
+        entries (list[FaqEntry]): The entries to index.
+        ngram_size (int): The length of the character n-grams. Defaults to the value of
+        FAQ_NGRAM_SIZE.
+        threshold (float): The minimum cosine similarity of a match. Defaults to the value of
+        FAQ_MATCH_THRESHOLD.
+        min_overlap (float): The minimum share of the content words of the matched question the
+        transcript contains. Defaults to the value of FAQ_MIN_OVERLAP.
+    """
+
+    def __init__(
+        self,
+        entries: list[FaqEntry],
+        ngram_size: int = FAQ_NGRAM_SIZE,
+        threshold: float = FAQ_MATCH_THRESHOLD,
+        min_overlap: float = FAQ_MIN_OVERLAP
+    ):
+        self.entries = entries
+        self.ngram_size = ngram_size
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self._content_words = [_content_words(entry.question) for entry in entries]
+
+        grams = [self._ngrams(entry.question) for entry in entries]
+        self._vocabulary = {g: i for i, g in enumerate(sorted({g for q in grams for g in q}))}
+        counts = np.zeros((len(entries), len(self._vocabulary)), dtype=np.float32)
+        for row, question_grams in enumerate(grams):
+            np.add.at(counts[row], [self._vocabulary[g] for g in question_grams], 1)
+
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self._idf = (np.log((1 + len(entries)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self._unknown_idf = math.log(1 + len(entries)) + 1
+        weights = counts * self._idf
+        self._matrix = weights / np.linalg.norm(weights, axis=1, keepdims=True)
+
+    def _ngrams(self, text: str) -> list[str]:
+        text = f" {_normalize(text)} "
+        return [text[i:i + self.ngram_size] for i in range(len(text) - self.ngram_size + 1)]
+
+    def scores(self, text: str) -> np.ndarray:
+        """
+        Returns the cosine similarity of `text` to every indexed question.
+        """
+        indices = np.fromiter(
+            (self._vocabulary.get(g, -1) for g in self._ngrams(text)), dtype=np.int64
+        )
+        known = indices[indices >= 0]
+        query = np.bincount(known, minlength=len(self._vocabulary)).astype(np.float32) * self._idf
+        norm_squared = float(query @ query) + (len(indices) - len(known)) * self._unknown_idf ** 2
+        if norm_squared == 0:
+            return np.zeros(len(self.entries), dtype=np.float32)
+        return self._matrix @ query / math.sqrt(norm_squared)
+
+    def lookup(self, text: str) -> Optional[FaqMatch]:
+        """
+        Returns the best matching entry, or None if no question is similar enough or the best
+        one shares too few content words with `text`.
+
+        Args:
+            text (str): The transcript to match.
+
+        Returns:
+            Optional[FaqMatch]: The best match above the threshold.
+        """
+        if not self.entries:
+            return None
+        scores = self.scores(text)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        question_words = self._content_words[best]
+        if question_words and (
+            len(question_words & _content_words(text)) / len(question_words) < self.min_overlap
+        ):
+            return None
+        return FaqMatch(self.entries[best], float(scores[best]))
+
+
+FAQ_INDEX = FaqIndex(parse_faq())
@@ -0,0 +1,330 @@
+"""Strategies for generating the short and long suggested answers of an utterance."""
+from collections import deque
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass
+from typing import Callable, Generator, Optional
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from src import llm
+from src.constants import ANSWER_STRATEGY, LONG_ANSWER_IDLE_SEC, AnswerStrategies
+from src.tracing import Trace
+
+answer_stats = deque(maxlen=100)
+
+
+@dataclass
+class AnswerStats:
+    """
+    Token and latency figures of the answers of one utterance.
+
+    Latencies are in seconds from the start of the generation; `long_latency` is None if the long
+    answer was never generated.
+    """
+    strategy: str
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    short_latency: Optional[float] = None
+    long_latency: Optional[float] = None
+
+
+def summarize_answer_stats(stats: Optional[list[AnswerStats]] = None) -> dict:
+    """
+    Summarizes answer statistics by strategy.
+
+    Args:
+        stats (list[AnswerStats], optional): The statistics to summarize. Defaults to the ones
+        of the last 100 utterances.
+
+    Returns:
+        dict: For every strategy, the number of utterances, the mean requests and tokens per
+        utterance, the share of utterances that got a long answer, and the median latencies.
+    """
+    stats = list(answer_stats) if stats is None else stats
+    summary = {}
+    for strategy in sorted({s.strategy for s in stats}):
+        group = [s for s in stats if s.strategy == strategy]
+        short = [s.short_latency for s in group if s.short_latency is not None]
+        long = [s.long_latency for s in group if s.long_latency is not None]
+        summary[strategy] = {
+            "utterances": len(group),
+            "requests": float(np.mean([s.requests for s in group])),
+            "prompt_tokens": float(np.mean([s.prompt_tokens for s in group])),
+            "completion_tokens": float(np.mean([s.completion_tokens for s in group])),
+            "long_answer_share": len(long) / len(group),
+            "short_latency_p50": float(np.median(short)) if short else None,
+            "long_latency_p50": float(np.median(long)) if long else None,
+        }
+    return summary
+
+
+class SuggestedAnswers:
+    """
+    The short and long answers of an utterance.
+
+    Both answers are futures. `short` is None if the short answer was found elsewhere. The long
+    answer of the on-demand strategy is only generated once `request_long` is called or its idle
+    timer fires. `cancel` drops the answers once they are superseded, e.g. when the next utterance
+    comes: answers that have not started are cancelled, and streaming ones stop at their next
+    token and fail with CancelledError.
+    """
+
+    def __init__(self, strategy: AnswerStrategies, short_answered: bool):
+        self.strategy = strategy
+        self.short = None if short_answered else Future()
+        self.long = Future()
+        self.stats = AnswerStats(strategy.name)
+        self.started_at = time.perf_counter()
+        self.cancelled = False
+        self._start_long = None
+        self._long_requested = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self.long.add_done_callback(lambda _: answer_stats.append(self.stats))
+
+    def request_long(self) -> None:
+        """
+        Starts generating the long answer if it is waiting to be asked for, or as soon as it can
+        be started.
+        """
+        with self._lock:
+            start, self._start_long = self._start_long, None
+            self._long_requested = start is None
+            if self._timer:
+                self._timer.cancel()
+        if start:
+            start()
+
+    def cancel(self) -> None:
+        """
+        Cancels the answers that are not complete.
+        """
+        with self._lock:
+            self.cancelled = True
+            self._start_long = None
+            if self._timer:
+                self._timer.cancel()
+        if self.short:
+            self.short.cancel()
+        self.long.cancel()
+
+    def _defer_long(self, start: Callable[[], None], idle_sec: float) -> None:
+        with self._lock:
+            if self.long.done():
+                return
+            self._start_long = start
+            if not self._long_requested:
+                self._timer = threading.Timer(idle_sec, self.request_long)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.request_long()
+
+    def _record(self, stats: llm.GenerationStats) -> None:
+        with self._lock:
+            self.stats.requests += not stats.cached
+            self.stats.prompt_tokens += stats.prompt_tokens
+            self.stats.completion_tokens += stats.completion_tokens
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+
+def _drain(
+    stream: Generator,
+    on_token: Callable[[str], None],
+    answers: SuggestedAnswers
+) -> llm.GenerationStats:
+    # Iterates a stream of `llm` and returns the statistics it returns once exhausted. Closing a
+    # stream of cancelled answers stops its request, so it stops using tokens.
+    while True:
+        if answers.cancelled:
+            stream.close()
+            raise CancelledError("The answers were superseded")
+        try:
+            on_token(next(stream))
+        except StopIteration as stop:
+            return stop.value
+
+
+class AnswerGenerator:
+    """
+    Generates the short and long suggested answers of utterances with one of `AnswerStrategies`:
+
+    - Parallel: a short and a long answer request at once, each with the whole system prompt.
+    - Dual: a single request whose structured response holds the short and then the long answer,
+      so the prompt is only sent once and the short answer is ready as early as before.
+    - OnDemand: the short answer at once, and the long answer only when the agent asks for it or
+      nothing else happened for `idle_sec` seconds.
+
+    Partial answers are passed to `on_partial` with a flag telling whether the text is the short
+    answer; the figures of every utterance are appended to `answer_stats`.
+
+    Args:
+        submit (Callable[..., Future]): Runs a function in the background, e.g.
+        `CallSession.submit`.
+        strategy (AnswerStrategies): The strategy. Defaults to the value of ANSWER_STRATEGY.
+        idle_sec (float): The idle time before an on-demand long answer is generated. Defaults to
+        the value of LONG_ANSWER_IDLE_SEC.
+
+    Example:
+        ```python
+        generator = AnswerGenerator(session.submit, AnswerStrategies.Dual)
+        answers = generator.answer("What hours are you open?", [], print)
+        print(answers.short.result(), answers.long.result())
+        ```
+    """
+
+    def __init__(
+        self,
+        submit: Callable[..., Future],
+        strategy: AnswerStrategies = ANSWER_STRATEGY,
+        idle_sec: float = LONG_ANSWER_IDLE_SEC
+    ):
+        self.submit = submit
+        self.strategy = strategy
+        self.idle_sec = idle_sec
+
+    def answer(
+        self,
+        transcript: str,
+        context: list[dict],
+        on_partial: Callable[[bool, str], None],
+        trace: Optional[Trace] = None,
+        short_answered: bool = False
+    ) -> SuggestedAnswers:
+        """
+        Starts generating the answers of an utterance.
+
+        Args:
+            transcript (str): The transcript to answer.
+            context (list[dict]): The context messages of the earlier turns of the call.
+            on_partial (Callable[[bool, str], None]): Receives the partial answers.
+            trace (Trace, optional): The trace stamped with the request, first token and
+            completion of the short answer.
+            short_answered (bool): Whether the short answer was already found elsewhere, in which
+            case only the long answer is generated.
+
+        Returns:
+            SuggestedAnswers: The answers.
+        """
+        answers = SuggestedAnswers(self.strategy, short_answered)
+        if self.strategy == AnswerStrategies.Dual and not short_answered:
+            self.submit(self._dual, answers, transcript, context, on_partial, trace)
+            return answers
+
+        def start_long() -> None:
+            self.submit(
+                self._single, answers, answers.long, transcript, False, 0.7, context, on_partial
+            )
+
+        if not short_answered:
+            short = self.submit(
+                self._single,
+                answers,
+                answers.short,
+                transcript,
+                True,
+                0,
+                context,
+                on_partial,
+                trace,
+            )
+        if self.strategy != AnswerStrategies.OnDemand:
+            start_long()
+        elif short_answered:
+            answers._defer_long(start_long, self.idle_sec)
+        else:
+            short.add_done_callback(lambda _: answers._defer_long(start_long, self.idle_sec))
+        return answers
+
+    def _single(
+        self,
+        answers: SuggestedAnswers,
+        future: Future,
+        transcript: str,
+        short_answer: bool,
+        temperature: float,
+        context: list[dict],
+        on_partial: Callable[[bool, str], None],
+        trace: Optional[Trace] = None
+    ) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        tokens = []
+
+        def on_token(token: str) -> None:
+            if trace and not tokens:
+                trace.mark("first_token")
+            tokens.append(token)
+            on_partial(short_answer, ''.join(tokens))
+
+        if trace:
+            trace.mark("llm_request")
+        try:
+            stream = llm.generate_answer_stream(transcript, short_answer, temperature, context)
+            answers._record(_drain(stream, on_token, answers))
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if trace:
+            trace.mark("completion")
+        if short_answer:
+            answers.stats.short_latency = answers._elapsed()
+        else:
+            answers.stats.long_latency = answers._elapsed()
+        future.set_result(''.join(tokens))
+
+    def _dual(
+        self,
+        answers: SuggestedAnswers,
+        transcript: str,
+        context: list[dict],
+        on_partial: Callable[[bool, str], None],
+        trace: Optional[Trace] = None
+    ) -> None:
+        if not answers.long.set_running_or_notify_cancel():
+            answers.short.cancel()
+            return
+        answers.short.set_running_or_notify_cancel()
+        tokens = []
+
+        def finish_short(short: str) -> None:
+            if answers.short.done():
+                return
+            if trace:
+                trace.mark("completion")
+            answers.stats.short_latency = answers._elapsed()
+            answers.short.set_result(short)
+
+        def on_token(token: str) -> None:
+            if trace and not tokens:
+                trace.mark("first_token")
+            tokens.append(token)
+            short, long = llm.split_dual_answer(''.join(tokens))
+            if long is None:
+                on_partial(True, short)
+            else:
+                finish_short(short)
+                on_partial(False, long)
+
+        if trace:
+            trace.mark("llm_request")
+        try:
+            stream = llm.generate_dual_answer_stream(transcript, 0, context)
+            answers._record(_drain(stream, on_token, answers))
+        except Exception as e:
+            if not answers.short.done():
+                answers.short.set_exception(e)
+            answers.long.set_exception(e)
+            return
+        short, long = llm.split_dual_answer(''.join(tokens))
+        if long is None:
+            logger.warning("The dual answer has no long answer, using the short one")
+        finish_short(short)
+        answers.stats.long_latency = answers._elapsed()
+        answers.long.set_result(long if long is not None else short)
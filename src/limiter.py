@@ -0,0 +1,296 @@
+"""Adaptive concurrency limiting, retries and circuit breaking for LLM requests."""
+from typing import Iterator, Optional
+import random
+import threading
+import time
+
+from loguru import logger
+
+from src.constants import (
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_SEC,
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MAX,
+    LLM_CONCURRENCY_MIN,
+    LLM_LATENCY_TARGET_SEC,
+    LLM_REQUEST_DEADLINE_SEC,
+    LLM_RETRY_BASE_SEC,
+    LLM_RETRY_MAX_SEC
+)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+_DONE = object()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+def status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def _is_timeout(error: Exception) -> bool:
+    # The OpenAI client's timeout error does not derive from TimeoutError.
+    return isinstance(error, TimeoutError) or type(error).__name__ == "APITimeoutError"
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Returns whether a request that failed with `error` may succeed if sent again: rate limits,
+    server errors, timeouts and connection errors.
+    """
+    if status_code(error) is not None:
+        return status_code(error) in RETRYABLE_STATUS_CODES
+    return (
+        _is_timeout(error)
+        or isinstance(error, ConnectionError)
+        or type(error).__name__ == "APIConnectionError"
+    )
+
+
+def is_congestion(error: Exception) -> bool:
+    """
+    Returns whether `error` means the provider is overloaded: a rate limit or a timeout.
+    """
+    return status_code(error) == 429 or _is_timeout(error)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the delay a rate limited response asked for in its Retry-After header, if any.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of requests in flight with additive increase, multiplicative decrease.
+
+    Every successful request that responded within `latency_target` raises the limit by about
+    one per limit's worth of requests. A rate limited (429) or slow request halves it, at most
+    once per `latency_target` seconds so a burst of failures from the same congestion only counts
+    once. The limit thus settles just under the point where the provider starts pushing back.
+
+    Args:
+        initial (float): The initial limit. Defaults to the value of LLM_CONCURRENCY_INITIAL.
+        min_limit (float): The minimum limit. Defaults to the value of LLM_CONCURRENCY_MIN.
+        max_limit (float): The maximum limit. Defaults to the value of LLM_CONCURRENCY_MAX.
+        latency_target (float): The time to the first token above which a request counts as
+        congested, in seconds. Defaults to the value of LLM_LATENCY_TARGET_SEC.
+    """
+
+    def __init__(
+        self,
+        initial: float = LLM_CONCURRENCY_INITIAL,
+        min_limit: float = LLM_CONCURRENCY_MIN,
+        max_limit: float = LLM_CONCURRENCY_MAX,
+        latency_target: float = LLM_LATENCY_TARGET_SEC
+    ):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.decreases = 0
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline: float) -> None:
+        """
+        Waits for a free slot until `deadline`, a `time.monotonic()` value.
+
+        Raises:
+            TimeoutError: If no slot freed up in time.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("No LLM request slot freed up before the deadline")
+                self._condition.wait(remaining)
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self, latency: float) -> None:
+        if latency > self.latency_target:
+            self.on_congestion()
+            return
+        with self._condition:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify()
+
+    def on_congestion(self) -> None:
+        with self._condition:
+            now = time.monotonic()
+            if now - self._decreased_at < self.latency_target:
+                return
+            self._decreased_at = now
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.decreases += 1
+        logger.debug(f"LLM concurrency limit lowered to {self.limit:.1f}")
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the provider is unhealthy.
+
+    After `failures` consecutive failed requests the breaker opens and `check` raises at once.
+    Once `reset_sec` seconds have passed, a single probe request is let through: the breaker
+    closes if it succeeds and opens again if it fails.
+
+    Args:
+        failures (int): The consecutive failures that open the breaker. Defaults to the value of
+        LLM_BREAKER_FAILURES.
+        reset_sec (float): How long the breaker stays open. Defaults to the value of
+        LLM_BREAKER_RESET_SEC.
+    """
+
+    def __init__(
+        self,
+        failures: int = LLM_BREAKER_FAILURES,
+        reset_sec: float = LLM_BREAKER_RESET_SEC
+    ):
+        self.failures = failures
+        self.reset_sec = reset_sec
+        self.opened = 0
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self) -> None:
+        """
+        Raises CircuitOpenError unless a request may be sent.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.reset_sec:
+                raise CircuitOpenError("The LLM provider is unhealthy")
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("LLM circuit breaker closed")
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or (self._opened_at is None and self._consecutive >= self.failures):
+                if not self._probing:
+                    self.opened += 1
+                    logger.warning("LLM circuit breaker opened")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LimitedAnswerBackend:
+    """
+    Answer backend that paces, retries and circuit-breaks the requests of another one.
+
+    A request waits for a slot of the `limiter`, and the time to its first chunk drives the
+    limit. A request that fails before its first chunk with a retryable error is sent again after
+    a jittered exponential backoff (or the delay a 429 asked for), as long as it can still start
+    before `deadline_sec` is over. Failures other than rate limits also feed the `breaker`, which
+    rejects requests with CircuitOpenError while it is open. Once the first chunk arrived the
+    response is passed through as is, since a stream can't be retried halfway.
+
+    Args:
+        backend: The answer backend whose requests are limited.
+        limiter (AdaptiveLimiter, optional): The concurrency limiter. Defaults to a new one.
+        breaker (CircuitBreaker, optional): The circuit breaker. Defaults to a new one.
+        deadline_sec (float): The time a request has to start, retries included. Defaults to
+        the value of LLM_REQUEST_DEADLINE_SEC.
+    """
+
+    def __init__(
+        self,
+        backend,
+        limiter: Optional[AdaptiveLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        deadline_sec: float = LLM_REQUEST_DEADLINE_SEC
+    ):
+        self.backend = backend
+        self.name = backend.name
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.deadline_sec = deadline_sec
+        self.retries = 0
+
+    def stream(self, messages: list[dict], temperature: float) -> Iterator:
+        deadline = time.monotonic() + self.deadline_sec
+        attempt = 0
+        while True:
+            self.limiter.acquire(deadline)
+            try:
+                self.breaker.check()
+            except CircuitOpenError:
+                self.limiter.release()
+                raise
+            started_at = time.monotonic()
+            response = None
+            try:
+                response = self.backend.stream(messages, temperature)
+                chunks = iter(response)
+                first = next(chunks, _DONE)
+            except Exception as error:
+                self.limiter.release()
+                if not is_retryable(error):
+                    # The provider answered, so it is healthy even though the request was wrong.
+                    self.breaker.record_success()
+                    raise
+                if is_congestion(error):
+                    self.limiter.on_congestion()
+                if status_code(error) != 429:
+                    # A rate limit is for the limiter to handle; the provider itself is healthy.
+                    self.breaker.record_failure()
+                delay = retry_after(error) or random.uniform(
+                    0, min(LLM_RETRY_MAX_SEC, LLM_RETRY_BASE_SEC * 2 ** attempt)
+                )
+                if time.monotonic() + delay >= deadline:
+                    raise
+                logger.debug(f"Retrying {self.name} in {delay:.2f} sec: {error}")
+                time.sleep(delay)
+                attempt += 1
+                self.retries += 1
+                continue
+            break
+
+        self.breaker.record_success()
+        self.limiter.on_success(time.monotonic() - started_at)
+        try:
+            if first is not _DONE:
+                yield first
+                yield from chunks
+        except GeneratorExit:
+            getattr(response, "close", lambda: None)()
+            raise
+        finally:
+            self.limiter.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "decreases": self.limiter.decreases,
+            "retries": self.retries,
+            "breaker_open": self.breaker.is_open,
+            "breaker_opened": self.breaker.opened,
+        }
@@ -1,37 +1,120 @@
 from collections import deque
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Generator, Optional
+import re
 import threading
+import time
 
 from loguru import logger
-from deepgram import (
-    DeepgramClient,
-    DeepgramClientOptions,
-    FileSource,
-    LiveOptions,
-    LiveTranscriptionEvents,
-    PrerecordedOptions,
-)
-from openai import OpenAI
 
+from src.backends import (
+    DeepgramTranscriber,
+    HedgedAnswerBackend,
+    HedgedTranscriber,
+    Hedger,
+    OpenAIChatBackend
+)
+from src import faq
+from src.cache import LRUTTLCache
+from src.connections import LiveConnection, get_deepgram_client
+from src.context import estimate_tokens
+from src.limiter import LimitedAnswerBackend
 from src.constants import (
+    ANSWER_CACHE_SIZE,
+    ANSWER_MODELS,
+    ANSWER_CACHE_TTL_SEC,
+    DUAL_INSTRUCTION,
+    LONG_MARKER,
     OPENAI_API_KEY,
     OUTPUT_FILE_NAME,
-    DEEPGRAM_API_KEY,
+    SAMPLE_RATE,
     SYSTEM_PROMPT,
+    SHORT_MARKER,
     SHORTER_INSTRUCTION,
-    LONGER_INSTRUCTION
+    LONGER_INSTRUCTION,
+    SUMMARY_INSTRUCTION,
+    TRANSCRIBE_HEDGE_DEFAULT_DELAY_SEC,
+    TRANSCRIPTION_MODELS
+)
+from src.prerecorded import ChunkedTranscriber
+from src.transcript import TranscriptBuffer
+
+
+client = None
+_client_lock = threading.Lock()
+transcription_backend = HedgedTranscriber(
+    [DeepgramTranscriber(model) for model in TRANSCRIPTION_MODELS],
+    Hedger(default_delay=TRANSCRIBE_HEDGE_DEFAULT_DELAY_SEC),
 )
+generation_stats = deque(maxlen=100)
+answer_cache = LRUTTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SEC)
+fallback_cache = LRUTTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SEC)
+_system_prompts = {}
+_prompts_day = None
+_prompts_lock = threading.Lock()
+
+
+def get_openai_client():
+    """
+    Returns the process-wide OpenAI client, importing the SDK and creating it on first use.
+    """
+    global client  # pylint: disable=global-statement
+
+    with _client_lock:
+        if client is None:
+            from openai import OpenAI  # pylint: disable=import-outside-toplevel
+
+            client = OpenAI(api_key=OPENAI_API_KEY)
+        return client
+
+
+answer_backend = HedgedAnswerBackend([
+    LimitedAnswerBackend(OpenAIChatBackend(get_openai_client, model)) for model in ANSWER_MODELS
+])
+
+
+@dataclass
+class GenerationStats:
+    """
+    Timings of a single streamed answer, in seconds, and its token counts.
+
+    `short_answer` is None for a dual answer. The token counts are the ones reported by the API,
+    or estimated if it reported none; a cached answer, or a fallback answer given while the LLM
+    can't be reached, uses no tokens.
+    """
+    short_answer: Optional[bool]
+    time_to_first_token: Optional[float]
+    total_time: float
+    cached: bool = False
+    fallback: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
 
+def transcribe_buffer(buffer_data: bytes) -> str:
+    """
+    Transcribes an audio file held in memory with a single request, hedged across the
+    TRANSCRIPTION_MODELS.
+
+    Args:
+        buffer_data (bytes): The content of the audio file.
+
+    Returns:
+        str: The transcribed text.
+    """
+    return transcription_backend.transcribe(buffer_data)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-dg_connection = None
-transcript_queue = deque()
+
+chunked_transcriber = ChunkedTranscriber(transcribe_buffer)
 
 
 def transcribe_audio(path_to_file: str = OUTPUT_FILE_NAME) -> str:
     """
     Transcribes an audio file into text.
 
+    Long recordings are split at pauses and the chunks are transcribed in parallel.
+
     Args:
         path_to_file (str, optional): The path to the audio file to be transcribed.
 
@@ -43,96 +126,93 @@ def transcribe_audio(path_to_file: str = OUTPUT_FILE_NAME) -> str:
     """
 
     try:
-        deepgram = DeepgramClient()
-        with open(path_to_file, "rb") as file:
-            buffer_data = file.read()
-        payload: FileSource = {"buffer": buffer_data}
-
-        options = PrerecordedOptions(
-            model="nova-2",
-            smart_format=True,
-        )
-        response = deepgram.listen.rest.v("1").transcribe_file(payload, options)
-
-        return response.results.channels[0].alternatives[0].transcript
+        return chunked_transcriber.transcribe(path_to_file)
     except Exception as e:
         logger.error(f"Can't transcribe audio: {e}")
         raise e
 
 
-def start_dg_connection():
-    global dg_connection  # pylint: disable=global-statement
-
-    def on_open(self, open, **kwargs):
-        logger.info("Connection Open")
-
+def start_dg_connection(
+    transcript: TranscriptBuffer,
+    sample_rate: int = SAMPLE_RATE,
+    channels: int = 1,
+    channel_transcripts: Optional[dict[int, TranscriptBuffer]] = None
+) -> LiveConnection:
+    """
+    Opens a live Deepgram connection that writes its results into a transcript.
 
-    def on_message(self, result, **kwargs):
-        sentence = result.channel.alternatives[0].transcript
-        if len(sentence) == 0:
-            return
-        if result.is_final:
-            logger.debug(f"Transcription: {sentence}")
-            if len(transcript_queue) > 0 and not transcript_queue[-1][0]:
-                transcript_queue.pop()
-            transcript_queue.append((True, sentence))
-        else:
-            logger.debug(f"Interim transcription: {sentence}")
-            if len(transcript_queue) > 0:
-                transcript_queue.pop()
-            transcript_queue.append((False, sentence))
+    The connection reconnects on its own and replays the audio sent while it was down. Audio of
+    several channels is transcribed channel by channel.
 
-    def on_error(self, error, **kwargs):
-        logger.error(f"Error: {error}")
+    Args:
+        transcript (TranscriptBuffer): The transcript that receives interim and final results.
+        sample_rate (int): The sample rate of the linear16 audio that will be sent. Defaults to
+        the value of SAMPLE_RATE.
+        channels (int): The number of interleaved channels of the audio. Defaults to 1.
+        channel_transcripts (dict[int, TranscriptBuffer], optional): The transcripts that
+        receive the results of some channels instead of `transcript`, by channel index.
 
-    def on_speech_started(self, speech_started, **kwargs):
-        logger.debug("Speech Started")
+    Returns:
+        LiveConnection: The started live connection.
 
+    Raises:
+        Exception: If the connection fails to start.
+    """
+    from deepgram import LiveOptions  # pylint: disable=import-outside-toplevel
+
+    options = LiveOptions(
+        model="nova-2",
+        language="en-US",
+        smart_format=True,
+        encoding="linear16",
+        channels=channels,
+        sample_rate=sample_rate,
+        multichannel=channels > 1,
+        interim_results=True,
+        utterance_end_ms="1000",
+        vad_events=True,
+        endpointing=100,
+    )
     try:
-        deepgram = DeepgramClient(
-            api_key=DEEPGRAM_API_KEY,
-            config=DeepgramClientOptions(options={"keepalive": "true"})
-        )
-        dg_connection = deepgram.listen.websocket.v("1")
-        dg_connection.on(LiveTranscriptionEvents.Transcript, on_message)
-        dg_connection.on(LiveTranscriptionEvents.Error, on_error)
-        dg_connection.on(LiveTranscriptionEvents.Open, on_open)
-        dg_connection.on(LiveTranscriptionEvents.SpeechStarted, on_speech_started)
-
-        options = LiveOptions(
-            model="nova-2",
-            language="en-US",
-            smart_format=True,
-            encoding="linear16",
-            channels=1,
-            sample_rate=48000,
-            interim_results=True,
-            utterance_end_ms="1000",
-            vad_events=True,
-            endpointing=100,
+        dg_connection = LiveConnection(
+            transcript,
+            options,
+            bytes_per_sec=sample_rate * channels * 2,
+            channel_transcripts=channel_transcripts
         )
-        dg_connection.start(options)
+        dg_connection.start()
     except Exception as e:
         logger.error(f"Can't start Deepgram connection: {e}")
         raise e
+    return dg_connection
 
 
-def close_dg_connection():
+def warm_up() -> None:
+    """
+    Creates the shared Deepgram client and opens the OpenAI HTTP connection ahead of the first
+    request. Both SDKs are imported here on first use, so this is best run in the background.
+    """
+    get_deepgram_client()
+    try:
+        get_openai_client().models.list()
+    except Exception as e:
+        logger.warning(f"Can't warm up the OpenAI client: {e}")
+
+
+def close_dg_connection(dg_connection) -> None:
     dg_connection.finish()
 
 
-def transcribe_audio_realtime(audio_data: bytes) -> str:
+def transcribe_audio_realtime(dg_connection, audio_data: bytes) -> None:
     """
-    Transcribes a chunk of audio data into text.
+    Sends a chunk of audio data to a live connection for transcription.
 
     Args:
+        dg_connection: The live connection returned by `start_dg_connection`.
         audio_data (bytes): The audio data to be transcribed.
 
-    Returns:
-        str: The transcribed text.
-
     Raises:
-        Exception: If the audio file fails to transcribe.
+        Exception: If the audio data fails to send.
     """
     try:
         dg_connection.send(audio_data)
@@ -141,15 +221,162 @@ def transcribe_audio_realtime(audio_data: bytes) -> str:
         raise e
 
 
-def generate_answer(transcript: str, short_answer: bool = True, temperature: float = 0.7) -> str:
+def _next_business_day(day: date, days_ahead: int) -> date:
+    result = day + timedelta(days=days_ahead)
+    if result.strftime('%a') == 'Sat':
+        result += timedelta(days=2)
+    elif result.strftime('%a') == 'Sun':
+        result += timedelta(days=1)
+    return result
+
+
+def get_scheduling_prompt(day: Optional[date] = None) -> str:
+    """
+    Builds the scheduling part of the system prompt for the given day.
+
+    Args:
+        day (date, optional): The day of the call. Defaults to today.
+
+    Returns:
+        str: The scheduling prompt.
+    """
+    day = day or date.today()
+    schedule_date = _next_business_day(day, 2)
+    return (
+        'The current date is {} so the first day you can schedule is {} morning. '
+        'A live agent can still call between 7:30 AM to 8:30 AM {} though.'
+    ).format(
+        day.strftime('%A, %B %d'),
+        schedule_date.strftime('%A, %B %d'),
+        schedule_date.strftime('%A, %B %d')
+    )
+
+
+def get_system_prompt(short_answer: Optional[bool]) -> str:
+    """
+    Returns the system prompt for the requested answer length.
+
+    The prompt variants are built once per day and rebuilt when the date rolls over, which also
+    clears the answer cache since cached answers may refer to the previous scheduling day.
+
+    Args:
+        short_answer (bool, optional): Whether the prompt is for a short answer or not, or None
+        for a prompt that asks for both a short and a long answer.
+
+    Returns:
+        str: The system prompt.
+    """
+    global _prompts_day  # pylint: disable=global-statement
+
+    today = date.today()
+    with _prompts_lock:
+        if _prompts_day != today:
+            base_prompt = SYSTEM_PROMPT.format(scheduling_prompt=get_scheduling_prompt(today))
+            _system_prompts[True] = base_prompt + SHORTER_INSTRUCTION
+            _system_prompts[False] = base_prompt + LONGER_INSTRUCTION
+            _system_prompts[None] = base_prompt + DUAL_INSTRUCTION
+            _prompts_day = today
+            answer_cache.clear()
+            fallback_cache.clear()
+        return _system_prompts[short_answer]
+
+
+def _normalize(transcript: str) -> str:
+    return ' '.join(re.sub(r"[^\w\s']", ' ', transcript.lower()).split())
+
+
+def _answer_cache_key(
+    transcript: str,
+    short_answer: Optional[bool],
+    temperature: float,
+    context: Optional[list[dict]] = None
+) -> tuple:
+    earlier = tuple(message["content"] for message in context or ())
+    return _normalize(transcript), short_answer, temperature, earlier, _prompts_day
+
+
+def _fallback_key(transcript: str, short_answer: Optional[bool]) -> tuple:
+    return _normalize(transcript), short_answer, _prompts_day
+
+
+def fallback_answer(transcript: str, short_answer: Optional[bool]) -> Optional[str]:
+    """
+    Returns an answer for when the LLM can't be reached: the last answer generated for the same
+    transcript whatever its context and temperature, or else the matching FAQ answer.
+
+    Args:
+        transcript (str): The transcript to answer.
+        short_answer (bool, optional): Whether the answer is a short one, or None for a dual
+        answer.
+
+    Returns:
+        Optional[str]: The answer, or None if there is none.
+    """
+    answer = fallback_cache.get(_fallback_key(transcript, short_answer))
+    if answer is not None:
+        return answer
+    match = faq.FAQ_INDEX.lookup(transcript)
+    if match is None:
+        return None
+    answer = match.entry.answer.format(scheduling_prompt=get_scheduling_prompt())
+    if short_answer is None:
+        return f"{SHORT_MARKER} {answer}\n{LONG_MARKER} {answer}"
+    return answer
+
+
+def _messages(system_prompt: str, transcript: str, context: Optional[list[dict]]) -> list[dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        *(context or ()),
+        {"role": "user", "content": transcript},
+    ]
+
+
+def summarize_conversation(summary: str, turns: list[str]) -> str:
+    """
+    Folds earlier turns of a call into its running summary, with the ANSWER_MODELS through
+    `answer_backend`, so summaries are paced, hedged and circuit-broken like answers.
+
+    Args:
+        summary (str): The current summary, empty at first.
+        turns (list[str]): The turns to add to the summary, oldest first, each labelled with its
+        speaker.
+
+    Returns:
+        str: The updated summary.
     """
-    Generates an answer based on the given transcript using the OpenAI GPT-3.5-turbo model.
+    new_turns = '\n'.join(turns)
+    messages = [
+        {"role": "system", "content": SUMMARY_INSTRUCTION},
+        {"role": "user", "content": f"Notes so far: {summary or 'none'}\n\n{new_turns}"},
+    ]
+    return ''.join(
+        chunk.choices[0].delta.content
+        for chunk in answer_backend.stream(messages, 0)
+        if chunk.choices and chunk.choices[0].delta.content
+    )
+
+
+def generate_answer(
+    transcript: str,
+    short_answer: bool = True,
+    temperature: float = 0.7,
+    context: Optional[list[dict]] = None
+) -> str:
+    """
+    Generates an answer based on the given transcript with the ANSWER_MODELS, hedging a late
+    request to the next model.
+
+    The answer is streamed and joined, so it shares the cache and statistics of
+    `generate_answer_stream`.
 
     Args:
         transcript (str): The transcript to generate an answer from.
         short_answer (bool): Whether to generate a short answer or not. Defaults to True.
         temperature (float): The temperature parameter for controlling the randomness of the
         generated answer.
+        context (list[dict], optional): Messages with the earlier turns of the call, as returned
+        by `ConversationContext.messages`.
 
     Returns:
         str: The generated answer.
@@ -164,39 +391,162 @@ def generate_answer(transcript: str, short_answer: bool = True, temperature: flo
     Raises:
         Exception: If the LLM fails to generate an answer.
     """
-    now = datetime.now()
-    schedule_date = now + timedelta(days=2)
-    if schedule_date.strftime('%a') == 'Sat':
-        schedule_date += timedelta(days=2)
-    elif schedule_date.strftime('%a') == 'Sun':
-        schedule_date += timedelta(days=1)
-
-    call_date = now + timedelta(days=1)
-    if call_date.strftime('%a') == 'Sat':
-        call_date += timedelta(days=2)
-    elif call_date.strftime('%a') == 'Sun':
-        call_date += timedelta(days=1)
-    schedule = (
-        'The current time and date is {} so the first day you can schedule is {} morning. '
-            .format(now.strftime('%I:%M %p %A, %B %d'), schedule_date.strftime('%A, %B %d')),
-        'A live agent can still call between 7:30 AM to 8:30 AM {} though.'
-            .format(schedule_date.strftime('%A, %B %d'))
-    )
+    return ''.join(generate_answer_stream(transcript, short_answer, temperature, context))
 
-    if short_answer:
-        system_prompt = SYSTEM_PROMPT.format(scheduling_prompt=schedule) + SHORTER_INSTRUCTION
-    else:
-        system_prompt = SYSTEM_PROMPT.format(scheduling_prompt=schedule) + LONGER_INSTRUCTION
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            temperature=temperature,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": transcript},
-            ],
+
+def generate_answer_stream(
+    transcript: str,
+    short_answer: bool = True,
+    temperature: float = 0.7,
+    context: Optional[list[dict]] = None
+) -> Generator[str, None, GenerationStats]:
+    """
+    Streaming variant of `generate_answer` that yields the answer token by token.
+
+    The time to the first token, the total generation time and the token counts are appended to
+    `generation_stats` once the stream is exhausted, and returned as the value of the generator.
+    Cached answers are yielded in one piece.
+
+    Args:
+        transcript (str): The transcript to generate an answer from.
+        short_answer (bool): Whether to generate a short answer or not. Defaults to True.
+        temperature (float): The temperature parameter for controlling the randomness of the
+        generated answer.
+        context (list[dict], optional): Messages with the earlier turns of the call.
+
+    Yields:
+        str: The next piece of the generated answer.
+
+    Example:
+        ```python
+        for token in generate_answer_stream("What hours are you open?"):
+            print(token, end="")
+        ```
+
+    Raises:
+        Exception: If the LLM fails to generate an answer.
+    """
+    return (yield from _stream_answer(transcript, short_answer, temperature, context))
+
+
+def generate_dual_answer_stream(
+    transcript: str,
+    temperature: float = 0,
+    context: Optional[list[dict]] = None
+) -> Generator[str, None, GenerationStats]:
+    """
+    Streams a short and a long answer from a single request.
+
+    The response holds the short answer after SHORT_MARKER and then the long answer after
+    LONG_MARKER; `split_dual_answer` separates them, even from a partial response. Statistics are
+    recorded as in `generate_answer_stream`, with `short_answer` set to None.
+
+    Args:
+        transcript (str): The transcript to generate the answers from.
+        temperature (float): The temperature of both answers. Defaults to 0.
+        context (list[dict], optional): Messages with the earlier turns of the call.
+
+    Yields:
+        str: The next piece of the response.
+    """
+    return (yield from _stream_answer(transcript, None, temperature, context))
+
+
+def split_dual_answer(response: str) -> tuple[str, Optional[str]]:
+    """
+    Splits a response of `generate_dual_answer_stream` into the short and the long answer.
+
+    Args:
+        response (str): The response so far.
+
+    Returns:
+        tuple[str, Optional[str]]: The short answer, and the long answer or None while the
+        response has not reached it yet.
+    """
+    short, marker, long = response.partition(LONG_MARKER)
+    short = short.strip()
+    if short.startswith(SHORT_MARKER):
+        short = short[len(SHORT_MARKER):]
+    elif SHORT_MARKER.startswith(short):
+        short = ""
+    if marker:
+        return short.strip(), long.strip()
+    # Hold back a long answer marker that has only partly arrived.
+    for length in range(len(LONG_MARKER) - 1, 0, -1):
+        if short.endswith("\n" + LONG_MARKER[:length]):
+            short = short[:-length]
+            break
+    return short.strip(), None
+
+
+def _stream_answer(
+    transcript: str,
+    short_answer: Optional[bool],
+    temperature: float,
+    context: Optional[list[dict]]
+) -> Generator[str, None, GenerationStats]:
+    system_prompt = get_system_prompt(short_answer)
+    cache_key = _answer_cache_key(transcript, short_answer, temperature, context)
+    started_at = time.perf_counter()
+    answer = answer_cache.get(cache_key)
+    if answer is not None:
+        yield answer
+        stats = GenerationStats(
+            short_answer=short_answer,
+            time_to_first_token=0.0,
+            total_time=time.perf_counter() - started_at,
+            cached=True,
         )
+        generation_stats.append(stats)
+        return stats
+
+    messages = _messages(system_prompt, transcript, context)
+    tokens = []
+    usage = None
+    first_token_at = None
+    try:
+        stream = answer_backend.stream(messages, temperature)
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens.append(chunk.choices[0].delta.content)
+            yield tokens[-1]
+    except GeneratorExit:
+        # The answer is no longer wanted: close the response instead of reading it to the end.
+        stream.close()
+        raise
     except Exception as error:
-        logger.error(f"Can't generate answer: {error}")
-        raise error
-    return response.choices[0].message.content
+        answer = None if tokens else fallback_answer(transcript, short_answer)
+        if answer is None:
+            logger.error(f"Can't generate answer: {error}")
+            raise error
+        logger.warning(f"Can't generate answer, falling back to an earlier one: {error}")
+        yield answer
+        stats = GenerationStats(
+            short_answer=short_answer,
+            time_to_first_token=time.perf_counter() - started_at,
+            total_time=time.perf_counter() - started_at,
+            fallback=True,
+        )
+        generation_stats.append(stats)
+        return stats
+
+    answer = ''.join(tokens)
+    answer_cache.put(cache_key, answer)
+    fallback_cache.put(_fallback_key(transcript, short_answer), answer)
+
+    stats = GenerationStats(
+        short_answer=short_answer,
+        time_to_first_token=first_token_at - started_at if first_token_at else None,
+        total_time=time.perf_counter() - started_at,
+        prompt_tokens=usage.prompt_tokens if usage else sum(
+            estimate_tokens(message["content"]) for message in messages
+        ),
+        completion_tokens=usage.completion_tokens if usage else estimate_tokens(answer),
+    )
+    generation_stats.append(stats)
+    logger.debug(f"Answer generated: {stats}")
+    return stats
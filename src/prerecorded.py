@@ -0,0 +1,165 @@
+"""Parallel transcription of recordings split at silence."""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+import io
+import time
+
+import numpy as np
+import soundfile as sf
+from loguru import logger
+
+from src.constants import (
+    TRANSCRIBE_CHUNK_SEC,
+    TRANSCRIBE_RETRIES,
+    TRANSCRIBE_RETRY_BASE_SEC,
+    TRANSCRIBE_WORKERS,
+    VAD_WINDOW_MS
+)
+from src.vad import frame_features
+
+SILENCE_SEARCH_MS = 200  # [ms]. span over which the energy is averaged when looking for a pause.
+
+
+@dataclass
+class ChunkTranscript:
+    """Transcript of one chunk of a recording, with its position in seconds."""
+    index: int
+    start: float
+    end: float
+    text: str
+
+
+def split_at_silence(
+    samples: np.ndarray,
+    sample_rate: int,
+    chunk_sec: float = TRANSCRIBE_CHUNK_SEC
+) -> list[tuple[int, int]]:
+    """
+    Splits a signal into chunks of at most `chunk_sec` seconds, cutting at pauses.
+
+    Every cut is placed at the quietest point of the second half of the chunk, measured as the
+    energy averaged over SILENCE_SEARCH_MS, so words are not split between chunks.
+
+    Args:
+        samples (np.ndarray): The int16 samples of a mono signal.
+        sample_rate (int): The sample rate of the signal.
+        chunk_sec (float): The maximum duration of a chunk. Defaults to the value of
+        TRANSCRIBE_CHUNK_SEC.
+
+    Returns:
+        list[tuple[int, int]]: The start and end sample of every chunk.
+    """
+    window = max(1, sample_rate * VAD_WINDOW_MS // 1000)
+    chunk_windows = max(2, int(chunk_sec * sample_rate / window))
+    if len(samples) <= chunk_windows * window:
+        return [(0, len(samples))]
+
+    energy_db, _ = frame_features(samples, window)
+    span = max(1, SILENCE_SEARCH_MS // VAD_WINDOW_MS)
+    energy = np.convolve(10 ** (energy_db / 10), np.ones(span) / span, mode="same")
+
+    bounds = []
+    start = 0
+    while len(energy) - start > chunk_windows:
+        low = start + chunk_windows // 2
+        cut = low + int(np.argmin(energy[low:start + chunk_windows]))
+        bounds.append((start * window, cut * window))
+        start = cut
+    bounds.append((start * window, len(samples)))
+    return bounds
+
+
+class ChunkedTranscriber:
+    """
+    Transcribes a recording as chunks in parallel.
+
+    The recording is split at pauses, every chunk is encoded as WAV and transcribed on a bounded
+    thread pool, and the transcripts are stitched back in order. A failed chunk is retried on its
+    own with exponential backoff; the recording fails only if a chunk runs out of retries.
+
+    Args:
+        transcribe (Callable[[bytes], str]): Transcribes a WAV file held in memory.
+        max_workers (int): The maximum number of chunks transcribed at once. Defaults to the
+        value of TRANSCRIBE_WORKERS.
+        chunk_sec (float): The maximum duration of a chunk. Defaults to the value of
+        TRANSCRIBE_CHUNK_SEC.
+        retries (int): The number of retries of a failed chunk. Defaults to the value of
+        TRANSCRIBE_RETRIES.
+
+    Example:
+        ```python
+        transcriber = ChunkedTranscriber(llm.transcribe_buffer)
+        for chunk in transcriber.transcribe_chunks("out.wav"):
+            print(f"[{chunk.start:.1f}-{chunk.end:.1f}] {chunk.text}")
+        ```
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[bytes], str],
+        max_workers: int = TRANSCRIBE_WORKERS,
+        chunk_sec: float = TRANSCRIBE_CHUNK_SEC,
+        retries: int = TRANSCRIBE_RETRIES
+    ):
+        self.transcribe_buffer = transcribe
+        self.chunk_sec = chunk_sec
+        self.retries = retries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcribe")
+
+    def transcribe_chunks(self, path: str) -> list[ChunkTranscript]:
+        """
+        Transcribes a recording.
+
+        Args:
+            path (str): The path of the audio file.
+
+        Returns:
+            list[ChunkTranscript]: The transcripts of the chunks, in order.
+
+        Raises:
+            Exception: If a chunk fails to transcribe after all retries.
+        """
+        samples, sample_rate = sf.read(path, dtype="int16")
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1).astype(np.int16)
+        bounds = split_at_silence(samples, sample_rate, self.chunk_sec)
+        logger.debug(f"Transcribing {path} as {len(bounds)} chunks")
+        futures = [
+            self.executor.submit(self._transcribe_chunk, samples[start:end], sample_rate)
+            for start, end in bounds
+        ]
+        return [
+            ChunkTranscript(index, start / sample_rate, end / sample_rate, future.result())
+            for index, ((start, end), future) in enumerate(zip(bounds, futures))
+        ]
+
+    def transcribe(self, path: str) -> str:
+        """
+        Transcribes a recording into text.
+
+        Args:
+            path (str): The path of the audio file.
+
+        Returns:
+            str: The transcribed text.
+        """
+        return " ".join(chunk.text for chunk in self.transcribe_chunks(path) if chunk.text)
+
+    def _transcribe_chunk(self, samples: np.ndarray, sample_rate: int) -> str:
+        buffer = io.BytesIO()
+        sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+        data = buffer.getvalue()
+        delay = TRANSCRIBE_RETRY_BASE_SEC
+        for _ in range(self.retries):
+            try:
+                return self.transcribe_buffer(data)
+            except Exception as e:
+                logger.warning(f"Can't transcribe chunk, retrying in {delay:.2f} sec: {e}")
+                time.sleep(delay)
+                delay *= 2
+        # The last attempt's error is raised to the caller.
+        return self.transcribe_buffer(data)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,173 @@
+"""Frame-rate rendering of widget updates from any thread, and event-loop lag measurement."""
+from typing import Any, Callable, Hashable, Optional
+import threading
+import time
+
+from src.constants import LAG_EVENT, LAG_PROBE_SEC, RENDER_EVENT, RENDER_FRAME_SEC
+from src.tracing import LatencyHistogram
+
+
+class RenderScheduler:
+    """
+    Coalesces widget updates into at most one render per frame, on the GUI thread.
+
+    Updates are queued with `update` (replace a widget's value) or `append` (add text to the end
+    of a widget) from any thread. Only the latest value of a widget is kept, and appended text is
+    joined, so however often a widget changes it is redrawn at most once per `frame_sec`. The
+    first queued change of a frame posts a single `event` to the GUI thread, whose handler calls
+    `render` to apply everything queued since.
+
+    Widgets are any objects with an `update(value)` method, and `update(text, append=True)` for
+    the ones text is appended to, like PySimpleGUI elements.
+
+    Args:
+        post (Callable[[str, Any], None]): Posts an event to the GUI thread, e.g.
+        `Window.write_event_value`.
+        frame_sec (float): The minimum interval between renders. Defaults to the value of
+        RENDER_FRAME_SEC.
+        event (str): The event posted to the GUI thread. Defaults to the value of RENDER_EVENT.
+
+    Example:
+        ```python
+        renderer = RenderScheduler(window.write_event_value)
+        renderer.update(transcribed_message, "Hello")  # from any thread
+        ...
+        if event == RENDER_EVENT:  # in the event loop
+            renderer.render()
+        ```
+    """
+
+    def __init__(
+        self,
+        post: Callable[[str, Any], None],
+        frame_sec: float = RENDER_FRAME_SEC,
+        event: str = RENDER_EVENT
+    ):
+        self.post = post
+        self.frame_sec = frame_sec
+        self.event = event
+        self.requests = 0
+        self.renders = 0
+        self.delay = LatencyHistogram()
+        self._updates = {}
+        self._appends = {}
+        self._queued_at = None
+        self._scheduled = False
+        self._rendered_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, widget: Hashable, value: Any) -> None:
+        """
+        Sets the value of `widget` at the next render, replacing any value queued before.
+        """
+        with self._lock:
+            self._updates[widget] = value
+            post_in = self._queue()
+        self._schedule(post_in)
+
+    def append(self, widget: Hashable, text: str) -> None:
+        """
+        Appends `text` to `widget` at the next render.
+        """
+        with self._lock:
+            self._appends.setdefault(widget, []).append(text)
+            post_in = self._queue()
+        self._schedule(post_in)
+
+    def _queue(self) -> Optional[float]:
+        # Returns in how long to post the render event, or None if it is already scheduled.
+        now = time.perf_counter()
+        self.requests += 1
+        if self._queued_at is None:
+            self._queued_at = now
+        if self._scheduled:
+            return None
+        self._scheduled = True
+        return max(0.0, self._rendered_at + self.frame_sec - now)
+
+    def _schedule(self, post_in: Optional[float]) -> None:
+        if post_in is None:
+            return
+        if post_in == 0:
+            self.post(self.event, None)
+            return
+        timer = threading.Timer(post_in, self.post, (self.event, None))
+        timer.daemon = True
+        timer.start()
+
+    def render(self) -> None:
+        """
+        Applies the queued updates. Must be called on the GUI thread.
+        """
+        with self._lock:
+            updates, self._updates = self._updates, {}
+            appends, self._appends = self._appends, {}
+            queued_at, self._queued_at = self._queued_at, None
+            self._scheduled = False
+        for widget, value in updates.items():
+            widget.update(value)
+        for widget, texts in appends.items():
+            widget.update(''.join(texts), append=True)
+        rendered_at = time.perf_counter()
+        with self._lock:
+            self._rendered_at = rendered_at
+        if queued_at is not None:
+            self.delay.observe(rendered_at - queued_at)
+            self.renders += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the number of queued changes and of renders, and the delay from the first change
+        of a render to the render, in seconds.
+        """
+        return {"requests": self.requests, "renders": self.renders, **self.delay.summary()}
+
+
+class LagProbe:
+    """
+    Measures how late the GUI event loop handles events.
+
+    A background thread posts `event` with its send time every `interval_sec`; the event loop
+    passes it to `observe` when it gets to it. The difference is the time the loop was busy
+    with other work, so it grows when rendering or handlers block the loop.
+
+    Args:
+        post (Callable[[str, Any], None]): Posts an event to the GUI thread, e.g.
+        `Window.write_event_value`.
+        interval_sec (float): The interval between probes. Defaults to the value of
+        LAG_PROBE_SEC.
+        event (str): The probe event. Defaults to the value of LAG_EVENT.
+    """
+
+    def __init__(
+        self,
+        post: Callable[[str, Any], None],
+        interval_sec: float = LAG_PROBE_SEC,
+        event: str = LAG_EVENT
+    ):
+        self.post = post
+        self.interval_sec = interval_sec
+        self.event = event
+        self.lag = LatencyHistogram()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="lag-probe", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_sec):
+            self.post(self.event, time.perf_counter())
+
+    def observe(self, sent_at: float) -> None:
+        """
+        Records the lag of a probe handled by the event loop now.
+        """
+        self.lag.observe(time.perf_counter() - sent_at)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def stats(self) -> dict:
+        return self.lag.summary()
@@ -0,0 +1,132 @@
+"""Streaming downmix and sample rate conversion of linear16 audio."""
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.constants import RESAMPLE_ZERO_CROSSINGS
+
+
+def design_filter(up: int, down: int, zero_crossings: int = RESAMPLE_ZERO_CROSSINGS) -> np.ndarray:
+    """
+    Designs the anti-aliasing low-pass filter of a rational resampler.
+
+    Args:
+        up (int): The upsampling factor.
+        down (int): The downsampling factor.
+        zero_crossings (int): The number of zero crossings of the windowed sinc on each side.
+        Defaults to the value of RESAMPLE_ZERO_CROSSINGS.
+
+    Returns:
+        np.ndarray: The filter taps at the upsampled rate, with a gain of `up`.
+    """
+    factor = max(up, down)
+    length = 2 * zero_crossings * factor + 1
+    cutoff = 0.5 / factor * 0.95  # relative to the upsampled rate, just below the lower Nyquist.
+    n = np.arange(length) - (length - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.6)
+    return (taps * up).astype(np.float32)
+
+
+class Resampler:
+    """
+    Stateful polyphase resampler for a mono float signal.
+
+    The conversion ratio is reduced to `up / down`. The filter is split into `up` phases, and each
+    output sample is the dot product of one phase with the latest input samples; a whole block is
+    computed at once by gathering its input windows. The filter history and the phase carry over
+    between calls, so a stream can be converted block by block without discontinuities.
+
+    Args:
+        in_rate (int): The sample rate of the input.
+        out_rate (int): The sample rate of the output.
+        zero_crossings (int): The half-width of the filter in zero crossings. Defaults to the
+        value of RESAMPLE_ZERO_CROSSINGS.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, zero_crossings: int = RESAMPLE_ZERO_CROSSINGS):
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        taps = design_filter(self.up, self.down, zero_crossings)
+        taps = np.pad(taps, (0, -len(taps) % self.up))
+        # phases[p, j] is applied to the input sample j positions before the current one; the
+        # columns are reversed so a phase can be multiplied with a window in chronological order.
+        self.phases = np.ascontiguousarray(taps.reshape(-1, self.up).T[:, ::-1])
+        self.width = self.phases.shape[1]
+        self._history = np.zeros(self.width - 1, dtype=np.float32)
+        self._offset = 0  # position of the next output sample, in 1/up input samples.
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Converts the next block of the stream.
+
+        Args:
+            samples (np.ndarray): The next input samples.
+
+        Returns:
+            np.ndarray: The output samples that became available.
+        """
+        length = len(samples) * self.up
+        count = max(0, -(-(length - self._offset) // self.down))
+        positions = self._offset + self.down * np.arange(count)
+        self._offset += count * self.down - length
+
+        signal = np.concatenate([self._history, samples.astype(np.float32, copy=False)])
+        self._history = signal[len(signal) - len(self._history):]
+        windows = sliding_window_view(signal, self.width)[positions // self.up]
+        return np.einsum("ij,ij->i", windows, self.phases[positions % self.up])
+
+
+class AudioConverter:
+    """
+    Converts interleaved linear16 audio to mono linear16 at another sample rate.
+
+    Channels are averaged before resampling. If the input is already mono at the output rate,
+    frames are passed through untouched.
+
+    Args:
+        in_rate (int): The sample rate of the input.
+        in_channels (int): The number of interleaved input channels.
+        out_rate (int): The sample rate of the output.
+
+    Example:
+        ```python
+        converter = AudioConverter(48000, 2, 16000)
+        frame_16k = converter.process(frame_48k_stereo)
+        ```
+    """
+
+    def __init__(self, in_rate: int, in_channels: int, out_rate: int):
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.out_rate = out_rate
+        self.passthrough = in_rate == out_rate and in_channels == 1
+        self.resampler = None if in_rate == out_rate else Resampler(in_rate, out_rate)
+
+    def process(self, frame: bytes) -> bytes:
+        """
+        Converts the next frame of the stream.
+
+        Args:
+            frame (bytes): Interleaved linear16 samples.
+
+        Returns:
+            bytes: Mono linear16 samples at the output rate.
+        """
+        if self.passthrough:
+            return frame
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        if self.in_channels > 1:
+            samples = samples.reshape(-1, self.in_channels).mean(axis=1)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+
+    def output_samples(self, in_samples: int) -> int:
+        """
+        Returns the maximum number of output samples for `in_samples` input samples per channel.
+        """
+        if self.resampler is None:
+            return in_samples
+        return -(-in_samples * self.resampler.up // self.resampler.down)
@@ -0,0 +1,120 @@
+"""Scheduling of suggestion requests: coalescing, superseding and a concurrency limit."""
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Hashable, Optional
+import threading
+
+from src.constants import LLM_MAX_IN_FLIGHT
+
+
+class SuggestionScheduler:
+    """
+    Schedules the LLM work of suggestions so that only the latest one gets API concurrency.
+
+    Every suggestion begins a new generation with `begin`, unless an identical one (same key) is
+    still in flight, in which case it is coalesced into it. Work is submitted with `submit` and
+    tagged with the generation that was current at the time; at most `max_in_flight` pieces of
+    work run at once and the rest wait in order. Waiting work of a superseded generation is
+    cancelled, and results can be checked with `is_current` so a stale answer never overwrites
+    a newer one.
+
+    Args:
+        submit (Callable[..., Future]): Runs a function in the background, e.g.
+        `CallSession.submit`.
+        max_in_flight (int): The maximum number of requests running at once. Defaults to the
+        value of LLM_MAX_IN_FLIGHT.
+
+    Example:
+        ```python
+        scheduler = SuggestionScheduler(session.submit)
+        generation = scheduler.begin(transcript)
+        if generation is not None:
+            future = scheduler.submit(llm.generate_answer, transcript)
+            ...
+            if scheduler.is_current(generation):
+                show(future.result())
+        ```
+    """
+
+    def __init__(self, submit: Callable[..., Future], max_in_flight: int = LLM_MAX_IN_FLIGHT):
+        self._submit = submit
+        self.max_in_flight = max_in_flight
+        self.generation = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self._key = None
+        self._queue = deque()
+        self._running = 0
+        self._outstanding = 0
+        self._lock = threading.Lock()
+
+    def begin(self, key: Hashable) -> Optional[int]:
+        """
+        Begins a new generation for the suggestion identified by `key`.
+
+        Returns:
+            Optional[int]: The new generation, or None if the same suggestion is still in flight.
+        """
+        with self._lock:
+            if key == self._key and self._outstanding:
+                self.coalesced += 1
+                return None
+            self.generation += 1
+            self._key = key
+            stale = [work[1] for work in self._queue]
+            self._queue.clear()
+            self.superseded += len(stale)
+            self._outstanding = 0
+        for future in stale:
+            future.cancel()
+        return self.generation
+
+    def is_current(self, generation: Optional[int]) -> bool:
+        return generation == self.generation
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Submits work for the current generation, to run once a request slot is free.
+
+        Returns:
+            Future: The future of the work, cancelled if it is superseded before it starts.
+        """
+        future = Future()
+        with self._lock:
+            self._queue.append((self.generation, future, fn, args, kwargs))
+            self._outstanding += 1
+        self._dispatch()
+        return future
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._lock:
+                if self._running >= self.max_in_flight or not self._queue:
+                    return
+                work = self._queue.popleft()
+                self._running += 1
+            self._submit(self._run, *work)
+
+    def _run(self, generation: int, future: Future, fn: Callable, args: tuple, kwargs: dict):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if generation == self.generation:
+                    self._outstanding -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "generation": self.generation,
+                "coalesced": self.coalesced,
+                "superseded": self.superseded,
+                "running": self._running,
+                "queued": len(self._queue),
+            }
@@ -0,0 +1,271 @@
+"""Non-blocking send path for captured audio, with a bounded queue and an overflow policy."""
+from collections import deque
+from typing import Callable, Optional
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+from src.constants import (
+    SEND_CLOSE_TIMEOUT_SEC,
+    SEND_COALESCE_BYTES,
+    SEND_OVERFLOW_POLICY,
+    SEND_QUEUE_FRAMES,
+    OverflowPolicies
+)
+from src.tracing import LatencyHistogram
+
+
+class AudioSender:
+    """
+    Sends captured audio on a dedicated thread, so capture never waits on the network.
+
+    `put` queues a frame and returns at once, and the sender thread hands the queued audio to
+    `send` in order. At most `queue_frames` messages are queued; once a network stall fills the
+    queue, new audio is handled by `policy`:
+
+    - DropOldest: the oldest queued message is dropped to make room.
+    - Coalesce: the frame is appended to the last queued message, up to `coalesce_bytes`, so a
+      stall costs fewer and larger sends rather than audio. Beyond that the oldest message is
+      dropped.
+    - Spill: the frame, and all the audio after it until the sender has caught up, is written to
+      a temporary file and sent from there, so nothing is lost and the order is kept. Its place
+      in the file is reserved under the queue's lock, but the file is written and read outside
+      it, so a slow disk never holds up the other thread.
+
+    Keepalives requested with `keep_alive` are sent by the sender thread too, once nothing is
+    queued.
+
+    Args:
+        send (Callable[[bytes], None]): Sends a message, e.g. `LiveConnection.send`. A message
+        whose send fails is logged and dropped.
+        keep_alive (Callable[[], None], optional): Keeps the connection open while no audio is
+        sent.
+        queue_frames (int): The maximum number of queued messages. Defaults to the value of
+        SEND_QUEUE_FRAMES.
+        policy (OverflowPolicies): What happens to audio put into a full queue. Defaults to the
+        value of SEND_OVERFLOW_POLICY.
+        coalesce_bytes (int): The maximum size of a coalesced message. Defaults to the value of
+        SEND_COALESCE_BYTES.
+        name (str): The name of the sender thread.
+
+    Example:
+        ```python
+        sender = AudioSender(connection.send)
+        for frame in capture.frames(is_recording):
+            sender.put(frame)  # never blocks
+        sender.close()
+        ```
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], None],
+        keep_alive: Optional[Callable[[], None]] = None,
+        queue_frames: int = SEND_QUEUE_FRAMES,
+        policy: OverflowPolicies = SEND_OVERFLOW_POLICY,
+        coalesce_bytes: int = SEND_COALESCE_BYTES,
+        name: str = "audio-sender"
+    ):
+        self.send = send
+        self._keep_alive = keep_alive
+        self.queue_frames = queue_frames
+        self.policy = policy
+        self.coalesce_bytes = coalesce_bytes
+        self.frames = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        self.max_depth = 0
+        self.send_latency = LatencyHistogram()
+        self.delay = LatencyHistogram()
+        self._queue = deque()  # [data, queued_at, frames] of the messages held in memory.
+        # [offset, size, queued_at, written] of the frames held in the spill file, in order. A
+        # frame is sent once written, and its size is None if it couldn't be.
+        self._spilled = deque()
+        self._spill_file = None
+        self._spill_end = 0
+        self._unspilling = False
+        self._spill_lock = threading.Lock()
+        self._keep_alive_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, frame: bytes) -> None:
+        """
+        Queues a frame for sending. Never blocks on the network.
+        """
+        data = bytearray(frame)
+        queued_at = time.perf_counter()
+        spill = None
+        with self._condition:
+            if self._closed:
+                return
+            self.frames += 1
+            if self._spilled or (
+                len(self._queue) >= self.queue_frames and self.policy == OverflowPolicies.Spill
+            ):
+                spill = self._reserve_spill(len(data), queued_at)
+            elif len(self._queue) >= self.queue_frames:
+                self._overflow(data, queued_at)
+            else:
+                self._queue.append([data, queued_at, 1])
+            self.max_depth = max(self.max_depth, len(self._queue) + len(self._spilled))
+            self._condition.notify()
+        if spill is not None:
+            self._write_spill(spill, data)
+
+    def _overflow(self, data: bytearray, queued_at: float) -> None:
+        if self.policy == OverflowPolicies.Coalesce:
+            last = self._queue[-1]
+            if len(last[0]) + len(data) <= self.coalesce_bytes:
+                last[0] += data
+                last[2] += 1
+                self.coalesced += 1
+                return
+        self.dropped += self._queue.popleft()[2]
+        self._queue.append([data, queued_at, 1])
+
+    def _reserve_spill(self, size: int, queued_at: float) -> list:
+        # Called under the lock. Once nothing is left to read, the file is reused from the start.
+        if not self._spilled and not self._unspilling:
+            self._spill_end = 0
+        spill = [self._spill_end, size, queued_at, False]
+        self._spill_end += size
+        self._spilled.append(spill)
+        self.spilled += 1
+        return spill
+
+    def _write_spill(self, spill: list, data: bytearray) -> None:
+        try:
+            with self._spill_lock:
+                if self._closed:
+                    spill[1] = None
+                    return
+                if self._spill_file is None:
+                    self._spill_file = tempfile.TemporaryFile(prefix="audio-spill-")
+                self._spill_file.seek(spill[0])
+                self._spill_file.write(data)
+        except OSError as e:
+            logger.warning(f"Can't spill audio: {e}")
+            spill[1] = None
+        finally:
+            with self._condition:
+                spill[3] = True
+                self._condition.notify()
+
+    def _read_spill(self, spill: list) -> Optional[bytes]:
+        try:
+            with self._spill_lock:
+                if spill[1] is None or self._spill_file is None:
+                    return None
+                self._spill_file.seek(spill[0])
+                return self._spill_file.read(spill[1])
+        finally:
+            with self._condition:
+                self._unspilling = False
+
+    def keep_alive(self) -> None:
+        """
+        Requests a keepalive, sent by the sender thread once nothing is queued.
+        """
+        if self._keep_alive is None:
+            return
+        with self._condition:
+            self._keep_alive_requested = True
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._queue or (self._spilled and self._spilled[0][3])
+                    or self._keep_alive_requested or self._closed
+                )
+                spill = None
+                if self._queue:
+                    data, queued_at, _ = self._queue.popleft()
+                elif self._spilled and self._spilled[0][3]:
+                    spill = self._spilled.popleft()
+                    data, queued_at = None, spill[2]
+                    self._unspilling = True
+                elif self._keep_alive_requested:
+                    self._keep_alive_requested = False
+                    data = None
+                else:
+                    return
+            if spill is not None:
+                data = self._read_spill(spill)
+                if data is None:
+                    with self._condition:
+                        self.dropped += 1
+                    continue
+            elif data is None:
+                self._send_keep_alive()
+                continue
+            started_at = time.perf_counter()
+            try:
+                self.send(bytes(data))
+            except Exception as e:
+                logger.warning(f"Can't send audio: {e}")
+                self.failed += 1
+            sent_at = time.perf_counter()
+            self.send_latency.observe(sent_at - started_at)
+            self.delay.observe(sent_at - queued_at)
+            self.sent += 1
+
+    def _send_keep_alive(self) -> None:
+        try:
+            self._keep_alive()
+        except Exception as e:
+            logger.warning(f"Can't send keepalive: {e}")
+
+    def depth(self) -> int:
+        """
+        Returns the number of messages waiting to be sent, in memory or spilled.
+        """
+        with self._condition:
+            return len(self._queue) + len(self._spilled)
+
+    def close(self, timeout: float = SEND_CLOSE_TIMEOUT_SEC) -> None:
+        """
+        Stops accepting audio and gives the queued audio `timeout` seconds to be sent. What is
+        still queued then is dropped.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        with self._condition:
+            self.dropped += sum(message[2] for message in self._queue) + len(self._spilled)
+            self._queue.clear()
+            self._spilled.clear()
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth, the frames put, the messages sent and failed, the frames
+        dropped, coalesced and spilled, and the latency percentiles of a send and from queuing to
+        sent, in seconds.
+        """
+        with self._condition:
+            return {
+                "depth": len(self._queue) + len(self._spilled),
+                "max_depth": self.max_depth,
+                "frames": self.frames,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "spilled": self.spilled,
+                "send": self.send_latency.summary(),
+                "delay": self.delay.summary(),
+            }
@@ -0,0 +1,138 @@
+"""
+Headless suggestion server.
+
+Clients connect over WebSocket and stream mono linear16 audio at SAMPLE_RATE as binary messages.
+Every connection gets its own `CallSession`; its transcript and suggestion events are pushed back
+as JSON text messages:
+
+    {"type": "session", "session_id": "call-1"}
+    {"type": "transcript", "final": false, "text": "what hours"}
+    {"type": "suggestion", "transcript": "...", "short_answer": true, "text": "..."}
+    {"type": "speech_started"}  # also "speech_ended", detected locally before any transcript
+
+Clients may also send JSON control messages:
+
+    {"type": "suggest", "short_answer": false}  # suggest an answer for the current utterance
+    {"type": "reset"}  # close the current utterance and start a new one
+    {"type": "metrics", "format": "json"}  # latency by stage, as "json" or "prometheus" text
+
+which is answered with `{"type": "metrics", "format": "json", "data": ...}`. A control message
+that isn't a JSON object of a known type is answered with `{"type": "error", "message": "..."}`,
+and audio messages that aren't a whole number of 16-bit samples are dropped.
+"""
+import asyncio
+import json
+from typing import Optional
+
+import websockets
+from loguru import logger
+
+from src import llm
+from src.constants import SERVER_HOST, SERVER_MAX_MESSAGE_BYTES, SERVER_PORT, CaptureModes
+from src.session import CallSession, SessionManager
+
+
+class SuggestionServer:
+    """
+    WebSocket server running one call session per connection.
+
+    Args:
+        manager (SessionManager, optional): The manager sessions are created with. Defaults to a
+        manager that suggests an answer for every final transcript of the streamed mono audio.
+        host (str): The interface to listen on. Defaults to the value of SERVER_HOST.
+        port (int): The port to listen on. Defaults to the value of SERVER_PORT.
+    """
+
+    def __init__(
+        self,
+        manager: Optional[SessionManager] = None,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT
+    ):
+        self.manager = manager if manager is not None else SessionManager(
+            auto_suggest=True, capture_mode=CaptureModes.Mic
+        )
+        self.host = host
+        self.port = port
+
+    async def handle(self, websocket) -> None:
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def on_event(_: CallSession, event: str, payload: dict) -> None:
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, {"type": event, **payload})
+            except RuntimeError:
+                pass  # the event loop is already closed
+
+        session = await asyncio.to_thread(self.manager.create, on_event=on_event)
+        sender = asyncio.create_task(self._send_events(websocket, events))
+        try:
+            await websocket.send(json.dumps({"type": "session", "session_id": session.session_id}))
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    await asyncio.to_thread(session.feed, message)
+                else:
+                    try:
+                        reply = self._handle_control(session, json.loads(message))
+                    except (ValueError, AttributeError) as e:
+                        logger.warning(f"Invalid control message {message!r}: {e}")
+                        reply = {"type": "error", "message": f"Invalid control message: {e}"}
+                    if reply:
+                        await websocket.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            await asyncio.to_thread(self.manager.close, session.session_id)
+
+    @staticmethod
+    async def _send_events(websocket, events: asyncio.Queue) -> None:
+        while True:
+            await websocket.send(json.dumps(await events.get()))
+
+    @staticmethod
+    def _handle_control(session: CallSession, message: dict) -> Optional[dict]:
+        if message.get("type") == "suggest":
+            session.suggest(
+                session.transcript.final_text(),
+                short_answer=message.get("short_answer", True),
+                temperature=0 if message.get("short_answer", True) else 0.7,
+            )
+        elif message.get("type") == "reset":
+            session.finish_utterance()
+            session.start_utterance()
+        elif message.get("type") == "metrics":
+            if message.get("format") == "prometheus":
+                return {"type": "metrics", "format": "prometheus",
+                        "data": session.tracer.to_prometheus()}
+            return {"type": "metrics", "format": "json", "data": session.tracer.summary()}
+        else:
+            logger.warning(f"Unknown control message: {message}")
+            return {"type": "error", "message": f"Unknown control message: {message.get('type')}"}
+        return None
+
+    async def serve(self) -> None:
+        self.manager.executor.submit(llm.warm_up)
+        async with websockets.serve(
+            self.handle, self.host, self.port, max_size=SERVER_MAX_MESSAGE_BYTES
+        ):
+            logger.info(f"Suggestion server listening on ws://{self.host}:{self.port}")
+            await asyncio.Future()
+
+
+def run_server(host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+    """
+    Runs the headless suggestion server until it is interrupted.
+
+    Args:
+        host (str): The interface to listen on. Defaults to the value of SERVER_HOST.
+        port (int): The port to listen on. Defaults to the value of SERVER_PORT.
+    """
+    server = SuggestionServer(host=host, port=port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.manager.shutdown()
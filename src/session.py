@@ -0,0 +1,537 @@
+"""Per-call state and concurrent call sessions."""
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import itertools
+import threading
+import time
+
+from loguru import logger
+
+from src import llm
+from src.archive import ArchiveMatch, CallArchive
+from src.context import ConversationContext
+from src.constants import (
+    AGENT_CHANNEL,
+    CAPTURE_MODE,
+    SAMPLE_RATE,
+    SESSION_POOL_WORKERS,
+    SPECULATIVE_MODE,
+    SEND_OVERFLOW_POLICY,
+    VAD_GATING,
+    CaptureModes,
+    OverflowPolicies,
+    TranscriptionModes
+)
+from src.sender import AudioSender
+from src.speculation import Speculator
+from src.tracing import TRACER, Trace, Tracer
+from src.transcript import TranscriptBuffer
+from src.vad import SpeechGate, VoiceActivityDetector
+
+
+class CallSession:
+    """
+    Everything that belongs to a single call.
+
+    A session owns its audio source, its live transcription connection, its transcript, the
+    history of finished utterances and the LLM work started for it. Blocking work is run on the
+    `executor`, which is normally shared by all sessions of a `SessionManager`.
+
+    Two-channel audio is dual capture: channel AGENT_CHANNEL is the agent and the other one the
+    caller. Only the caller is written to `transcript`, and so answered; the agent is written to
+    `agent_transcript` and reported as "agent_transcript" events.
+
+    Args:
+        executor (Executor): The executor LLM work is submitted to.
+        transcription_mode (TranscriptionModes): The transcription mode of the call. Defaults to
+        TranscriptionModes.Live.
+        audio_source (optional): The source `record` reads from. It provides
+        `frames(is_recording)`, `sample_rate` and `channels`. Defaults to a `CaptureEngine` on the
+        default microphone, or a `DualCaptureEngine` in dual capture mode.
+        capture_mode (CaptureModes): The capture mode used when no audio source is given. Defaults
+        to the value of CAPTURE_MODE.
+        connect (Callable): Opens a live connection that writes into a transcript, given the
+        transcript, the sample rate and the number of channels of the audio, and for two
+        channels `channel_transcripts`, the transcripts of other channels by index. Defaults to
+        `llm.start_dg_connection`.
+        generate (Callable): Generates an answer from a transcript, a `short_answer` flag, a
+        temperature and the context messages of the earlier turns. Defaults to
+        `llm.generate_answer`.
+        on_event (Callable, optional): Called with the session, the event name ("transcript",
+        "agent_transcript", "suggestion", "speech_started" or "speech_ended") and its payload.
+        auto_suggest (bool): Whether to generate a short answer for every final transcript.
+        speculative (bool): Whether to speculate on interim transcripts. Defaults to the value of
+        SPECULATIVE_MODE.
+        vad_gating (bool): Whether to send only speech for live transcription. Defaults to the
+        value of VAD_GATING.
+        overflow_policy (OverflowPolicies): What happens to captured audio while the send queue
+        is full. Defaults to the value of SEND_OVERFLOW_POLICY.
+        recording_path (str, optional): The file the call's audio is streamed to. The audio is
+        not kept if missing.
+        sample_rate (int): The sample rate of fed audio when the audio source does not provide
+        one. Defaults to the value of SAMPLE_RATE.
+        session_id (str, optional): The identifier of the session. Generated if missing.
+        archive (CallArchive, optional): The archive the call's utterances and answers are
+        stored in, and earlier answers are reused from. Nothing is archived if missing.
+        tracer (Tracer): The tracer utterance latencies are recorded with. Defaults to the shared
+        TRACER.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        executor: Executor,
+        transcription_mode: TranscriptionModes = TranscriptionModes.Live,
+        audio_source: Optional[Any] = None,
+        capture_mode: CaptureModes = CAPTURE_MODE,
+        connect: Callable[[TranscriptBuffer, int, int], Any] = llm.start_dg_connection,
+        generate: Callable[[str, bool, float, list[dict]], str] = llm.generate_answer,
+        on_event: Optional[Callable[["CallSession", str, dict], None]] = None,
+        auto_suggest: bool = False,
+        speculative: bool = SPECULATIVE_MODE,
+        vad_gating: bool = VAD_GATING,
+        overflow_policy: OverflowPolicies = SEND_OVERFLOW_POLICY,
+        recording_path: Optional[str] = None,
+        sample_rate: int = SAMPLE_RATE,
+        session_id: Optional[str] = None,
+        archive: Optional[CallArchive] = None,
+        tracer: Tracer = TRACER
+    ):
+        self.session_id = session_id or f"call-{next(self._ids)}"
+        self.executor = executor
+        self.transcription_mode = transcription_mode
+        self.audio_source = audio_source
+        self.generate = generate
+        self.on_event = on_event
+        self.auto_suggest = auto_suggest
+        self.vad_gating = vad_gating
+        self.overflow_policy = overflow_policy
+        self.recording_path = recording_path
+        self.sample_rate = getattr(audio_source, "sample_rate", None) or sample_rate
+        self.capture_mode = capture_mode
+        self.channels = getattr(audio_source, "channels", None) or (
+            2 if capture_mode == CaptureModes.Dual else 1
+        )
+        self.connection = None
+        self.history = []
+        self.context = ConversationContext(llm.summarize_conversation, executor)
+        self.archive = archive
+        self.call_id = None
+        self.tracer = tracer
+        self.trace = tracer.start()
+        self.transcript = TranscriptBuffer()
+        self.transcript.subscribe(self._on_transcript)
+        self.agent_transcript = TranscriptBuffer()
+        self.agent_transcript.subscribe(self._on_agent_transcript)
+        self.speculator = Speculator(
+            lambda text: generate(text, True, 0, self.context.messages()), submit=executor.submit
+        ) if speculative else None
+        self._connect = connect
+        self._sender = None
+        self._writer = None
+        self._gate = None
+        self._captured_at = None
+        self._utterance_started_at = None
+        self._recorded = threading.Event()
+        self._recorded.set()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def open(self) -> None:
+        """
+        Opens the live transcription connection, if the session transcribes live, and archives
+        the start of the call.
+        """
+        if self.archive:
+            self.call_id = self.archive.start_call(self.session_id)
+        if self.transcription_mode != TranscriptionModes.Live:
+            return
+        if self.channels == 1:
+            self.connection = self._connect(self.transcript, self.sample_rate, self.channels)
+        else:
+            self.connection = self._connect(
+                self.transcript,
+                self.sample_rate,
+                self.channels,
+                channel_transcripts={AGENT_CHANNEL: self.agent_transcript}
+            )
+
+    def is_connected(self) -> bool:
+        return self.connection is None or self.connection.is_connected()
+
+    def feed(self, frame: bytes) -> None:
+        """
+        Forwards a captured frame to the live connection and to the recording file.
+
+        With VAD gating on, only speech (plus a short pre-roll) reaches the live connection. A
+        frame that isn't a whole number of 16-bit samples per channel is logged and dropped.
+        """
+        if len(frame) % (2 * self.channels):
+            logger.warning(
+                f"Dropping a {len(frame)} byte frame of session {self.session_id}: not a whole "
+                f"number of {self.channels} channel 16-bit samples"
+            )
+            return
+        self._captured_at = time.perf_counter()
+        if self.connection is not None:
+            if not self.vad_gating:
+                self._send(frame)
+            else:
+                self._speech_gate().process(frame)
+        if self.recording_path:
+            if self._writer is None:
+                self._writer = self._audio().AudioFileWriter(
+                    self.recording_path, self.sample_rate, self.channels
+                )
+            self._writer.write(frame)
+
+    def _send(self, frame: bytes) -> None:
+        self.trace.mark_once("capture", self._captured_at)
+        self.trace.mark_once("send")
+        self._audio_sender().put(frame)
+
+    def _audio_sender(self) -> AudioSender:
+        # Capture only queues the audio; the network is left to the sender's thread.
+        if self._sender is None:
+            self._sender = AudioSender(
+                lambda data: llm.transcribe_audio_realtime(self.connection, data),
+                getattr(self.connection, "keep_alive", None),
+                policy=self.overflow_policy,
+                name=f"sender-{self.session_id}",
+            )
+        return self._sender
+
+    def _speech_gate(self) -> SpeechGate:
+        if self._gate is None:
+            self._gate = SpeechGate(
+                VoiceActivityDetector(self.sample_rate, self.channels),
+                self._send,
+                self._audio_sender().keep_alive,
+                lambda event: self._emit(event, {}),
+            )
+        return self._gate
+
+    def record(self, is_recording: Callable[[], bool]) -> None:
+        """
+        Records the session's audio source until `is_recording` returns False.
+
+        The recording file, if any, is finalized before this returns.
+        """
+        if self.audio_source is None and self.channels == 2:
+            self.audio_source = self._audio().DualCaptureEngine(sample_rate=self.sample_rate)
+        elif self.audio_source is None:
+            self.audio_source = self._audio().CaptureEngine(sample_rate=self.sample_rate)
+        self._gate = None
+        self._recorded.clear()
+        try:
+            for frame in self.audio_source.frames(is_recording):
+                if not is_recording():
+                    break
+                self.feed(frame)
+        finally:
+            self.close_recording()
+            self._recorded.set()
+            if self._gate is not None:
+                logger.debug(f"Session {self.session_id} speech gate: {self._gate.stats()}")
+
+    @staticmethod
+    def _audio():
+        # Imported on first use so headless sessions never touch the local audio devices.
+        from src import audio  # pylint: disable=import-outside-toplevel
+
+        return audio
+
+    def close_recording(self) -> None:
+        """
+        Finalizes the recording file, if one is open.
+        """
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception as e:
+                logger.error(f"Recording of session {self.session_id} is incomplete: {e}")
+            self._writer = None
+
+    def transcribe_recording(self) -> str:
+        """
+        Waits for the current recording to be finalized and transcribes it.
+
+        Returns:
+            str: The transcribed text.
+        """
+        self._recorded.wait()
+        return llm.transcribe_audio(self.recording_path)
+
+    def start_utterance(self) -> None:
+        self._utterance_started_at = time.time()
+        self.trace = self.tracer.start()
+        self.transcript.clear()
+        self.agent_transcript.clear()
+        if self.speculator:
+            self.speculator.reset()
+
+    def finish_utterance(self) -> str:
+        """
+        Moves the finalized transcript into the history.
+
+        Returns:
+            str: The finalized transcript of the utterance.
+        """
+        text = self.transcript.final_text()
+        self.history.append(text)
+        return text
+
+    def take_trace(self) -> Trace:
+        """
+        Hands the trace of the current utterance over to the work that answers it, and starts a
+        new trace for what is said next.
+
+        Returns:
+            Trace: The trace of the current utterance.
+        """
+        trace, self.trace = self.trace, self.tracer.start()
+        return trace
+
+    def add_answer(self, text: str, turn: Optional[int] = None) -> None:
+        """
+        Adds an answer suggested to the agent to the context, as an assistant turn right after
+        the `turn` it answers, as returned by `take_context`, or as the latest turn if missing.
+        """
+        self.context.add_turn(text, role="assistant", answers=turn)
+
+    def take_context(self, text: str) -> tuple[list[dict], Optional[int]]:
+        """
+        Returns the context of the earlier turns for answering `text`, then adds `text` to it
+        as the latest turn.
+
+        Returns:
+            tuple[list[dict], Optional[int]]: The context messages and the identifier of the
+            turn of `text`, to add its answer with `add_answer`.
+        """
+        messages = self.context.messages()
+        return messages, self.context.add_turn(text)
+
+    def archive_utterance(self, text: str) -> Optional[int]:
+        """
+        Archives an utterance of the call.
+
+        Returns:
+            Optional[int]: The identifier of the archived utterance, or None if the session has
+            no archive.
+        """
+        if self.call_id is None or not text:
+            return None
+        return self.archive.add_utterance(self.call_id, text, self._utterance_started_at)
+
+    def archive_suggestion(
+        self,
+        utterance_id: Optional[int],
+        short_answer: bool,
+        text: str,
+        reusable: bool = True
+    ):
+        """
+        Archives an answer suggested for an utterance archived with `archive_utterance`. An
+        answer generated with the context of earlier turns is not `reusable` on other calls.
+        """
+        if utterance_id is not None:
+            self.archive.add_suggestion(utterance_id, short_answer, text, reusable)
+
+    def recall(self, text: str) -> Optional[ArchiveMatch]:
+        """
+        Returns an earlier utterance close enough to `text` that its answer can be reused, or
+        None if there is none or the session has no archive.
+        """
+        return self.archive.lookup(text) if self.archive else None
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Runs `fn` on the session's executor and tracks it until it is done.
+
+        Raises:
+            RuntimeError: If the session is closed.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Session {self.session_id} is closed")
+            future = self.executor.submit(fn, *args, **kwargs)
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def suggest(
+        self,
+        text: str,
+        short_answer: bool = True,
+        temperature: float = 0,
+        trace: Optional[Trace] = None
+    ) -> Future:
+        """
+        Generates an answer for `text` in the background and emits it as a "suggestion" event.
+
+        The utterance and its answer are archived. The short answer of an archived utterance close
+        enough to `text` is reused instead of generating a new one, and not archived again;
+        otherwise a matching speculative short answer is claimed from the speculator. Answers
+        generated with the context of earlier turns are archived as not reusable, and every answer
+        is added to the context as an assistant turn, after the utterance it answers. The trace,
+        if any, is stamped around the generation and finished once the event has been handed to
+        `on_event`.
+
+        Returns:
+            Future: The future of the generated answer.
+        """
+        context, turn = self.take_context(text)
+        utterance_id = self.archive_utterance(text)
+        recalled = self.recall(text) if short_answer else None
+        speculation = None
+        if self.speculator and short_answer:
+            if recalled:
+                self.speculator.reset()
+            else:
+                speculation = self.speculator.claim(text)
+
+        def generate() -> str:
+            if recalled:
+                return recalled.utterance.short_answer
+            if trace:
+                trace.mark("llm_request")
+            answer = self.generate(text, short_answer, temperature, context)
+            if trace:
+                trace.mark("completion")
+            return answer
+
+        if speculation is None:
+            future = self.submit(generate)
+        else:
+            # Generated, or being generated, from the interim transcript already:
+            future = speculation
+            with self._lock:
+                self._pending.add(future)
+            future.add_done_callback(self._forget)
+
+        def emit(done: Future) -> None:
+            if not done.cancelled() and done.exception() is None:
+                if not recalled:
+                    self.archive_suggestion(utterance_id, short_answer, done.result(), not context)
+                self.add_answer(done.result(), turn)
+                self._emit("suggestion", {
+                    "transcript": text, "short_answer": short_answer, "text": done.result()
+                })
+                if trace:
+                    trace.mark("render")
+                    trace.finish()
+
+        future.add_done_callback(emit)
+        return future
+
+    def _on_transcript(self, is_final: bool, text: str) -> None:
+        if is_final:
+            self.trace.mark("final")
+        else:
+            self.trace.mark_once("interim")
+        self._emit("transcript", {"final": is_final, "text": text})
+        if self.speculator:
+            # Auto suggestions answer every final on its own, so speculate on the result being
+            # transcribed rather than on the whole utterance.
+            self.speculator.observe(text if self.auto_suggest else self.transcript.text())
+        if is_final and self.auto_suggest and not self._closed:
+            self.suggest(text, trace=self.take_trace())
+
+    def _on_agent_transcript(self, is_final: bool, text: str) -> None:
+        self._emit("agent_transcript", {"final": is_final, "text": text})
+
+    def _emit(self, event: str, payload: dict) -> None:
+        if self.on_event:
+            self.on_event(self, event, payload)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def close(self) -> None:
+        """
+        Cancels the session's pending work and closes its live connection.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+        if self.speculator:
+            self.speculator.reset()
+        self.close_recording()
+        if self._sender is not None:
+            self._sender.close()
+            logger.debug(f"Session {self.session_id} send path: {self._sender.stats()}")
+        if self.connection is not None:
+            llm.close_dg_connection(self.connection)
+            if hasattr(self.connection, "stats"):
+                logger.debug(f"Session {self.session_id} connection: {self.connection.stats()}")
+        logger.debug(f"Session {self.session_id} closed")
+
+
+class SessionManager:
+    """
+    Runs many call sessions concurrently on one shared thread pool.
+
+    Args:
+        max_workers (int): The size of the shared thread pool. Defaults to the value of
+        SESSION_POOL_WORKERS.
+        **session_defaults: Default keyword arguments of every created `CallSession`.
+    """
+
+    def __init__(self, max_workers: int = SESSION_POOL_WORKERS, **session_defaults):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session")
+        self.session_defaults = session_defaults
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs) -> CallSession:
+        """
+        Creates and opens a new session.
+
+        Args:
+            **kwargs: Keyword arguments of `CallSession`, overriding the manager's defaults.
+
+        Returns:
+            CallSession: The opened session.
+        """
+        session = CallSession(self.executor, **{**self.session_defaults, **kwargs})
+        session.open()
+        with self._lock:
+            self._sessions[session.session_id] = session
+        logger.debug(f"Session {session.session_id} opened ({len(self)} active)")
+        return session
+
+    def get(self, session_id: str) -> Optional[CallSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session:
+            session.close()
+
+    def shutdown(self) -> None:
+        """
+        Closes every session and stops the shared thread pool.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
@@ -1,26 +1,56 @@
-import textwrap
+from concurrent.futures import Future
+from typing import Callable, Optional
+import sqlite3
 import time
 
 import numpy as np
 import PySimpleGUI as sg
 from loguru import logger
 
-from src import audio, llm
+from src import faq, llm
+from src.archive import CallArchive
+from src.generation import AnswerGenerator, summarize_answer_stats
+from src.render import LagProbe, RenderScheduler
+from src.scheduler import SuggestionScheduler
+from src.session import CallSession, SessionManager
+from src.tracing import TRACER, Trace
 from src.constants import (
+    AnswerStrategies,
     TranscriptionModes,
     APPLICATION_WIDTH,
+    LAG_EVENT,
     OFF_IMAGE,
     ON_IMAGE,
-    OUTPUT_FILE_NAME
+    OUTPUT_FILE_NAME,
+    RENDER_EVENT,
+    STREAM_UPDATE_SEC
 )
 
 
-OUTPUT_AUDIO_FILE = OUTPUT_FILE_NAME
-AUDIO_SAVED = False
-AUDIO_DATA = []
 TRANSCRIPTION_MODE = TranscriptionModes.Live
-CURRENT_TRANSCRIPT = ''
-MESSAGE_HISTORY = []
+SESSIONS = SessionManager()
+SESSION = None
+SCHEDULER = None
+GENERATOR = None
+ANSWERS = None
+SUGGESTED = None  # The transcript of the current utterance that was last suggested for.
+TURN = None  # The context turn of the utterance last suggested for, which its answers follow.
+RENDERER = None
+LAG_PROBE = None
+HISTORY_RENDERED = 0
+WINDOW = None
+# The widgets, built with the window by `build_window`:
+record_status_button = None
+analyzed_text_label = None
+transcribed_message = None
+quick_chat_gpt_answer = None
+full_chat_gpt_answer = None
+message_history = None
+# Events that need the call session, ignored until it is connected:
+SESSION_EVENTS = {
+    "r", "R", "-TOGGLE-RECORDING-", "a", "A", "-RUN-TRANSCRIPTION-", "f", "F", "-LONG-ANSWER-"
+}
+PARTIAL_EVENTS = {True: "-CHAT_GPT SHORT ANSWER PARTIAL-", False: "-CHAT_GPT LONG ANSWER PARTIAL-"}
 
 
 def get_text_area(text: str, size: tuple) -> sg.Text:
@@ -48,143 +78,354 @@ class BtnInfo:
         self.state = state
 
 
-# All the stuff inside your window:
-sg.theme("DarkAmber")  # Add a touch of color
-record_status_button = sg.Button(
-    image_data=OFF_IMAGE,
-    k="-TOGGLE-RECORDING-",
-    border_width=0,
-    button_color=(sg.theme_background_color(), sg.theme_background_color()),
-    disabled_button_color=(sg.theme_background_color(), sg.theme_background_color()),
-    metadata=BtnInfo(),
-    size=(int(APPLICATION_WIDTH * 0.1), 1)
-)
-analyzed_text_label = get_text_area("", size=(int(APPLICATION_WIDTH * 0.3), 2))
-transcribed_message = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
-quick_chat_gpt_answer = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
-full_chat_gpt_answer = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
-message_history = sg.Text('')
-
-layout = [
-    [sg.Column([[
-        sg.Column([
-            [
-                sg.Text("Run transcription: "),
-                record_status_button
-            ]
-        ]),
-        sg.Column([[sg.Text('', size=(int(APPLICATION_WIDTH * 0.1), 0))]]),
-        sg.Column([
+def build_window() -> sg.Window:
+    """
+    Builds the widgets and the layout, and shows the window.
+
+    Called by `run_ui` rather than at import, so importing the module builds nothing.
+
+    Returns:
+        sg.Window: The finalized window, ready to receive events from other threads.
+    """
+    # pylint: disable-next=global-statement
+    global record_status_button, analyzed_text_label, transcribed_message, quick_chat_gpt_answer
+    global full_chat_gpt_answer, message_history  # pylint: disable=global-statement
+
+    # All the stuff inside your window:
+    sg.theme("DarkAmber")  # Add a touch of color
+    record_status_button = sg.Button(
+        image_data=OFF_IMAGE,
+        k="-TOGGLE-RECORDING-",
+        border_width=0,
+        button_color=(sg.theme_background_color(), sg.theme_background_color()),
+        disabled_button_color=(sg.theme_background_color(), sg.theme_background_color()),
+        metadata=BtnInfo(),
+        size=(int(APPLICATION_WIDTH * 0.1), 1)
+    )
+    analyzed_text_label = get_text_area("", size=(int(APPLICATION_WIDTH * 0.3), 2))
+    transcribed_message = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
+    quick_chat_gpt_answer = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
+    full_chat_gpt_answer = get_text_area("", size=(int(APPLICATION_WIDTH * 0.5), 6))
+    message_history = sg.Multiline(
+        '',
+        size=(int(APPLICATION_WIDTH * 0.6), 20),
+        disabled=True,
+        autoscroll=True,
+        border_width=0,
+        background_color=sg.theme_background_color(),
+        text_color="white",
+        expand_y=True
+    )
+
+    layout = [
+        [sg.Column([[
+            sg.Column([
                 [
-                    sg.Text("Suggest response: "),
-                    sg.Button(
-                        'Run',
-                        size=(int(APPLICATION_WIDTH * 0.1), 1),
-                        k="-RUN-TRANSCRIPTION-"
-                    )
+                    sg.Text("Run transcription: "),
+                    record_status_button
                 ]
-        ])
-    ]], element_justification='c', expand_x=True)],
-    [
-        [sg.Text('', size=(int(APPLICATION_WIDTH * 2), 0))],
-        sg.Column([
-            [sg.Text(
-                "Previous messages:", font=('Arial', 18), size=(int(APPLICATION_WIDTH * 0.6), 1)
-            )],
-            [message_history],
-        ], expand_y=True, element_justification='top'),
-        sg.Column([
-            [analyzed_text_label],
-            [sg.Text("Current message:", font=('Arial', 18))],
-            [transcribed_message],
-            [sg.Text("Suggested responses:", font=('Arial', 18))],
-            [sg.Text("Short answer:", font=('Arial', 14))],
-            [quick_chat_gpt_answer],
-            [sg.Text("Full answer:", font=('Arial', 14))],
-            [full_chat_gpt_answer],
-        ], expand_y=True, element_justification='top')
-    ],
-    [sg.Button("Cancel")],
-]
-WINDOW = sg.Window("Keyboard Test", layout, return_keyboard_events=True, use_default_focus=False)
+            ]),
+            sg.Column([[sg.Text('', size=(int(APPLICATION_WIDTH * 0.1), 0))]]),
+            sg.Column([
+                    [
+                        sg.Text("Suggest response: "),
+                        sg.Button(
+                            'Run',
+                            size=(int(APPLICATION_WIDTH * 0.1), 1),
+                            k="-RUN-TRANSCRIPTION-"
+                        ),
+                        sg.Button(
+                            'Full answer',
+                            size=(int(APPLICATION_WIDTH * 0.1), 1),
+                            k="-LONG-ANSWER-"
+                        )
+                    ]
+            ])
+        ]], element_justification='c', expand_x=True)],
+        [
+            [sg.Text('', size=(int(APPLICATION_WIDTH * 2), 0))],
+            sg.Column([
+                [sg.Text(
+                    "Previous messages:",
+                    font=('Arial', 18),
+                    size=(int(APPLICATION_WIDTH * 0.6), 1)
+                )],
+                [message_history],
+            ], expand_y=True, element_justification='top'),
+            sg.Column([
+                [analyzed_text_label],
+                [sg.Text("Current message:", font=('Arial', 18))],
+                [transcribed_message],
+                [sg.Text("Suggested responses:", font=('Arial', 18))],
+                [sg.Text("Short answer:", font=('Arial', 14))],
+                [quick_chat_gpt_answer],
+                [sg.Text("Full answer:", font=('Arial', 14))],
+                [full_chat_gpt_answer],
+            ], expand_y=True, element_justification='top')
+        ],
+        [sg.Button("Cancel")],
+    ]
+    return sg.Window(
+        "Keyboard Test",
+        layout,
+        return_keyboard_events=True,
+        use_default_focus=False,
+        finalize=True
+    )
 
 
 def background_recording_loop() -> None:
-    global AUDIO_SAVED, AUDIO_DATA  # pylint: disable=global-statement
-
-    AUDIO_SAVED = False
-    llm.transcript_queue.clear()
-    AUDIO_DATA = []
-    # stop_recording = audio.record_background(AUDIO_DATA, TRANSCRIPTION_MODE)
-    # while record_status_button.metadata.state:
-    #     time.sleep(0.1)
-    # stop_recording()
-    while record_status_button.metadata.state:
-        audio.record_background(AUDIO_DATA, TRANSCRIPTION_MODE, 1)
-    audio.save_audio_file(AUDIO_DATA, OUTPUT_AUDIO_FILE)
-    AUDIO_SAVED = True
+    SESSION.record(lambda: record_status_button.metadata.state)
 
 
 def background_transcription_loop():
-    global CURRENT_TRANSCRIPT  # pylint: disable=global-statement
-
+    version = SESSION.transcript.version
     while record_status_button.metadata.state:
-        interim_message = None
-        while len(llm.transcript_queue) > 0:
-            sentence = llm.transcript_queue[0]
-            if sentence[0]:
-                interim_message = None
-                llm.transcript_queue.popleft()
-                if not CURRENT_TRANSCRIPT.endswith(' '):
-                    CURRENT_TRANSCRIPT += f" {sentence[1]}"
-                else:
-                    CURRENT_TRANSCRIPT += f"{sentence[1]}"
-
-                transcribed_message.update(CURRENT_TRANSCRIPT)
-            elif not interim_message or interim_message.strip() != sentence[1]:
-                if not CURRENT_TRANSCRIPT.endswith(' '):
-                    interim_message = f" {sentence[1]}"
-                else:
-                    interim_message = f"{sentence[1]}"
-
-                transcribed_message.update(CURRENT_TRANSCRIPT + interim_message)
+        new_version = SESSION.transcript.wait(version, timeout=0.5)
+        if new_version == version:
+            continue
+        version = new_version
+        RENDERER.update(transcribed_message, SESSION.transcript.text())
+
+
+def render_history() -> None:
+    """
+    Appends the utterances added to the session's history since the last call to the history
+    pane, instead of redrawing the whole history.
+    """
+    global HISTORY_RENDERED  # pylint: disable=global-statement
+
+    for text in SESSION.history[HISTORY_RENDERED:]:
+        RENDERER.append(message_history, f"{text}\n\n")
+    HISTORY_RENDERED = len(SESSION.history)
+
+
+def post_result(
+    future: Future,
+    event: str,
+    generation: int,
+    trace: Optional[Trace] = None
+) -> None:
+    """
+    Posts the result of a session's background work to the window once it is done.
+
+    Parameters:
+        future (Future): The background work.
+        event (str): The event that receives the result, the generation and the trace.
+        generation (int): The suggestion generation the work belongs to.
+        trace (Trace, optional): The trace of the utterance the work answers.
+    """
+    def post(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            WINDOW.write_event_value(event, (done.result(), generation, trace))
+
+    future.add_done_callback(post)
+
+
+def archive_result(
+    future: Future,
+    utterance_id: Optional[int],
+    short_answer: bool,
+    reusable: bool
+) -> None:
+    """
+    Archives an answer of the session once it is generated.
+
+    Parameters:
+        future (Future): The answer.
+        utterance_id (int, optional): The archived utterance the answer is for.
+        short_answer (bool): Whether the answer is the short one.
+        reusable (bool): Whether the answer can be reused on other calls.
+    """
+    def archive(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            SESSION.archive_suggestion(utterance_id, short_answer, done.result(), reusable)
+
+    future.add_done_callback(archive)
 
+
+def partial_writer(generation: int) -> Callable[[bool, str], None]:
+    """
+    Returns a callback that streams partial answers into the window while they are generated.
+
+    Partial answers are coalesced so the window receives at most one partial event per answer
+    every STREAM_UPDATE_SEC seconds.
+
+    Parameters:
+        generation (int): The suggestion generation the answers belong to.
+
+    Returns:
+        Callable[[bool, str], None]: Receives whether the text is the short answer, and the text.
+    """
+    last_update = {True: 0.0, False: 0.0}
+
+    def write(short_answer: bool, text: str) -> None:
+        now = time.monotonic()
+        if now - last_update[short_answer] >= STREAM_UPDATE_SEC:
+            WINDOW.write_event_value(PARTIAL_EVENTS[short_answer], (text, generation))
+            last_update[short_answer] = now
+
+    return write
+
+
+def suggest(audio_transcript: str, generation: int) -> None:
+    """
+    Suggests the short and long answers of an utterance.
+
+    Parameters:
+        audio_transcript (str): The transcript of the utterance.
+        generation (int): The suggestion generation the answers belong to.
+    """
+    global ANSWERS, TURN  # pylint: disable=global-statement
+
+    trace = SESSION.take_trace()
+    trace.mark_once("final")
+    context, TURN = SESSION.take_context(audio_transcript)
+    utterance_id = SESSION.archive_utterance(audio_transcript)
+
+    # Generate quick answer, answering commonly asked questions and questions answered on earlier
+    # calls locally:
+    faq_match = faq.FAQ_INDEX.lookup(audio_transcript)
+    recalled = None if faq_match else SESSION.recall(audio_transcript)
+    speculation = None
+    if SESSION.speculator:
+        if faq_match or recalled:
+            SESSION.speculator.reset()
+        else:
+            speculation = SESSION.speculator.claim(audio_transcript)
+        logger.debug(f"Speculation stats: {SESSION.speculator.stats()}")
+
+    if ANSWERS:
+        ANSWERS.cancel()
+    ANSWERS = GENERATOR.answer(
+        audio_transcript,
+        context,
+        partial_writer(generation),
+        trace,
+        short_answered=bool(faq_match or recalled or speculation),
+    )
+    if faq_match or recalled:
+        if faq_match:
+            logger.debug(f"FAQ match ({faq_match.score:.2f}): {faq_match.entry.question}")
+            answer = faq_match.entry.answer.format(scheduling_prompt=llm.get_scheduling_prompt())
+        else:
+            logger.debug(f"Archive match ({recalled.score:.2f}): {recalled.utterance.text}")
+            answer = recalled.utterance.short_answer
+        quick_chat_gpt_answer.update(answer)
+        # Not archived: the answer is stored already, in the archive or in the prompt.
+        SESSION.add_answer(answer, TURN)
+        trace.mark("render")
+        trace.finish()
+    else:
+        quick_chat_gpt_answer.update("Chatgpt is working...")
+        post_result(
+            speculation or ANSWERS.short, "-CHAT_GPT SHORT ANSWER-", generation, trace
+        )
+        archive_result(speculation or ANSWERS.short, utterance_id, True, not context)
+
+    # Generate full answer, at once or once the agent asks for it:
+    if GENERATOR.strategy == AnswerStrategies.OnDemand:
+        full_chat_gpt_answer.update("Press 'f' or 'Full answer' to generate it now.")
+    else:
+        full_chat_gpt_answer.update("Chatgpt is working...")
+    post_result(ANSWERS.long, "-CHAT_GPT LONG ANSWER-", generation)
+    archive_result(ANSWERS.long, utterance_id, False, not context)
+
+
+def open_session() -> CallSession:
+    """
+    Opens the call archive and the call session, and waits for its live connection. Runs off the
+    GUI thread, so the window is interactive while SQLite and Deepgram are set up. The session
+    runs without an archive if it can't be opened.
+
+    Returns:
+        CallSession: The connected session.
+    """
+    try:
+        archive = CallArchive()
+    except sqlite3.Error as e:
+        logger.error(f"Can't open the call archive, calls won't be archived: {e}")
+        archive = None
+    session = SESSIONS.create(
+        transcription_mode=TRANSCRIPTION_MODE, recording_path=OUTPUT_FILE_NAME, archive=archive
+    )
+    while not session.is_connected():
+        logger.debug("Waiting for connection...")
         time.sleep(0.1)
+    return session
 
 
 def run_ui():
-    global CURRENT_TRANSCRIPT  # pylint: disable=global-statement
-
-    if TRANSCRIPTION_MODE == TranscriptionModes.Live:
-        llm.start_dg_connection()
-        while not llm.dg_connection.is_connected():
-            logger.debug("Waiting for connection...")
-            time.sleep(0.1)
+    # pylint: disable-next=global-statement
+    global WINDOW, SESSION, SCHEDULER, GENERATOR, SUGGESTED, RENDERER, LAG_PROBE
+
+    # Show the window first, then import the SDKs and connect in the background:
+    WINDOW = build_window()
+    RENDERER = RenderScheduler(WINDOW.write_event_value)
+    LAG_PROBE = LagProbe(WINDOW.write_event_value)
+    LAG_PROBE.start()
+    analyzed_text_label.update("Connecting...")
+    SESSIONS.executor.submit(llm.warm_up)
+    opening = SESSIONS.executor.submit(open_session)
+    opening.add_done_callback(lambda done: WINDOW.write_event_value("-SESSION OPENED-", done))
 
     while True:
         event, values = WINDOW.read()
         if event in ["Cancel", sg.WIN_CLOSED]:
-            if TRANSCRIPTION_MODE == TranscriptionModes.Live:
-                llm.close_dg_connection()
+            opening.cancel()
+            if ANSWERS:
+                ANSWERS.cancel()
+            SESSIONS.shutdown()
+            if SESSION and SESSION.archive:
+                logger.debug(f"Call archive: {SESSION.archive.stats()}")
+                SESSION.archive.close()
+            logger.debug(f"Latency by stage: {TRACER.to_json()}")
+            logger.debug(f"Answers by strategy: {summarize_answer_stats()}")
+            if SCHEDULER:
+                logger.debug(f"Suggestion scheduling: {SCHEDULER.stats()}")
+            LAG_PROBE.stop()
+            logger.debug(f"Rendering: {RENDERER.stats()}")
+            logger.debug(f"Event loop lag: {LAG_PROBE.stats()}")
             logger.debug("Closing...")
             break
 
-        if event in ("r", "R", "-TOGGLE-RECORDING-"):  # start recording
+        if event == "-SESSION OPENED-":
+            opened = values[event]
+            if opened.cancelled() or opened.exception() is not None:
+                logger.error(f"Can't open the call session: {opened.exception()}")
+                analyzed_text_label.update("Can't connect, restart to retry")
+            else:
+                SESSION = opened.result()
+                SCHEDULER = SuggestionScheduler(SESSION.submit)
+                GENERATOR = AnswerGenerator(SCHEDULER.submit)
+                if SESSION.speculator:
+                    # Speculations share the request budget of the answers:
+                    SESSION.speculator.submit = SCHEDULER.submit
+                analyzed_text_label.update("")
+            continue
+        if SESSION is None and event in SESSION_EVENTS:
+            analyzed_text_label.update("Still connecting...")
+            continue
+
+        if event == RENDER_EVENT:
+            RENDERER.render()
+        elif event == LAG_EVENT:
+            LAG_PROBE.observe(values[event])
+        elif event in ("r", "R", "-TOGGLE-RECORDING-"):  # start recording
             record_status_button.metadata.state = not record_status_button.metadata.state
             if record_status_button.metadata.state:
-                CURRENT_TRANSCRIPT = ''
+                SESSION.start_utterance()
+                SUGGESTED = None
                 WINDOW.perform_long_operation(background_recording_loop)
                 if TRANSCRIPTION_MODE == TranscriptionModes.Live:
                     WINDOW.perform_long_operation(background_transcription_loop)
             else:
-                MESSAGE_HISTORY.append(CURRENT_TRANSCRIPT)
+                SESSION.finish_utterance()
                 if TRANSCRIPTION_MODE == TranscriptionModes.Live:
                     analyzed_text_label.update("Start analyzing...")
                     WINDOW.write_event_value("-TRANSCRIPTION COMPLETE-", None)
 
-                message_history.update('\n\n\n'.join(
-                    [textwrap.fill(m, 150) for m in MESSAGE_HISTORY]
-                ))
+                render_history()
 
             record_status_button.update(
                 image_data=ON_IMAGE if record_status_button.metadata.state else OFF_IMAGE
@@ -199,23 +440,13 @@ def run_ui():
                     image_data=ON_IMAGE if record_status_button.metadata.state else OFF_IMAGE
                 )
 
-                if not AUDIO_SAVED:
-                    audio.save_audio_file(audio_data, OUTPUT_AUDIO_FILE)
-
                 logger.debug("Analyzing audio...")
                 analyzed_text_label.update("Start analyzing...")
-                WINDOW.perform_long_operation(llm.transcribe_audio, "-TRANSCRIPTION COMPLETE-")
+                WINDOW.perform_long_operation(
+                    SESSION.transcribe_recording, "-TRANSCRIPTION COMPLETE-"
+                )
             else:
                 analyzed_text_label.update("Start analyzing...")
-                while len(llm.transcript_queue) > 0:
-                    sentence = llm.transcript_queue[0]
-                    if llm.transcript_queue[0][0]:
-                        llm.transcript_queue.popleft()
-                        if not CURRENT_TRANSCRIPT.endswith(' '):
-                            CURRENT_TRANSCRIPT += f" {sentence[1]}"
-                        else:
-                            CURRENT_TRANSCRIPT += f"{sentence[1]}"
-
                 WINDOW.write_event_value("-TRANSCRIPTION COMPLETE-", None)
 
         elif event == "-TRANSCRIPTION COMPLETE-":
@@ -223,24 +454,42 @@ def run_ui():
                 audio_transcript = values["-TRANSCRIPTION COMPLETE-"]
                 transcribed_message.update(audio_transcript)
             else:
-                audio_transcript = CURRENT_TRANSCRIPT
+                audio_transcript = SESSION.transcript.final_text()
 
             analyzed_text_label.update("...done")
-
-            # Generate quick answer:
-            quick_chat_gpt_answer.update("Chatgpt is working...")
-            WINDOW.perform_long_operation(
-                lambda: llm.generate_answer(audio_transcript, short_answer=True, temperature=0),
-                "-CHAT_GPT SHORT ANSWER-",
-            )
-
-            # Generate full answer:
-            full_chat_gpt_answer.update("Chatgpt is working...")
-            WINDOW.perform_long_operation(
-                lambda: llm.generate_answer(audio_transcript, short_answer=False, temperature=0.7),
-                "-CHAT_GPT LONG ANSWER-",
-            )
+            # Suggesting again for an unchanged transcript would add it to the context and the
+            # archive twice:
+            if audio_transcript == SUGGESTED:
+                logger.debug("The answers of this transcript are already suggested")
+                continue
+            generation = SCHEDULER.begin(audio_transcript)
+            if generation is None:
+                logger.debug("The same suggestion is already being generated")
+            else:
+                SUGGESTED = audio_transcript
+                suggest(audio_transcript, generation)
+        elif event in ("f", "F", "-LONG-ANSWER-"):
+            if ANSWERS and not ANSWERS.long.done():
+                full_chat_gpt_answer.update("Chatgpt is working...")
+                ANSWERS.request_long()
         elif event == "-CHAT_GPT SHORT ANSWER-":
-            quick_chat_gpt_answer.update(values["-CHAT_GPT SHORT ANSWER-"])
+            answer, generation, trace = values[event]
+            if SCHEDULER.is_current(generation):
+                quick_chat_gpt_answer.update(answer)
+                # The short answer is the one the agent answers with; the long one elaborates it.
+                SESSION.add_answer(answer, TURN)
+                if trace:
+                    trace.mark("render")
+                    trace.finish()
+        elif event == "-CHAT_GPT SHORT ANSWER PARTIAL-":
+            answer, generation = values[event]
+            if SCHEDULER.is_current(generation):
+                quick_chat_gpt_answer.update(answer)
         elif event == "-CHAT_GPT LONG ANSWER-":
-            full_chat_gpt_answer.update(values["-CHAT_GPT LONG ANSWER-"])
+            answer, generation, _ = values[event]
+            if SCHEDULER.is_current(generation):
+                full_chat_gpt_answer.update(answer)
+        elif event == "-CHAT_GPT LONG ANSWER PARTIAL-":
+            answer, generation = values[event]
+            if SCHEDULER.is_current(generation):
+                full_chat_gpt_answer.update(answer)
@@ -0,0 +1,130 @@
+"""Speculative answer generation on interim transcripts."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import Callable, Optional
+import threading
+
+from loguru import logger
+
+from src.constants import SPECULATION_MATCH_RATIO, SPECULATION_STABLE_SEC
+
+
+def transcript_similarity(a: str, b: str) -> float:
+    """
+    Returns the word-level similarity of two transcripts in [0, 1], ignoring case.
+    """
+    return SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+class Speculator:
+    """
+    Starts generating an answer once the interim transcript stops changing.
+
+    Every call to `observe` restarts a `stable_sec` timer. When the timer fires, `generate` is
+    submitted in the background for the observed text. `claim` is called with the final
+    transcript and hands back the speculative result if the texts are similar enough and the
+    speculation wasn't cancelled, otherwise the speculation is cancelled (or, if already running,
+    its result is discarded).
+
+    Speculations are submitted with `submit`, which can be replaced once the session's
+    `SuggestionScheduler` exists, so they count against the same in-flight budget as answers.
+
+    Args:
+        generate (Callable[[str], str]): Generates an answer for a transcript.
+        stable_sec (float): How long a hypothesis must stay unchanged before speculating.
+        Defaults to the value of SPECULATION_STABLE_SEC.
+        match_ratio (float): The minimum similarity between the speculated and the final
+        transcript. Defaults to the value of SPECULATION_MATCH_RATIO.
+        submit (Callable[..., Future], optional): Runs a speculation in the background, e.g.
+        `SuggestionScheduler.submit`. Defaults to submitting to a private two-worker thread pool.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str], str],
+        stable_sec: float = SPECULATION_STABLE_SEC,
+        match_ratio: float = SPECULATION_MATCH_RATIO,
+        submit: Optional[Callable[..., Future]] = None
+    ):
+        self.generate = generate
+        self.stable_sec = stable_sec
+        self.match_ratio = match_ratio
+        self.useful = 0
+        self.wasted = 0
+        self.submit = submit or ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="speculation"
+        ).submit
+        self._lock = threading.Lock()
+        self._timer = None
+        self._text = None
+        self._pending = None
+
+    def observe(self, text: str) -> None:
+        """
+        Records the latest transcript hypothesis and restarts the stability timer.
+        """
+        text = text.strip()
+        with self._lock:
+            if not text or text == self._text:
+                return
+            self._text = text
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.stable_sec, self._speculate, args=(text,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _speculate(self, text: str) -> None:
+        with self._lock:
+            if text != self._text or (self._pending and self._pending[0] == text):
+                return
+            self._discard()
+            logger.debug(f"Speculating on: {text}")
+            self._pending = (text, self.submit(self.generate, text))
+
+    def claim(self, final_text: str) -> Optional[Future]:
+        """
+        Returns the speculative answer for the final transcript, if there is a matching one.
+
+        Args:
+            final_text (str): The final transcript.
+
+        Returns:
+            Optional[Future]: The future of the speculative answer, or None.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._text = None
+            if self._pending and not self._pending[1].cancelled() and (
+                transcript_similarity(self._pending[0], final_text) >= self.match_ratio
+            ):
+                future = self._pending[1]
+                self._pending = None
+                self.useful += 1
+                return future
+            self._discard()
+            return None
+
+    def reset(self) -> None:
+        """
+        Cancels the timer and discards any pending speculation.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._text = None
+            self._discard()
+
+    def _cancel_timer(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _discard(self) -> None:
+        if self._pending:
+            self._pending[1].cancel()
+            self._pending = None
+            self.wasted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"useful": self.useful, "wasted": self.wasted}
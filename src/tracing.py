@@ -0,0 +1,188 @@
+"""Per-utterance latency tracing with per-stage histograms."""
+from bisect import bisect_left
+from typing import Optional
+import json
+import threading
+import time
+
+# The stages of an utterance, in the order they happen.
+STAGES = (
+    "capture",  # the first frame sent for the utterance was captured.
+    "send",  # the first frame was sent for transcription.
+    "interim",  # the first interim transcript arrived.
+    "final",  # the last final transcript of the utterance arrived.
+    "llm_request",  # the answer was requested from the LLM.
+    "first_token",  # the first token of the answer arrived.
+    "completion",  # the answer was complete.
+    "render",  # the answer was shown.
+)
+
+# Histogram bucket bounds in seconds: 0.5 ms to about 90 sec, every bucket 1.5 times the last.
+BUCKETS = tuple(0.0005 * 1.5 ** i for i in range(31))
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Observations only increment a bucket counter, so the memory use and the cost of an
+    observation are constant. Percentiles are interpolated within their bucket.
+
+    Args:
+        buckets (tuple[float, ...]): The upper bounds of the buckets in seconds. Defaults to
+        BUCKETS.
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Returns the estimated `q` quantile (between 0 and 1) in seconds, or None if empty.
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, count in enumerate(self.counts):
+                if count and seen + count >= rank:
+                    low = self.buckets[i - 1] if i > 0 else 0.0
+                    high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                    return low + (high - low) * (rank - seen) / count
+                seen += count
+            return self.buckets[-1]
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        """
+        Returns a consistent copy of the bucket counts, the sum and the count.
+        """
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Trace:
+    """
+    Timestamps of a single utterance.
+
+    Stamps are `time.perf_counter()` values. A stage that never happened (e.g. "first_token" for
+    an answer that was not streamed) is simply missing.
+    """
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self.stamps = {}
+        self._finished = False
+
+    def mark(self, stage: str, at: Optional[float] = None) -> None:
+        """
+        Stamps `stage`, replacing an earlier stamp.
+        """
+        self.stamps[stage] = at if at is not None else time.perf_counter()
+
+    def mark_once(self, stage: str, at: Optional[float] = None) -> None:
+        """
+        Stamps `stage` unless it is already stamped.
+        """
+        if stage not in self.stamps:
+            self.mark(stage, at)
+
+    def finish(self) -> None:
+        """
+        Records the trace into its tracer's histograms. Later calls are ignored.
+        """
+        if not self._finished:
+            self._finished = True
+            self.tracer.record(self)
+
+
+class Tracer:
+    """
+    Collects utterance traces into one histogram per stage.
+
+    The latency of a stage is the time since the previous stamped stage of the same trace, and
+    "total" is the time from the first to the last stamp, so a slow suggestion can be attributed
+    to capture, transcription, the LLM or rendering.
+
+    Example:
+        ```python
+        trace = TRACER.start()
+        trace.mark("final")
+        ...
+        trace.mark("render")
+        trace.finish()
+        print(TRACER.to_prometheus())
+        ```
+    """
+
+    def __init__(self, stages: tuple = STAGES):
+        self.stages = stages
+        self.histograms = {stage: LatencyHistogram() for stage in (*stages[1:], "total")}
+
+    def start(self) -> Trace:
+        return Trace(self)
+
+    def record(self, trace: Trace) -> None:
+        stamps = [trace.stamps[stage] for stage in self.stages if stage in trace.stamps]
+        previous = None
+        for stage in self.stages:
+            if stage not in trace.stamps:
+                continue
+            if previous is not None:
+                self.histograms[stage].observe(max(0.0, trace.stamps[stage] - previous))
+            previous = trace.stamps[stage]
+        if len(stamps) > 1:
+            self.histograms["total"].observe(max(0.0, max(stamps) - min(stamps)))
+
+    def summary(self) -> dict:
+        """
+        Returns the count, mean and p50/p95/p99 of every stage, in seconds.
+        """
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary())
+
+    def to_prometheus(self, name: str = "autosuggest_stage_latency_seconds") -> str:
+        """
+        Returns the histograms in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {name} Time since the previous stage of an utterance (total: end to end).",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, histogram in self.histograms.items():
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip((*histogram.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else f"{bound:.6g}"
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        self.histograms = {stage: LatencyHistogram() for stage in self.histograms}
+
+
+TRACER = Tracer()
@@ -0,0 +1,110 @@
+"""Thread-safe transcript shared between the ASR callbacks and its consumers."""
+from typing import Callable, Optional
+import threading
+
+
+class TranscriptBuffer:
+    """
+    Transcript made of finalized segments followed by a single interim tail.
+
+    Producers push finalized and interim results; consumers block in `wait` until the transcript
+    changes instead of polling. Every change bumps `version`, so a consumer that passes the last
+    version it has seen never misses an update. Listeners registered with `subscribe` are called
+    on the producer's thread for every pushed result.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._condition = threading.Condition()
+        self._segments = []
+        self._final_text = ''  # The joined segments, or None until joined again after a change.
+        self._interim = ''
+        self._listeners = []
+
+    def subscribe(self, listener: Callable[[bool, str], None]) -> None:
+        """
+        Registers a callback that receives `(is_final, text)` for every pushed result.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, is_final: bool, text: str) -> None:
+        for listener in self._listeners:
+            listener(is_final, text)
+
+    def push_final(self, text: str) -> None:
+        """
+        Appends a finalized segment, replacing the interim tail.
+        """
+        with self._condition:
+            self._segments.append(text)
+            self._final_text = None
+            self._interim = ''
+            self._changed()
+        self._notify(True, text)
+
+    def push_interim(self, text: str) -> None:
+        """
+        Replaces the interim tail.
+        """
+        with self._condition:
+            if text == self._interim:
+                return
+            self._interim = text
+            self._changed()
+        self._notify(False, text)
+
+    def clear(self) -> None:
+        with self._condition:
+            self._segments = []
+            self._final_text = ''
+            self._interim = ''
+            self._changed()
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._condition.notify_all()
+
+    def wait(self, version: int, timeout: Optional[float] = None) -> int:
+        """
+        Blocks until the transcript is newer than `version` or the timeout expires.
+
+        Args:
+            version (int): The last version the caller has seen.
+            timeout (float, optional): The maximum time to wait in seconds.
+
+        Returns:
+            int: The current version.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def segments(self) -> list[str]:
+        """
+        Returns a copy of the finalized segments.
+        """
+        with self._condition:
+            return list(self._segments)
+
+    def final_text(self) -> str:
+        """
+        Returns the finalized part of the transcript.
+
+        The segments are joined when the text is first read after a change, and the joined text
+        is cached until the next one, so finals that arrive between two reads are never copied.
+        """
+        with self._condition:
+            if self._final_text is None:
+                self._final_text = ' '.join(self._segments)
+            return self._final_text
+
+    def text(self) -> str:
+        """
+        Returns the finalized part of the transcript followed by the interim tail.
+        """
+        with self._condition:
+            final_text = self.final_text()
+            interim = self._interim
+        if final_text and interim:
+            return f"{final_text} {interim}"
+        return final_text or interim
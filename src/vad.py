@@ -0,0 +1,217 @@
+"""Client-side voice activity detection and gating of the audio sent for transcription."""
+from collections import deque
+from typing import Callable, Optional
+import time
+
+import numpy as np
+
+from src.constants import (
+    FRAME_MS,
+    KEEPALIVE_SEC,
+    VAD_HANGOVER_MS,
+    VAD_MARGIN_DB,
+    VAD_MAX_ZCR,
+    VAD_MIN_ENERGY_DB,
+    VAD_PREROLL_MS,
+    VAD_WINDOW_MS
+)
+
+
+def frame_features(samples: np.ndarray, window_samples: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the energy and the zero-crossing rate of consecutive windows of a signal.
+
+    Args:
+        samples (np.ndarray): The int16 samples of a mono signal. A trailing partial window is
+        ignored, unless the signal is shorter than a window, in which case it is one window.
+        window_samples (int): The number of samples per window.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The energy of every window in dBFS and its zero-crossing
+        rate in crossings per sample.
+    """
+    window_samples = max(1, min(window_samples, len(samples)))
+    count = len(samples) // window_samples
+    windows = samples[:count * window_samples].reshape(count, window_samples)
+    windows = windows.astype(np.float32) / 32768
+    energy_db = 10 * np.log10(np.mean(windows * windows, axis=1) + 1e-10)
+    crossings = np.count_nonzero(np.diff(np.signbit(windows), axis=1), axis=1)
+    return energy_db, crossings / window_samples
+
+
+class VoiceActivityDetector:
+    """
+    Energy and zero-crossing voice activity detector with hangover.
+
+    A window is voiced if its energy is `margin_db` above the tracked noise floor (and above
+    `min_energy_db`) and its zero-crossing rate is below `max_zcr`, which rejects broadband hiss.
+    A frame is active while it or one of the frames within `hangover_ms` before it was voiced.
+
+    The noise floor starts at `min_energy_db - margin_db`, drops immediately to quieter frames and
+    rises slowly otherwise (ten times slower during speech), so a call that starts mid-sentence or
+    over steady background noise is still tracked.
+
+    Interleaved multichannel audio is downmixed to mono before it is classified, so a frame is
+    voiced when anyone speaks on any channel.
+
+    Args:
+        sample_rate (int): The sample rate of the audio.
+        channels (int): The number of interleaved channels of the audio. Defaults to 1.
+        window_ms (int): The analysis window. Defaults to the value of VAD_WINDOW_MS.
+        margin_db (float): Defaults to the value of VAD_MARGIN_DB.
+        min_energy_db (float): Defaults to the value of VAD_MIN_ENERGY_DB.
+        max_zcr (float): Defaults to the value of VAD_MAX_ZCR.
+        hangover_ms (int): Defaults to the value of VAD_HANGOVER_MS.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int = 1,
+        window_ms: int = VAD_WINDOW_MS,
+        margin_db: float = VAD_MARGIN_DB,
+        min_energy_db: float = VAD_MIN_ENERGY_DB,
+        max_zcr: float = VAD_MAX_ZCR,
+        hangover_ms: int = VAD_HANGOVER_MS
+    ):
+        self.window_samples = max(1, int(sample_rate * window_ms / 1000))
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.max_zcr = max_zcr
+        self.hangover_sec = hangover_ms / 1000
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.noise_floor_db = min_energy_db - margin_db
+        self._hangover_left = 0.0
+
+    def is_voiced(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Classifies every window of `samples` without updating the detector's state.
+        """
+        return self._classify(*frame_features(self._mono(samples), self.window_samples))
+
+    def _mono(self, samples: np.ndarray) -> np.ndarray:
+        if self.channels == 1:
+            return samples
+        return samples.reshape(-1, self.channels).mean(axis=1).astype(np.int16)
+
+    def _classify(self, energy_db: np.ndarray, zcr: np.ndarray) -> np.ndarray:
+        threshold = max(self.noise_floor_db + self.margin_db, self.min_energy_db)
+        return (energy_db > threshold) & (zcr < self.max_zcr)
+
+    def process(self, samples: np.ndarray) -> bool:
+        """
+        Classifies a frame and updates the noise floor and the hangover.
+
+        Args:
+            samples (np.ndarray): The int16 samples of the frame.
+
+        Returns:
+            bool: Whether the frame is part of speech.
+        """
+        if len(samples) == 0:
+            return self._hangover_left > 0
+        samples = self._mono(samples)
+        energy_db, zcr = frame_features(samples, self.window_samples)
+        voiced = bool(self._classify(energy_db, zcr).any())
+
+        frame_energy_db = float(energy_db.min())
+        if frame_energy_db < self.noise_floor_db:
+            self.noise_floor_db = frame_energy_db
+        else:
+            rate = 0.001 if voiced else 0.01
+            self.noise_floor_db += rate * (frame_energy_db - self.noise_floor_db)
+
+        if voiced:
+            self._hangover_left = self.hangover_sec
+        else:
+            self._hangover_left -= len(samples) / self.sample_rate
+        return voiced or self._hangover_left > 0
+
+
+class SpeechGate:
+    """
+    Forwards only speech to the transcription connection.
+
+    Frames classified as silence are held back in a short pre-roll buffer, which is flushed when
+    speech starts so its onset is not clipped. During silence a keepalive is sent every
+    KEEPALIVE_SEC seconds so the connection stays open. Local "speech_started" and "speech_ended"
+    events are reported through `on_event` as soon as the detector changes state.
+
+    Args:
+        detector (VoiceActivityDetector): The detector frames are classified with.
+        send (Callable[[bytes], None]): Sends a frame for transcription.
+        keep_alive (Callable[[], None], optional): Keeps the connection open during silence.
+        on_event (Callable[[str], None], optional): Receives the speech events.
+        frame_ms (int): The duration of a frame. Defaults to the value of FRAME_MS.
+        preroll_ms (int): The amount of silence sent before speech. Defaults to the value of
+        VAD_PREROLL_MS.
+    """
+
+    def __init__(
+        self,
+        detector: VoiceActivityDetector,
+        send: Callable[[bytes], None],
+        keep_alive: Optional[Callable[[], None]] = None,
+        on_event: Optional[Callable[[str], None]] = None,
+        frame_ms: int = FRAME_MS,
+        preroll_ms: int = VAD_PREROLL_MS
+    ):
+        self.detector = detector
+        self.send = send
+        self.keep_alive = keep_alive
+        self.on_event = on_event
+        self.frames_total = 0
+        self.frames_sent = 0
+        self.speech_segments = 0
+        self._preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+        self._active = False
+        self._last_sent_at = time.monotonic()
+
+    def process(self, frame: bytes) -> bool:
+        """
+        Sends the frame if it is part of speech, otherwise holds it back.
+
+        Returns:
+            bool: Whether the frame is part of speech.
+        """
+        self.frames_total += 1
+        active = self.detector.process(np.frombuffer(frame, dtype=np.int16))
+        if active:
+            if not self._active:
+                self.speech_segments += 1
+                self._emit("speech_started")
+                while self._preroll:
+                    self._send(self._preroll.popleft())
+            self._send(frame)
+        else:
+            if self._active:
+                self._emit("speech_ended")
+            self._preroll.append(bytes(frame))
+            if self.keep_alive and time.monotonic() - self._last_sent_at >= KEEPALIVE_SEC:
+                self.keep_alive()
+                self._last_sent_at = time.monotonic()
+        self._active = active
+        return active
+
+    def _send(self, frame: bytes) -> None:
+        self.send(frame)
+        self.frames_sent += 1
+        self._last_sent_at = time.monotonic()
+
+    def _emit(self, event: str) -> None:
+        if self.on_event:
+            self.on_event(event)
+
+    def stats(self) -> dict:
+        """
+        Returns how much of the audio was suppressed.
+        """
+        return {
+            "frames_total": self.frames_total,
+            "frames_sent": self.frames_sent,
+            "suppressed_fraction": (
+                1 - self.frames_sent / self.frames_total if self.frames_total else 0.0
+            ),
+            "speech_segments": self.speech_segments,
+        }